@@ -0,0 +1,601 @@
+"""PromptVault 存储层基准测试。
+
+生成确定性的合成提示词库（中英混合提示词、标签、模型、缩略图、多版本历史），
+对 PromptVaultStore 的主要读写路径计时，并输出 JSON 结果，便于在不同提交之间对比。
+
+--legacy-thumbnails 另把生成库还原成旧版布局（缩略图内联在 entries.thumbnail_png），
+分别在 migrate_thumbnails() 前后对查询计时，并记录迁移本身的耗时。
+
+用法：
+    python bench_promptvault_store.py --sizes 10000 100000 --output bench_results.json
+    python bench_promptvault_store.py --sizes 100000 --legacy-thumbnails --skip-export
+    python bench_promptvault_store.py --compare old.json new.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from promptvault.db import PromptVaultStore  # noqa: E402
+
+EN_WORDS = [
+    "masterpiece", "best quality", "1girl", "solo", "long hair", "looking at viewer", "smile",
+    "outdoors", "sky", "cloud", "cityscape", "night", "neon lights", "rain", "reflection",
+    "portrait", "upper body", "landscape", "mountain", "forest", "river", "sunset", "golden hour",
+    "cinematic lighting", "depth of field", "bokeh", "ultra detailed", "8k", "photorealistic",
+    "watercolor", "oil painting", "anime style", "concept art", "isometric", "low poly",
+    "cyberpunk", "steampunk", "fantasy", "armor", "sword", "dragon", "castle", "spaceship",
+    "cat", "dog", "flower", "cherry blossoms", "snow", "beach", "ocean", "studio lighting",
+]
+ZH_WORDS = [
+    "杰作", "最佳质量", "少女", "长发", "微笑", "户外", "天空", "云朵", "城市夜景", "霓虹灯",
+    "雨天", "倒影", "人像", "半身像", "风景", "山脉", "森林", "河流", "日落", "电影光效",
+    "景深", "超高细节", "写实", "水彩", "油画", "动漫风格", "概念设计", "赛博朋克", "奇幻",
+    "盔甲", "长剑", "巨龙", "城堡", "飞船", "猫", "小狗", "花朵", "樱花", "雪景", "海滩",
+]
+NEGATIVE_WORDS = [
+    "lowres", "bad anatomy", "bad hands", "text", "error", "missing fingers", "cropped",
+    "worst quality", "low quality", "jpeg artifacts", "signature", "watermark", "blurry",
+    "低质量", "模糊", "水印", "多余手指",
+]
+TAG_POOL = [
+    "人像", "风景", "动漫", "写实", "赛博朋克", "奇幻", "水彩", "油画", "建筑", "夜景",
+    "portrait", "landscape", "anime", "photo", "cyberpunk", "fantasy", "watercolor", "sci-fi",
+    "character", "concept", "product", "food", "animal", "cat", "dog", "flower", "city",
+] + [f"tag{i:03d}" for i in range(300)] + [f"标签{i:03d}" for i in range(150)]
+MODELS = ["SDXL", "FLUX", "Qwen-Image", "Z-Image", "SD1.5", "Pony", "Illustrious"]
+SAMPLERS = ["euler", "euler_ancestral", "dpmpp_2m", "dpmpp_2m_sde", "dpmpp_3m_sde", "uni_pc"]
+SCHEDULERS = ["normal", "karras", "exponential", "sgm_uniform", "simple"]
+
+# (name, search kwargs)；关键词类查询按 _should_prefer_like 的取值分组。
+QUERY_CLASSES = [
+    ("plain_updated", {}),
+    ("sort_score", {"sort": "score_desc"}),
+    ("sort_favorite", {"sort": "favorite_desc"}),
+    ("favorite_only", {"favorite_only": True}),
+    ("has_thumbnail", {"has_thumbnail": True}),
+    ("tag_common", {"tags": ["人像"]}),
+    ("tag_rare", {"tags": ["tag299"]}),
+    ("tag_pair", {"tags": ["portrait", "photo"]}),
+    ("model", {"model": "SDXL"}),
+    ("model_tag", {"model": "FLUX", "tags": ["风景"]}),
+    ("like_cjk_short", {"q": "少女"}),
+    ("like_digit", {"q": "8k"}),
+    ("like_short_en", {"q": "cat"}),
+    ("fts_en", {"q": "cinematic"}),
+    ("fts_en_multi", {"q": "golden hour"}),
+    ("fts_cjk_long", {"q": "赛博朋克城市"}),
+    ("fts_miss", {"q": "nonexistentword"}),
+    ("fts_sort_score", {"q": "landscape", "sort": "score_desc"}),
+    ("trash_plain", {"status": "deleted"}),
+    ("trash_like", {"q": "少女", "status": "deleted"}),
+]
+
+# (name, field, prefix)；每次调用前清空读缓存，计的是查询本身。
+AUTOCOMPLETE_CLASSES = [
+    ("tag_empty", "tag", ""),
+    ("tag_prefix", "tag", "tag1"),
+    ("model_empty", "model", ""),
+    ("model_prefix", "model", "s"),
+    ("title_prefix", "title", "少女"),
+]
+
+
+def _iso(ts):
+    return ts.replace(microsecond=0).isoformat()
+
+
+def _png_chunk(kind, data):
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+
+def encode_png_rgb(width, height, raw_rows):
+    """最小 PNG 编码器（8-bit RGB，无滤波），避免基准依赖 Pillow。"""
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(raw_rows, 1)),
+            _png_chunk(b"IEND", b""),
+        ]
+    )
+
+
+class VaultGenerator:
+    """确定性合成库生成器：同一 seed 总是生成同一批记录。"""
+
+    def __init__(self, seed=20240501, thumbnail_ratio=0.6, thumbnail_size=96, deleted_ratio=0.05):
+        self.seed = int(seed)
+        self.thumbnail_ratio = float(thumbnail_ratio)
+        self.thumbnail_size = int(thumbnail_size)
+        self.deleted_ratio = float(deleted_ratio)
+        self._base_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self._thumb_bases = self._build_thumbnail_bases(16)
+
+    def _build_thumbnail_bases(self, count):
+        rnd = random.Random(self.seed ^ 0x7A11)
+        size = self.thumbnail_size
+        bases = []
+        for _ in range(count):
+            r0, g0, b0 = rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)
+            rows = bytearray()
+            for y in range(size):
+                rows.append(0)
+                for x in range(size):
+                    rows.append((r0 + x + rnd.randrange(8)) & 0xFF)
+                    rows.append((g0 + y + rnd.randrange(8)) & 0xFF)
+                    rows.append((b0 + ((x * y) >> 6)) & 0xFF)
+            bases.append(rows)
+        return bases
+
+    def thumbnail(self, rnd, index):
+        size = self.thumbnail_size
+        rows = bytearray(self._thumb_bases[rnd.randrange(len(self._thumb_bases))])
+        # 每条记录写入唯一像素，保证缩略图内容互不相同。
+        stamp = struct.pack(">Q", (self.seed << 32) ^ index) * 3
+        rows[1 : 1 + len(stamp)] = stamp
+        return encode_png_rgb(size, size, bytes(rows)), size, size
+
+    def _prompt(self, rnd):
+        words = rnd.sample(EN_WORDS, rnd.randint(6, 18))
+        if rnd.random() < 0.6:
+            words += rnd.sample(ZH_WORDS, rnd.randint(2, 8))
+        rnd.shuffle(words)
+        return ", ".join(words)
+
+    def _tags(self, rnd):
+        # 头部标签高频、长尾标签低频，近似真实库中的齐夫分布。
+        count = rnd.randint(1, 6)
+        picked = []
+        for _ in range(count):
+            idx = min(len(TAG_POOL) - 1, int(rnd.paretovariate(1.2)) - 1)
+            picked.append(TAG_POOL[idx])
+        return picked
+
+    def entry(self, index, with_thumbnail=True):
+        rnd = random.Random((self.seed << 24) ^ index)
+        created = self._base_time + timedelta(seconds=index * 37 + rnd.randrange(30))
+        updated = created + timedelta(seconds=rnd.randrange(86400 * 30))
+        positive = self._prompt(rnd)
+        title = positive.split(", ")[0][:24] if rnd.random() < 0.5 else f"{rnd.choice(ZH_WORDS)}{rnd.choice(ZH_WORDS)} {index}"
+        payload = {
+            "id": f"entry_bench_{self.seed:x}_{index:08d}",
+            "title": title,
+            "status": "deleted" if rnd.random() < self.deleted_ratio else "active",
+            "lang": "zh-CN",
+            "tags": self._tags(rnd),
+            "model_scope": [rnd.choice(MODELS)],
+            "variables": {},
+            "fragments": [],
+            "raw": {"positive": positive, "negative": ", ".join(rnd.sample(NEGATIVE_WORDS, rnd.randint(0, 6)))},
+            "params": {
+                "steps": rnd.choice([20, 25, 28, 30, 40]),
+                "cfg": rnd.choice([3.5, 4.0, 5.0, 6.5, 7.0]),
+                "sampler": rnd.choice(SAMPLERS),
+                "scheduler": rnd.choice(SCHEDULERS),
+                "seed": rnd.randrange(2**32),
+            },
+            "favorite": 1 if rnd.random() < 0.08 else 0,
+            "score": float(rnd.choice([0, 0, 0, 1, 2, 3, 4, 5])),
+            "created_at": _iso(created),
+            "updated_at": _iso(updated),
+        }
+        if rnd.random() < self.thumbnail_ratio and with_thumbnail:
+            png, w, h = self.thumbnail(rnd, index)
+            payload["thumbnail_b64"] = base64.b64encode(png).decode("ascii")
+            payload["thumbnail_width"] = w
+            payload["thumbnail_height"] = h
+        return payload
+
+    def revision(self, index, revision):
+        """同一记录的后续版本（标题/评分/标签变化），用于生成版本历史。"""
+        payload = self.entry(index, with_thumbnail=False)
+        rnd = random.Random((self.seed << 24) ^ index ^ (revision << 48))
+        payload["title"] = f"{payload['title']} v{revision + 1}"
+        payload["score"] = float(rnd.randint(0, 5))
+        payload["tags"] = payload["tags"] + self._tags(rnd)[:1]
+        return payload
+
+    def new_payload(self, index):
+        """create_entry 形式的载荷（缩略图为原始 PNG 字节）。"""
+        payload = self.entry(index)
+        payload.pop("id", None)
+        thumb_b64 = payload.pop("thumbnail_b64", "")
+        if thumb_b64:
+            payload["thumbnail_png"] = base64.b64decode(thumb_b64)
+        return payload
+
+
+def seed_vault(store, generator, size, chunk_size=2000, version_ratio=0.2, max_revisions=3, progress=None):
+    """通过 import_bundle 分块灌入数据，并为一部分记录追加历史版本。"""
+    for start in range(0, size, chunk_size):
+        end = min(size, start + chunk_size)
+        store.import_bundle({"entries": [generator.entry(i) for i in range(start, end)]})
+        if progress:
+            progress("seed", end, size)
+    rnd = random.Random(generator.seed ^ 0x5EED)
+    revised = [i for i in range(size) if rnd.random() < version_ratio]
+    for revision in range(1, max_revisions + 1):
+        batch = [i for i in revised if (i + revision) % max_revisions != 0 or revision == 1]
+        for start in range(0, len(batch), chunk_size):
+            part = batch[start : start + chunk_size]
+            store.import_bundle({"entries": [generator.revision(i, revision) for i in part]})
+        if progress:
+            progress("versions", revision, max_revisions)
+
+
+def _summarize(op, size, samples, **extra):
+    ordered = sorted(samples)
+    if len(ordered) >= 2:
+        q = statistics.quantiles(ordered, n=20, method="inclusive")
+        p50, p95 = statistics.median(ordered), q[18]
+    else:
+        p50 = p95 = ordered[0]
+    result = {
+        "op": op,
+        "size": size,
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+    result.update(extra)
+    return result
+
+
+def _time_calls(fn, repeat):
+    samples = []
+    value = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        value = fn(i)
+        samples.append(time.perf_counter() - t0)
+    return samples, value
+
+
+def _db_size_bytes(path):
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            total += os.path.getsize(path + suffix)
+        except OSError:
+            pass
+    return total
+
+
+def _table_sizes(path):
+    conn = sqlite3.connect(path)
+    try:
+        try:
+            rows = conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        return {name: int(size) for name, size in rows}
+    finally:
+        conn.close()
+
+
+def _time_queries(store, size, repeat, prefix=""):
+    """对 QUERY_CLASSES 逐类计时 search_entries / count_entries，op 名前加 prefix。"""
+    results = []
+    for name, kwargs in QUERY_CLASSES:
+        query = kwargs.get("q", "")
+        prefer_like = PromptVaultStore._should_prefer_like(query) if query else None
+        search_kwargs = dict(kwargs)
+        search_kwargs.setdefault("limit", 50)
+        samples, items = _time_calls(lambda _i: store.search_entries(**search_kwargs), repeat)
+        results.append(_summarize(f"{prefix}search:{name}", size, samples, prefer_like=prefer_like, hits=len(items)))
+        count_kwargs = {k: v for k, v in kwargs.items() if k != "sort"}
+        samples, total = _time_calls(lambda _i: store.count_entries(**count_kwargs), repeat)
+        results.append(_summarize(f"{prefix}count:{name}", size, samples, prefer_like=prefer_like, total=total))
+    return results
+
+
+def _inline_thumbnails(db_path):
+    """把库还原成旧版布局：缩略图内联在 entries.thumbnail_png，没有内容哈希，去重表为空。"""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            """
+            UPDATE entries SET has_thumbnail = 0, thumbnail_hash = NULL,
+              thumbnail_png = (SELECT data FROM thumbnail_blobs b WHERE b.blob_hash = entries.thumbnail_hash)
+            WHERE thumbnail_hash IS NOT NULL
+            """
+        )
+        conn.executescript(
+            """
+            DELETE FROM thumbnail_renditions;
+            DELETE FROM thumbnail_phashes;
+            DELETE FROM thumbnail_placeholders;
+            DELETE FROM thumbnail_blobs;
+            DELETE FROM meta WHERE key = 'thumbnail_table_version';
+            """
+        )
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def run_legacy_thumbnails(size, args, workdir, seeded_path, log):
+    """旧版内联缩略图库：迁移前查询计时、migrate_thumbnails() 计时、迁移后再计时。"""
+    db_path = os.path.join(workdir, f"legacy-{size}-{args.seed}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    shutil.copyfile(seeded_path, db_path)
+    _inline_thumbnails(db_path)
+    store = PromptVaultStore(db_path=db_path)
+    results = [{"op": "legacy:db_size", "size": size, "bytes": _db_size_bytes(db_path)}]
+    results.extend(_time_queries(store, size, args.repeat, prefix="legacy:"))
+
+    log(f"  [{size}] migrate_thumbnails")
+    samples, summary = _time_calls(lambda _i: store.migrate_thumbnails(), 1)
+    results.append(
+        _summarize(
+            "legacy:migrate_thumbnails",
+            size,
+            samples,
+            moved=summary["moved"],
+            deduplicated=summary["deduplicated"],
+            bytes=summary["bytes"],
+            batches=summary["batches"],
+        )
+    )
+    results.extend(_time_queries(store, size, args.repeat, prefix="migrated:"))
+    results.append({"op": "migrated:db_size", "size": size, "bytes": _db_size_bytes(db_path)})
+    return results
+
+
+def run_size(size, args, workdir, log):
+    generator = VaultGenerator(
+        seed=args.seed,
+        thumbnail_ratio=args.thumbnail_ratio,
+        thumbnail_size=args.thumbnail_size,
+    )
+    seeded_path = os.path.join(workdir, f"vault-{size}-{args.seed}.db")
+    results = []
+    if not os.path.exists(seeded_path):
+        t0 = time.perf_counter()
+        seed_store = PromptVaultStore(db_path=seeded_path)
+        last = [0.0]
+
+        def _progress(stage, done, total):
+            now = time.perf_counter()
+            if now - last[0] > 5 or done == total:
+                last[0] = now
+                log(f"  [{size}] {stage} {done}/{total}")
+
+        seed_vault(seed_store, generator, size, chunk_size=args.chunk_size, progress=_progress)
+        conn = sqlite3.connect(seeded_path)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        results.append(_summarize("seed_vault", size, [time.perf_counter() - t0]))
+
+    db_path = os.path.join(workdir, f"work-{size}-{args.seed}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    shutil.copyfile(seeded_path, db_path)
+    store = PromptVaultStore(db_path=db_path)
+    results.append(
+        {
+            "op": "db_size",
+            "size": size,
+            "bytes": _db_size_bytes(db_path),
+            "tables": _table_sizes(db_path),
+        }
+    )
+    repeat = args.repeat
+
+    results.extend(_time_queries(store, size, repeat))
+
+    samples, _ = _time_calls(lambda _i: store.search_entries(limit=50, offset=min(size, 5000)), repeat)
+    results.append(_summarize("search:deep_offset", size, samples))
+
+    for name, field, prefix in AUTOCOMPLETE_CLASSES:
+
+        def _autocomplete(_i, field=field, prefix=prefix):
+            store._invalidate_read_caches()
+            return store.autocomplete(field, prefix)
+
+        samples, items = _time_calls(_autocomplete, repeat)
+        results.append(_summarize(f"autocomplete:{name}", size, samples, hits=len(items)))
+
+    created_ids = []
+
+    def _create(i):
+        entry = store.create_entry(generator.new_payload(size + i))
+        created_ids.append(entry["id"])
+        return entry
+
+    samples, _ = _time_calls(_create, args.write_ops)
+    results.append(_summarize("create_entry", size, samples))
+
+    batch_payloads = [generator.new_payload(size + args.write_ops + j) for j in range(args.write_ops)]
+    samples, batch = _time_calls(lambda _i: store.create_entries(batch_payloads), 1)
+    results.append(
+        _summarize(
+            "create_entries",
+            size,
+            samples,
+            batch=args.write_ops,
+            entries_per_sec=round(batch["created"] / samples[0], 1) if samples[0] else None,
+        )
+    )
+
+    rnd = random.Random(args.seed ^ 0xA11)
+    update_targets = [generator.entry(rnd.randrange(size), with_thumbnail=False)["id"] for _ in range(args.write_ops)]
+
+    def _update(i):
+        entry = store.get_entry(update_targets[i])
+        return store.update_entry(
+            entry["id"],
+            {"version": entry["version"], "title": f"{entry['title']} edited", "tags": entry["tags"] + ["bench"]},
+        )
+
+    samples, _ = _time_calls(_update, args.write_ops)
+    results.append(_summarize("update_entry", size, samples))
+
+    def _toggle_favorite(i):
+        entry = store.get_entry(update_targets[i])
+        return store.update_entry(entry["id"], {"version": entry["version"], "favorite": 0 if entry["favorite"] else 1})
+
+    samples, _ = _time_calls(_toggle_favorite, args.write_ops)
+    results.append(_summarize("update_entry:favorite", size, samples))
+
+    samples, _ = _time_calls(lambda i: store.delete_entry(created_ids[i]), min(len(created_ids), args.write_ops))
+    results.append(_summarize("delete_entry", size, samples))
+
+    samples, _ = _time_calls(lambda i: store.list_entry_versions(update_targets[i]), args.write_ops)
+    results.append(_summarize("list_entry_versions", size, samples))
+
+    if not args.skip_export:
+        samples, bundle = _time_calls(lambda _i: store.export_bundle(), 1)
+        results.append(_summarize("export_bundle", size, samples, entries=len(bundle["entries"])))
+        samples, csv_text = _time_calls(lambda _i: store.export_bundle_csv(), 1)
+        results.append(_summarize("export_bundle_csv", size, samples, bytes=len(csv_text)))
+        del csv_text
+
+        import_path = os.path.join(workdir, f"import-{size}-{args.seed}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(import_path + suffix):
+                os.remove(import_path + suffix)
+        import_store = PromptVaultStore(db_path=import_path)
+        samples, summary = _time_calls(lambda _i: import_store.import_bundle(bundle), 1)
+        results.append(_summarize("import_bundle:fresh", size, samples, created=summary["created"]))
+        samples, summary = _time_calls(lambda _i: import_store.import_bundle(bundle), 1)
+        results.append(_summarize("import_bundle:merge", size, samples, updated=summary["updated"]))
+        del bundle, summary
+
+    samples, purged = _time_calls(lambda _i: store.purge_deleted_entries(), 1)
+    results.append(_summarize("purge_deleted_entries", size, samples, purged=purged))
+    results.append({"op": "db_size:after", "size": size, "bytes": _db_size_bytes(db_path)})
+    if args.legacy_thumbnails:
+        results.extend(run_legacy_thumbnails(size, args, workdir, seeded_path, log))
+    return results
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare_results(old_path, new_path, threshold=0.2):
+    """按 (op, size) 对比两次结果的 p50，返回是否存在超过阈值的回退。"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    old_map = {(r["op"], r["size"]): r for r in old.get("results", []) if "p50_ms" in r}
+    regressed = False
+    print(f"{'op':<32} {'size':>9} {'old p50':>10} {'new p50':>10} {'ratio':>7}")
+    for r in new.get("results", []):
+        key = (r["op"], r["size"])
+        if "p50_ms" not in r or key not in old_map:
+            continue
+        before = old_map[key]["p50_ms"]
+        after = r["p50_ms"]
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- regression"
+            regressed = True
+        print(f"{r['op']:<32} {r['size']:>9} {before:>10.3f} {after:>10.3f} {ratio:>7.2f}{flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000])
+    parser.add_argument("--seed", type=int, default=20240501)
+    parser.add_argument("--repeat", type=int, default=15, help="每个查询类的重复次数")
+    parser.add_argument("--write-ops", type=int, default=100, help="create/update/delete 的计时次数")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--thumbnail-ratio", type=float, default=0.6)
+    parser.add_argument("--thumbnail-size", type=int, default=96)
+    parser.add_argument("--skip-export", action="store_true", help="跳过 export/import（大库时很耗内存）")
+    parser.add_argument(
+        "--legacy-thumbnails", action="store_true", help="另测旧版内联缩略图库在 migrate_thumbnails() 前后的查询"
+    )
+    parser.add_argument("--workdir", default="", help="缓存生成库的目录，默认使用临时目录")
+    parser.add_argument("--output", default="", help="结果 JSON 路径，默认输出到 stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两份结果文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="--compare 判定回退的比例阈值")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare_results(args.compare[0], args.compare[1], args.threshold) else 0
+
+    def log(msg):
+        print(msg, file=sys.stderr, flush=True)
+
+    cleanup = not args.workdir
+    workdir = args.workdir or tempfile.mkdtemp(prefix="promptvault-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    try:
+        for size in args.sizes:
+            log(f"== size {size} ==")
+            results.extend(run_size(size, args, workdir, log))
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "git_revision": _git_revision(),
+            "created_at": datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "write_ops": args.write_ops,
+            "thumbnail_ratio": args.thumbnail_ratio,
+            "thumbnail_size": args.thumbnail_size,
+            "legacy_thumbnails": args.legacy_thumbnails,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        log(f"results written to {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""保存节点缩略图生成的微基准。
+
+对常见出图分辨率，比较旧路径（整图截断量化 → LANCZOS 缩放 → PNG optimize）与
+promptvault.thumbnails 的快速路径（浮点域块平均缩小 → 小图量化 → LANCZOS → 低压缩级别 PNG）
+的耗时与体积，并以旧路径的输出为基准计算快速路径的 PSNR / 最大像素差。
+
+源图默认由 --image 指定的图片（缺省为仓库里的 demo.png）缩放到各分辨率得到，再叠加少量噪声
+模拟生成图的细节；不可用时退回确定性的合成渐变图。
+
+用法：
+    python bench_thumbnails.py --resolutions 512x512 1024x1024 832x1216 2048x2048
+"""
+
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from promptvault.thumbnails import encode_png_thumbnail, float_image_to_uint8  # noqa: E402
+
+THUMBNAIL_WIDTH = 256
+
+
+def reference_thumbnail_png(arr, target_width=THUMBNAIL_WIDTH):
+    """旧实现：整图截断、量化后再缩放，PNG optimize=True。"""
+    arr = np.clip(arr, 0.0, 1.0)
+    arr = (arr * 255.0).round().astype(np.uint8)
+    img = Image.fromarray(arr, mode="RGB")
+    w, h = img.size
+    if w != target_width:
+        img = img.resize((target_width, max(1, int(round(h * (target_width / float(w)))))), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+def fast_thumbnail_png(arr, target_width=THUMBNAIL_WIDTH):
+    return encode_png_thumbnail(float_image_to_uint8(arr, max_width=target_width * 2), target_width)[0]
+
+
+def make_source(width, height, image_path, seed):
+    rng = np.random.default_rng(seed)
+    if image_path and Path(image_path).exists():
+        with Image.open(image_path) as img:
+            base = np.asarray(img.convert("RGB").resize((width, height), Image.Resampling.BICUBIC), dtype=np.float32)
+        arr = base / 255.0
+    else:
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        arr = np.stack(
+            [np.sin(x / 37.0) * 0.5 + 0.5, np.cos(y / 53.0) * 0.5 + 0.5, ((x + y) % 97) / 97.0], axis=-1
+        )
+    arr += rng.normal(0.0, 0.01, arr.shape).astype(np.float32)
+    return arr.astype(np.float32)
+
+
+def _decode(png_bytes):
+    with Image.open(io.BytesIO(png_bytes)) as img:
+        return np.asarray(img.convert("RGB"), dtype=np.float64)
+
+
+def _psnr(a, b):
+    mse = float(np.mean((a - b) ** 2))
+    return float("inf") if mse == 0 else 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def _time(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return result, samples
+
+
+def run(resolutions, repeat, image_path, seed):
+    results = []
+    for width, height in resolutions:
+        arr = make_source(width, height, image_path, seed)
+        ref_png, ref_ms = _time(lambda: reference_thumbnail_png(arr), repeat)
+        fast_png, fast_ms = _time(lambda: fast_thumbnail_png(arr), repeat)
+        ref_img, fast_img = _decode(ref_png), _decode(fast_png)
+        if ref_img.shape != fast_img.shape:
+            raise AssertionError(f"thumbnail size mismatch: {ref_img.shape} vs {fast_img.shape}")
+        results.append(
+            {
+                "resolution": f"{width}x{height}",
+                "reference_ms": round(statistics.median(ref_ms), 2),
+                "fast_ms": round(statistics.median(fast_ms), 2),
+                "speedup": round(statistics.median(ref_ms) / statistics.median(fast_ms), 2),
+                "reference_bytes": len(ref_png),
+                "fast_bytes": len(fast_png),
+                "psnr_db": round(_psnr(ref_img, fast_img), 2),
+                "max_abs_diff": int(np.max(np.abs(ref_img - fast_img))),
+            }
+        )
+    return results
+
+
+def _parse_resolution(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--resolutions", nargs="+", default=["512x512", "1024x1024", "832x1216", "1216x832", "2048x2048"]
+    )
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--image", default=str(Path(__file__).resolve().parent / "demo.png"))
+    parser.add_argument("--seed", type=int, default=20240501)
+    parser.add_argument("--output", default="", help="结果 JSON 路径，默认输出到 stdout")
+    args = parser.parse_args(argv)
+
+    results = run([_parse_resolution(r) for r in args.resolutions], args.repeat, args.image, args.seed)
+    text = json.dumps({"thumbnail_width": THUMBNAIL_WIDTH, "results": results}, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
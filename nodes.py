@@ -1,11 +1,11 @@
 import asyncio
-import io
 import json
 import logging
 import os
 import re
 import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 logger = logging.getLogger("PromptVault")
@@ -17,9 +17,22 @@ from .promptvault.assemble import assemble_entry
 from .promptvault.db import PromptVaultStore
 from .promptvault.image_metadata import extract_comfyui_metadata
 from .promptvault.llm import LLMClient, normalize_config
-
-
-def _make_thumbnail_png(image_tensor, target_width=256):
+from .promptvault.paths import get_data_dir
+from .promptvault.save_queue import SaveQueue, SaveQueueFull
+from .promptvault.thumbnails import (
+    contact_sheet,
+    encode_png_thumbnail,
+    encode_webp_renditions,
+    float_image_to_uint8,
+)
+
+
+def _image_to_array(image_tensor, max_width=None):
+    """取批次中的第一张图，转成 uint8 的 HWC RGB 数组。
+
+    给定 max_width 时先按整数倍做块平均缩小到不小于 max_width 的宽度，
+    异步保存只需把这份小图写入队列，缩略图编码留给后台线程。
+    """
     if image_tensor is None:
         raise ValueError("image is required")
 
@@ -29,26 +42,61 @@ def _make_thumbnail_png(image_tensor, target_width=256):
     if getattr(t, "ndim", None) != 3:
         raise ValueError("image tensor must be HWC or BHWC")
 
-    arr = t.detach().cpu().numpy()
-    arr = np.clip(arr, 0.0, 1.0)
-    if arr.shape[-1] == 1:
-        arr = np.repeat(arr, 3, axis=2)
-    elif arr.shape[-1] > 3:
-        arr = arr[:, :, :3]
+    return float_image_to_uint8(t.detach().cpu().numpy(), max_width=max_width)
+
+
+def _thumbnail_png_from_array(arr, target_width=256):
+    return encode_png_thumbnail(arr, target_width=target_width)
 
-    arr = (arr * 255.0).round().astype(np.uint8)
-    img = Image.fromarray(arr, mode="RGB")
-    w, h = img.size
-    if w <= 0 or h <= 0:
-        raise ValueError("invalid image size")
 
-    if w != target_width:
-        new_h = max(1, int(round(h * (target_width / float(w)))))
-        img = img.resize((target_width, new_h), Image.Resampling.LANCZOS)
+def _make_thumbnail_png(image_tensor, target_width=256):
+    # 先在浮点域缩到不小于 2 倍目标宽度，再量化、LANCZOS，与异步保存路径的输出一致
+    arr = _image_to_array(image_tensor, max_width=target_width * 2)
+    return _thumbnail_png_from_array(arr, target_width=target_width)
+
 
-    out = io.BytesIO()
-    img.save(out, format="PNG", optimize=True)
-    return out.getvalue(), img.size[0], img.size[1]
+def _image_batch_to_array(image_tensor, max_width=None):
+    """把整批图像一次转成 uint8 的 NHWC RGB 数组，块平均缩小在整批上一起完成。"""
+    if image_tensor is None:
+        raise ValueError("image is required")
+    if getattr(image_tensor, "ndim", None) not in (3, 4):
+        raise ValueError("image tensor must be HWC or BHWC")
+    arr = image_tensor.detach().cpu().numpy()
+    if arr.ndim == 3:
+        arr = arr[None]
+    return float_image_to_uint8(arr, max_width=max_width)
+
+
+def _source_max_width(store):
+    """缩略图（2 倍目标宽度）与 WebP 副本最大尺寸中较大者，作为张量转换时块平均缩小的下限宽度。
+
+    同步、后台和批量保存都用它，保证各条路径生成的副本尺寸一致。
+    """
+    try:
+        sizes = [int(size) for size in store.get_settings().get("thumbnail_webp_sizes") or []]
+    except Exception:
+        sizes = []
+    return max([THUMBNAIL_WIDTH * 2, *sizes])
+
+
+def _webp_renditions(store, image_tensor=None, arr=None):
+    """按存储设置生成多尺寸 WebP 副本；失败只记日志，副本之后可由 convert-thumbnails 补齐。"""
+    try:
+        settings = store.get_settings()
+        sizes = settings.get("thumbnail_webp_sizes") or []
+        if not sizes:
+            return []
+        if arr is None:
+            arr = _image_to_array(image_tensor, max_width=max(sizes))
+        return encode_webp_renditions(
+            Image.fromarray(arr, mode="RGB"),
+            sizes=sizes,
+            quality=settings.get("thumbnail_webp_quality", 80),
+            lossless=settings.get("thumbnail_webp_lossless", False),
+        )
+    except Exception as exc:
+        logger.warning("PromptVault WebP thumbnail renditions skipped: %s", exc)
+        return []
 
 
 def _linked_node_id(value):
@@ -867,6 +915,8 @@ class PromptVaultSaveNode:
                 "negative_prompt": ("STRING", {"default": "", "multiline": True}),
                 "llm_generate": ("BOOLEAN", {"default": cls._default_llm_generate_enabled()}),
                 "llm_generate_mode": (["auto", "title_only", "tags_only", "title_and_tags"], {"default": "title_and_tags"}),
+                "save_mode": (["blocking", "async"], {"default": "blocking"}),
+                "batch_mode": (BATCH_MODES, {"default": "first"}),
             },
             "hidden": {
                 "prompt": "PROMPT",
@@ -890,97 +940,73 @@ class PromptVaultSaveNode:
         negative_prompt="",
         llm_generate=False,
         llm_generate_mode="auto",
+        save_mode="blocking",
+        batch_mode="first",
         auto_generate=None,
         auto_generate_mode=None,
         prompt=None,
         extra_pnginfo=None,
     ):
-        try:
-            thumb_png, thumb_w, thumb_h = _make_thumbnail_png(image, target_width=256)
-        except Exception as exc:
-            return ("", f"保存失败: 缩略图处理错误: {exc}")
-       
-        # Prefer PNG metadata, then fallback to current workflow prompt.
-        prompt_from_png = _extract_prompt_from_pnginfo(extra_pnginfo)
-        data = _extract_generation_data(prompt_from_png or prompt)
-        workflow_data = _extract_from_workflow(extra_pnginfo)
-        for key, value in workflow_data.items():
-            if value not in (None, "", 0):
-                data[key] = value
-        png_meta_data = _extract_generation_data_from_pnginfo(extra_pnginfo)
-        for key, value in png_meta_data.items():
-            if value not in (None, "", 0):
-                data[key] = value
-        image_meta_data, image_meta_paths = _extract_from_source_image_metadata(prompt, extra_pnginfo)
-        for key, value in image_meta_data.items():
-            if value not in (None, "", 0):
-                data[key] = value
-    
-        _debug_dump_png_meta(
-            extra_pnginfo,
-            prompt_from_png,
-            png_meta_data,
-            workflow_data,
-            image_meta_data,
-            image_meta_paths,
-            data,
-        )
-        positive = str(positive_prompt or "").strip() or data.get("positive", "")
-        negative = str(negative_prompt or "").strip() or data.get("negative", "")
         effective_llm_generate = bool(auto_generate) if auto_generate is not None else bool(llm_generate)
         effective_llm_generate_mode = (
             str(auto_generate_mode or "auto")
             if auto_generate_mode is not None
             else str(llm_generate_mode or "auto")
         )
-        if not str(positive or "").strip():
-            return ("", "保存失败: 未提取到正向提示词，请确认输入图像或工作流元数据")
-        fallback5 = _first_five_chars(positive)
+        inputs = {
+            "title": title,
+            "tags": tags,
+            "model": model,
+            "positive_prompt": positive_prompt,
+            "negative_prompt": negative_prompt,
+            "llm_generate": effective_llm_generate,
+            "llm_generate_mode": effective_llm_generate_mode,
+            "prompt": prompt,
+            "extra_pnginfo": extra_pnginfo,
+        }
 
-        final_title = (title or "").strip()
-        tag_list = [t.strip() for t in (tags or "").split(",") if t.strip()]
+        if batch_mode not in BATCH_MODES[1:]:
+            batch_mode = "first"
 
-        final_title, tag_list, llm_changed = _maybe_auto_fill_with_llm(
-            final_title,
-            tag_list,
-            positive,
-            negative,
-            effective_llm_generate,
-            effective_llm_generate_mode,
-        )
+        if save_mode == "async":
+            queued = _enqueue_save(image, inputs, batch_mode)
+            if queued is not None:
+                return queued
+            # 队列已满或写入失败时退回同步保存，不丢记录
 
-        if not final_title:
-            final_title = fallback5 or "未命名"
-        if not tag_list and fallback5:
-            tag_list = [fallback5]
-
-        model_list = [m.strip() for m in (model or "").split(",") if m.strip()]
-        auto_model = data.get("model_name", "").strip()
-        if not model_list and auto_model:
-            model_list = [auto_model]
-
-        payload = {
-            "title": final_title,
-            "tags": tag_list,
-            "model_scope": model_list,
-            "raw": {
-                "positive": positive,
-                "negative": negative,
-            },
-            "params": {
-                "steps": data.get("steps", 20),
-                "cfg": data.get("cfg", 7.0),
-                "sampler": data.get("sampler", "euler"),
-                "scheduler": data.get("scheduler", "normal"),
-                "seed": data.get("seed", 0),
-            },
-            "thumbnail_png": thumb_png,
-            "thumbnail_width": thumb_w,
-            "thumbnail_height": thumb_h,
-        }
+        if batch_mode != "first":
+            try:
+                store = PromptVaultStore.get()
+            except Exception as exc:
+                return ("", f"保存失败: {exc}")
+            try:
+                arr = _image_batch_to_array(image, max_width=_source_max_width(store))
+            except Exception as exc:
+                return ("", f"保存失败: 缩略图处理错误: {exc}")
+            try:
+                return _save_batch(store, inputs, arr, batch_mode)
+            except _SaveFailed as exc:
+                return ("", str(exc))
+            except Exception as exc:
+                return ("", f"保存失败: {exc}")
 
         try:
             store = PromptVaultStore.get()
+        except Exception as exc:
+            return ("", f"保存失败: {exc}")
+        try:
+            # 缩略图和 WebP 副本共用一次张量转换
+            arr = _image_to_array(image, max_width=_source_max_width(store))
+            thumb_png, thumb_w, thumb_h = _thumbnail_png_from_array(arr, target_width=THUMBNAIL_WIDTH)
+        except Exception as exc:
+            return ("", f"保存失败: 缩略图处理错误: {exc}")
+        try:
+            payload, llm_changed = _build_save_payload(inputs, thumb_png, thumb_w, thumb_h)
+        except _SaveFailed as exc:
+            return ("", str(exc))
+
+        try:
+            payload["thumbnail_renditions"] = _webp_renditions(store, arr=arr)
             entry = store.create_entry(payload)
             status = "保存成功"
             if llm_changed:
@@ -990,6 +1016,232 @@ class PromptVaultSaveNode:
             return ("", f"保存失败: {exc}")
 
 
+class _SaveFailed(Exception):
+    pass
+
+
+def _build_save_payload(inputs, thumb_png, thumb_w, thumb_h):
+    """提取元数据、按需调用 LLM，组装 create_entry 的 payload；同步和后台保存共用。
+
+    返回 (payload, llm_changed)，无法保存时抛 _SaveFailed(状态文案)。
+    """
+    prompt = inputs.get("prompt")
+    extra_pnginfo = inputs.get("extra_pnginfo")
+    # Prefer PNG metadata, then fallback to current workflow prompt.
+    prompt_from_png = _extract_prompt_from_pnginfo(extra_pnginfo)
+    data = _extract_generation_data(prompt_from_png or prompt)
+    workflow_data = _extract_from_workflow(extra_pnginfo)
+    for key, value in workflow_data.items():
+        if value not in (None, "", 0):
+            data[key] = value
+    png_meta_data = _extract_generation_data_from_pnginfo(extra_pnginfo)
+    for key, value in png_meta_data.items():
+        if value not in (None, "", 0):
+            data[key] = value
+    image_meta_data, image_meta_paths = _extract_from_source_image_metadata(prompt, extra_pnginfo)
+    for key, value in image_meta_data.items():
+        if value not in (None, "", 0):
+            data[key] = value
+
+    _debug_dump_png_meta(
+        extra_pnginfo,
+        prompt_from_png,
+        png_meta_data,
+        workflow_data,
+        image_meta_data,
+        image_meta_paths,
+        data,
+    )
+    positive = str(inputs.get("positive_prompt") or "").strip() or data.get("positive", "")
+    negative = str(inputs.get("negative_prompt") or "").strip() or data.get("negative", "")
+    if not str(positive or "").strip():
+        raise _SaveFailed("保存失败: 未提取到正向提示词，请确认输入图像或工作流元数据")
+    fallback5 = _first_five_chars(positive)
+
+    final_title = (inputs.get("title") or "").strip()
+    tag_list = [t.strip() for t in (inputs.get("tags") or "").split(",") if t.strip()]
+
+    final_title, tag_list, llm_changed = _maybe_auto_fill_with_llm(
+        final_title,
+        tag_list,
+        positive,
+        negative,
+        inputs.get("llm_generate"),
+        inputs.get("llm_generate_mode"),
+    )
+
+    if not final_title:
+        final_title = fallback5 or "未命名"
+    if not tag_list and fallback5:
+        tag_list = [fallback5]
+
+    model_list = [m.strip() for m in (inputs.get("model") or "").split(",") if m.strip()]
+    auto_model = data.get("model_name", "").strip()
+    if not model_list and auto_model:
+        model_list = [auto_model]
+
+    payload = {
+        "title": final_title,
+        "tags": tag_list,
+        "model_scope": model_list,
+        "raw": {
+            "positive": positive,
+            "negative": negative,
+        },
+        "params": {
+            "steps": data.get("steps", 20),
+            "cfg": data.get("cfg", 7.0),
+            "sampler": data.get("sampler", "euler"),
+            "scheduler": data.get("scheduler", "normal"),
+            "seed": data.get("seed", 0),
+        },
+        "thumbnail_png": thumb_png,
+        "thumbnail_width": thumb_w,
+        "thumbnail_height": thumb_h,
+    }
+    return payload, llm_changed
+
+
+# ---- 批量保存 ----
+# first：只保存批次中的第一张；separate：每张图各建一条记录；contact_sheet：一条记录，缩略图为整批联系表
+BATCH_MODES = ["first", "separate", "contact_sheet"]
+THUMBNAIL_ENCODE_WORKERS = 4
+
+
+def _encode_thumbnail_set(store, arr):
+    thumb_png, thumb_w, thumb_h = _thumbnail_png_from_array(arr, target_width=THUMBNAIL_WIDTH)
+    return thumb_png, thumb_w, thumb_h, _webp_renditions(store, arr=arr)
+
+
+def _encode_batch_thumbnails(store, arrs):
+    """用线程池并行编码每张图的 PNG 缩略图和 WebP 副本（PIL 缩放和编码时会释放 GIL）。"""
+    workers = min(THUMBNAIL_ENCODE_WORKERS, len(arrs))
+    if workers <= 1:
+        return [_encode_thumbnail_set(store, arr) for arr in arrs]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PromptVaultThumbnail") as pool:
+        return list(pool.map(lambda arr: _encode_thumbnail_set(store, arr), arrs))
+
+
+def _save_batch(store, inputs, arr, batch_mode, entry_ids=None):
+    """保存整批图像（arr 为已缩小的 uint8 NHWC）；元数据提取和 LLM 补全只做一次。
+
+    separate 模式下 N 条记录由 create_entries 在一个事务里写入，标题追加 #序号。
+    返回节点输出 (逗号分隔的记录 ID, 状态文案)；无法保存时抛 _SaveFailed。
+    """
+    if batch_mode == "contact_sheet":
+        thumbs = [_encode_thumbnail_set(store, contact_sheet(arr, sheet_width=THUMBNAIL_WIDTH * 2))]
+    else:
+        thumbs = _encode_batch_thumbnails(store, list(arr))
+    thumb_png, thumb_w, thumb_h, _renditions = thumbs[0]
+    base, llm_changed = _build_save_payload(inputs, thumb_png, thumb_w, thumb_h)
+
+    payloads = []
+    for index, (thumb_png, thumb_w, thumb_h, renditions) in enumerate(thumbs):
+        payload = dict(
+            base,
+            thumbnail_png=thumb_png,
+            thumbnail_width=thumb_w,
+            thumbnail_height=thumb_h,
+            thumbnail_renditions=renditions,
+        )
+        if len(thumbs) > 1:
+            payload["title"] = f"{base['title']} #{index + 1}"
+        if entry_ids:
+            payload["id"] = entry_ids[index]
+        payloads.append(payload)
+
+    result = store.create_entries(payloads)
+    saved = [item["entry"]["id"] for item in result["items"] if item.get("ok")]
+    errors = [item["error"] for item in result["items"] if not item.get("ok")]
+    if not saved:
+        raise _SaveFailed(f"保存失败: {errors[0] if errors else '未知错误'}")
+    status = "保存成功" if len(thumbs) == 1 else f"保存成功 {len(saved)}/{len(thumbs)} 条"
+    if errors:
+        status += f"（失败: {errors[0]}）"
+    if llm_changed:
+        status += " (AI 已补全标题或标签)"
+    return (",".join(saved), status)
+
+
+# ---- 后台保存 ----
+THUMBNAIL_WIDTH = 256
+SAVE_QUEUE_MAX_PENDING = 32
+_save_queue = None
+_save_queue_lock = threading.Lock()
+
+
+def get_save_queue():
+    global _save_queue
+    with _save_queue_lock:
+        if _save_queue is None:
+            _save_queue = SaveQueue(
+                os.path.join(get_data_dir(), "save_queue"),
+                _process_save_job,
+                max_pending=SAVE_QUEUE_MAX_PENDING,
+            )
+        return _save_queue
+
+
+def _enqueue_save(image, inputs, batch_mode="first"):
+    """在执行线程里只做张量拷贝和块平均缩小，其余工作交给后台队列；失败时返回 None。
+
+    批量模式下整批缩小后一起入队，记录 ID 预先分配；任务 ID 取第一条记录的 ID。
+    """
+    try:
+        payload = {"inputs": inputs}
+        # 与同步保存按同一宽度缩小，后台生成的 WebP 副本尺寸才一致
+        max_width = _source_max_width(PromptVaultStore.get())
+        if batch_mode == "first":
+            arr = _image_to_array(image, max_width=max_width)
+            entry_ids = [PromptVaultStore.new_entry_id()]
+        else:
+            arr = _image_batch_to_array(image, max_width=max_width)
+            count = 1 if batch_mode == "contact_sheet" else arr.shape[0]
+            entry_ids = [PromptVaultStore.new_entry_id() for _ in range(count)]
+            payload.update(batch_mode=batch_mode, entry_ids=entry_ids)
+        entry_id = entry_ids[0]
+        payload["image_shape"] = list(arr.shape)
+        get_save_queue().enqueue(entry_id, payload, np.ascontiguousarray(arr).tobytes())
+    except SaveQueueFull as exc:
+        logger.warning("PromptVaultSaveNode async save fell back to blocking: %s", exc)
+        return None
+    except Exception as exc:
+        logger.warning("PromptVaultSaveNode async enqueue failed, saving synchronously: %s", exc)
+        return None
+    return (",".join(entry_ids), "已加入后台保存队列")
+
+
+def _process_save_job(entry_id, payload, blob):
+    store = PromptVaultStore.get()
+    try:
+        store.get_entry(entry_id)
+        # 上次处理时已提交但任务文件未删除（进程中途退出），直接视为完成
+        return {"entry_id": entry_id, "status": "保存成功"}
+    except KeyError:
+        pass
+    arr = np.frombuffer(blob, dtype=np.uint8).reshape(payload["image_shape"])
+    if payload.get("batch_mode") in BATCH_MODES[1:]:
+        try:
+            entry_ids, status = _save_batch(
+                store, payload.get("inputs") or {}, arr, payload["batch_mode"], payload.get("entry_ids")
+            )
+        except _SaveFailed as exc:
+            raise ValueError(str(exc))
+        return {"entry_id": entry_id, "entry_ids": entry_ids.split(","), "status": status}
+    thumb_png, thumb_w, thumb_h = _thumbnail_png_from_array(arr, target_width=THUMBNAIL_WIDTH)
+    try:
+        entry_payload, llm_changed = _build_save_payload(payload.get("inputs") or {}, thumb_png, thumb_w, thumb_h)
+    except _SaveFailed as exc:
+        raise ValueError(str(exc))
+    entry_payload["id"] = entry_id
+    entry_payload["thumbnail_renditions"] = _webp_renditions(store, arr=arr)
+    store.create_entry(entry_payload)
+    status = "保存成功"
+    if llm_changed:
+        status += " (AI 已补全标题或标签)"
+    return {"entry_id": entry_id, "status": status}
+
+
 MODEL_RESOLUTIONS = {
     "Qwen-Image": [
         (1328, 1328),
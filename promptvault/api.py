@@ -1,11 +1,16 @@
+import asyncio
 import base64
 import json
+import os
+import threading
+import zlib
 from datetime import datetime
 
 from aiohttp import web
 
 from .assemble import assemble_entry
 from .db import OptimisticLockError, PromptVaultStore
+from .thumbnails import BUNDLE_MIME, PNG_MIME, WEBP_MIME, accepts_webp, pack_thumbnail_bundle
 
 
 def _json_response(obj, status=200):
@@ -20,6 +25,19 @@ def _bad_request(msg):
     return _json_response({"error": msg}, status=400)
 
 
+def _etag_values(header):
+    """解析 If-None-Match，返回其中的实体标签（去掉引号和弱校验前缀 W/）。"""
+    values = []
+    for part in (header or "").split(","):
+        part = part.strip()
+        if part.startswith("W/"):
+            part = part[2:]
+        part = part.strip('"')
+        if part and part != "*":
+            values.append(part)
+    return values
+
+
 def _safe_update_entry(store, entry_id, payload):
     try:
         return store.update_entry(entry_id, payload or {})
@@ -52,13 +70,135 @@ def _download_name(ext):
     return f"promptvault-export-{stamp}.{ext}"
 
 
-def _decode_import_bytes(raw_bytes):
-    for encoding in ("utf-8-sig", "utf-8", "gb18030", "cp936"):
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+def _write_file(path, data):
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+
+async def _save_upload(part, path):
+    """把 multipart 里的文件分块写到 path；磁盘写入放到线程池，不占事件循环。"""
+    loop = asyncio.get_running_loop()
+    fh = await loop.run_in_executor(None, open, path, "wb")
+    try:
+        while True:
+            chunk = await part.read_chunk(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await loop.run_in_executor(None, fh.write, chunk)
+    finally:
+        await loop.run_in_executor(None, fh.close)
+
+
+def _is_truthy(value):
+    return str(value or "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+async def _run_job(request, job, stream=False):
+    """在线程池里运行 job(progress)，避免长任务阻塞事件循环。
+
+    stream 为真时以 NDJSON 流式返回：每次 progress(dict) 输出一行 {"event": "progress", ...}，
+    结束时输出 {"event": "done", ...} 或 {"event": "error", "error": ...}。否则等待完成后返回 JSON。
+    """
+    loop = asyncio.get_running_loop()
+    if not stream:
         try:
-            return raw_bytes.decode(encoding)
-        except Exception:
-            continue
-    raise UnicodeDecodeError("import", raw_bytes, 0, 1, "unsupported text encoding")
+            result = await loop.run_in_executor(None, job, None)
+        except (KeyError, ValueError) as exc:
+            return _bad_request(str(exc))
+        return _json_response(result)
+
+    queue = asyncio.Queue()
+
+    def progress(info):
+        loop.call_soon_threadsafe(queue.put_nowait, {"event": "progress", **info})
+
+    async def runner():
+        try:
+            result = await loop.run_in_executor(None, job, progress)
+            await queue.put({"event": "done", **result})
+        except Exception as exc:
+            await queue.put({"event": "error", "error": str(exc)})
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+    await response.prepare(request)
+    task = asyncio.create_task(runner())
+    while True:
+        item = await queue.get()
+        await response.write((json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8"))
+        if item["event"] in ("done", "error"):
+            break
+    await task
+    await response.write_eof()
+    return response
+
+
+EXPORT_CONTENT_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson", "csv": "text/csv"}
+# 导出工作线程与响应之间最多缓冲的块数；客户端读得慢时工作线程阻塞等待，而不是继续读库
+EXPORT_QUEUE_SIZE = 4
+
+
+def _encode_export_chunks(chunks, compress=False):
+    """把文本块编码为 UTF-8，compress 为真时再压成 gzip 流。"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    try:
+        for text in chunks:
+            data = text.encode("utf-8")
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+    finally:
+        chunks.close()
+
+
+async def _write_from_worker(response, make_chunks):
+    """在一个工作线程里迭代 make_chunks() 产生的 bytes 块，并依次写入已 prepare 的 response。
+
+    生成器里的 SQLite 连接只能在创建它的线程使用，所以迭代和关闭都留在同一个线程；队列有上限，
+    内存占用只取决于块大小。客户端断开时通知工作线程停下，由它关闭生成器、结束读事务。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def worker():
+        chunks = None
+        try:
+            chunks = make_chunks()
+            for chunk in chunks:
+                put(chunk)
+                if stopped.is_set():
+                    return
+            put(None)
+        except Exception as exc:
+            if not stopped.is_set():
+                put(exc)
+        finally:
+            if chunks is not None:
+                chunks.close()
+
+    task = loop.run_in_executor(None, worker)
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            await response.write(item)
+    finally:
+        stopped.set()
+        while not queue.empty():
+            queue.get_nowait()
+        await task
 
 
 def setup_routes():
@@ -110,6 +250,7 @@ def setup_routes():
         model = request.query.get("model", "")
         status = request.query.get("status", "active")
         sort = request.query.get("sort", "updated_desc")
+        similar_to = request.query.get("similar_to", "")
         favorite_only = request.query.get("favorite_only", "").strip().lower() in {"1", "true", "yes", "on"}
         has_thumbnail = request.query.get("has_thumbnail", "").strip().lower() in {"1", "true", "yes", "on"}
         try:
@@ -121,6 +262,12 @@ def setup_routes():
         except (TypeError, ValueError):
             offset = 0
 
+        try:
+            placeholder_budget = request.query.get("placeholder_budget")
+            placeholder_budget = int(placeholder_budget) if placeholder_budget not in (None, "") else None
+        except (TypeError, ValueError):
+            placeholder_budget = None
+
         tag_list = [t.strip() for t in tags.split(",") if t.strip()]
         items = store.search_entries(
             q=q,
@@ -132,6 +279,8 @@ def setup_routes():
             sort=sort,
             favorite_only=favorite_only,
             has_thumbnail=has_thumbnail,
+            similar_to=similar_to,
+            placeholder_budget=placeholder_budget,
         )
         total = store.count_entries(
             q=q,
@@ -156,10 +305,23 @@ def setup_routes():
         )
 
     @routes.post("/promptvault/entries/purge_deleted")
-    async def purge_deleted(_request):
+    async def purge_deleted(request):
         store = PromptVaultStore.get()
-        count = store.purge_deleted_entries()
-        return _json_response({"deleted": count})
+        try:
+            payload = await request.json() if request.can_read_body else {}
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        payload = payload if isinstance(payload, dict) else {}
+
+        def job(progress):
+            return store.purge_deleted_entries(
+                chunk_size=payload.get("chunk_size"),
+                progress=progress,
+                vacuum=payload.get("vacuum", True) is not False,
+            )
+
+        stream = _is_truthy(payload.get("stream")) or _is_truthy(request.query.get("stream"))
+        return await _run_job(request, job, stream=stream)
 
     @routes.post("/promptvault/tags/tidy")
     async def tidy_tags(_request):
@@ -167,6 +329,92 @@ def setup_routes():
         result = store.tidy_tags()
         return _json_response(result)
 
+    @routes.post("/promptvault/maintenance/rebuild_fts")
+    async def rebuild_fts(_request):
+        store = PromptVaultStore.get()
+        indexed = store.rebuild_fts_index()
+        return _json_response({"indexed": indexed})
+
+    @routes.post("/promptvault/maintenance/compress_versions")
+    async def compress_versions(request):
+        store = PromptVaultStore.get()
+
+        def job(progress):
+            return store.compress_entry_versions(progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.get("/promptvault/maintenance/compact_versions")
+    async def get_compaction_status(_request):
+        store = PromptVaultStore.get()
+        return _json_response({"policy": store.retention_policy(), "last_run": store.compaction_status})
+
+    @routes.post("/promptvault/maintenance/compact_versions")
+    async def compact_versions(request):
+        store = PromptVaultStore.get()
+
+        def job(progress):
+            return store.compact_entry_versions(progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.get("/promptvault/maintenance/migrate_thumbnails")
+    async def get_thumbnail_migration_status(_request):
+        store = PromptVaultStore.get()
+        return _json_response(
+            {"pending": store.thumbnail_migration_pending(), "background": store.thumbnail_migration_status}
+        )
+
+    @routes.post("/promptvault/maintenance/migrate_thumbnails")
+    async def migrate_thumbnails(request):
+        store = PromptVaultStore.get()
+
+        def job(progress):
+            return store.migrate_thumbnails(progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.post("/promptvault/maintenance/convert_thumbnails")
+    async def convert_thumbnails(request):
+        store = PromptVaultStore.get()
+        force = _is_truthy(request.query.get("force"))
+
+        def job(progress):
+            return store.convert_thumbnail_renditions(force=force, progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.post("/promptvault/maintenance/backfill_thumbnail_features")
+    async def backfill_thumbnail_features(request):
+        store = PromptVaultStore.get()
+
+        def job(progress):
+            return store.backfill_thumbnail_features(progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.get("/promptvault/maintenance/vacuum")
+    async def get_vacuum_status(_request):
+        store = PromptVaultStore.get()
+        return _json_response(store.vacuum_status())
+
+    @routes.post("/promptvault/maintenance/vacuum")
+    async def run_vacuum(request):
+        store = PromptVaultStore.get()
+        try:
+            payload = await request.json() if request.can_read_body else {}
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        payload = payload if isinstance(payload, dict) else {}
+
+        def job(progress):
+            # full=true 时把旧库迁移到 INCREMENTAL（整库 VACUUM），之后再回收剩余空闲页
+            migrated = store.enable_incremental_vacuum()["migrated"] if _is_truthy(payload.get("full")) else False
+            result = store.incremental_vacuum(max_pages=payload.get("max_pages"), progress=progress)
+            return {**result, "migrated": migrated}
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
     @routes.post("/promptvault/entries")
     async def create_entry(request):
         store = PromptVaultStore.get()
@@ -178,6 +426,53 @@ def setup_routes():
         entry = store.create_entry(payload or {})
         return _json_response(entry, status=201)
 
+    @routes.post("/promptvault/entries/batch")
+    async def create_entries(request):
+        store = PromptVaultStore.get()
+        try:
+            payload = await request.json()
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        items = payload.get("entries") if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            return _bad_request("entries 必须是数组")
+        for item in items:
+            if isinstance(item, dict):
+                _decode_thumbnail_b64(item)
+        try:
+            result = store.create_entries(items)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        status = 201 if result["created"] else 200
+        return _json_response(result, status=status)
+
+    @routes.post("/promptvault/entries/bulk")
+    async def bulk_entries(request):
+        store = PromptVaultStore.get()
+        try:
+            payload = await request.json()
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        if not isinstance(payload, dict):
+            return _bad_request("请求体必须是 JSON 对象")
+        op = str(payload.get("op") or "").strip()
+        if op not in store.BULK_OPS:
+            return _bad_request(f"op 必须是 {', '.join(store.BULK_OPS)} 之一")
+
+        def job(progress):
+            return store.bulk_update(
+                op,
+                ids=payload.get("ids"),
+                filters=payload.get("filters"),
+                value=payload.get("value"),
+                dry_run=_is_truthy(payload.get("dry_run")),
+                chunk_size=payload.get("chunk_size"),
+                progress=progress,
+            )
+
+        stream = _is_truthy(payload.get("stream")) or _is_truthy(request.query.get("stream"))
+        return await _run_job(request, job, stream=stream)
+
     @routes.get("/promptvault/entries/{entry_id}")
     async def get_entry(request):
         store = PromptVaultStore.get()
@@ -186,6 +481,9 @@ def setup_routes():
             entry = store.get_entry(entry_id)
         except KeyError:
             return _json_response({"error": "未找到记录"}, status=404)
+        # inline_thumbnail=0 时不内联 data URL，前端改走可缓存的缩略图 URL
+        if not _is_truthy(request.query.get("inline_thumbnail", "1")):
+            return _json_response(entry)
         try:
             thumb = store.get_entry_thumbnail(entry_id)
             if thumb and thumb.get("png"):
@@ -195,20 +493,94 @@ def setup_routes():
             entry["thumbnail_data_url"] = ""
         return _json_response(entry)
 
+    @routes.get("/promptvault/entries/{entry_id}/similar")
+    async def get_similar_entries(request):
+        store = PromptVaultStore.get()
+        entry_id = request.match_info["entry_id"]
+        try:
+            max_distance = request.query.get("max_distance")
+            max_distance = int(max_distance) if max_distance not in (None, "") else None
+            limit = max(1, min(200, int(request.query.get("limit", "20"))))
+        except ValueError:
+            return _bad_request("max_distance / limit 必须是整数")
+        try:
+            items = store.find_similar_entries(
+                entry_id, max_distance=max_distance, limit=limit, status=request.query.get("status", "active")
+            )
+        except KeyError:
+            return _json_response({"error": "未找到记录"}, status=404)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        return _json_response({"items": items, "limit": limit})
+
     @routes.get("/promptvault/entries/{entry_id}/thumbnail")
     async def get_entry_thumbnail(request):
         store = PromptVaultStore.get()
         entry_id = request.match_info["entry_id"]
         try:
-            thumb = store.get_entry_thumbnail(entry_id)
+            size = int(request.query.get("size") or 0) or None
+        except ValueError:
+            return _bad_request("size 必须是整数")
+        try:
+            thumb = store.open_thumbnail_stream(
+                entry_id,
+                width=size,
+                accept_webp=accepts_webp(request.headers.get("Accept")),
+                known_hashes=_etag_values(request.headers.get("If-None-Match")),
+            )
         except KeyError:
             return _json_response({"error": "未找到记录"}, status=404)
         if not thumb:
             return _json_response({"error": "未找到缩略图"}, status=404)
+        # 同一 URL 按 Accept 返回不同格式，缓存需区分
+        headers = {"Vary": "Accept"}
+        if thumb["hash"]:
+            headers["ETag"] = f'"{thumb["hash"]}"'
+        # URL 带着当前缩略图的哈希时内容永不改变；否则每次用 ETag 重新验证
+        addressed = thumb["thumbnail_hash"] and request.query.get("h") == thumb["thumbnail_hash"]
+        headers["Cache-Control"] = "public, max-age=31536000, immutable" if addressed else "no-cache"
+        if thumb["chunks"] is None:
+            return web.Response(status=304, headers=headers)
+        # 按块从 blob 直接写到响应，不在内存里拼出整张图
+        chunks = thumb["chunks"]
+        response = web.StreamResponse(headers=headers)
+        response.content_type = WEBP_MIME if thumb["format"] == "webp" else PNG_MIME
+        response.content_length = thumb["length"]
+        try:
+            await response.prepare(request)
+            for chunk in chunks:
+                await response.write(chunk)
+        finally:
+            chunks.close()
+        await response.write_eof()
+        return response
+
+    @routes.post("/promptvault/thumbnails/batch")
+    async def get_thumbnails_batch(request):
+        """一次返回一页记录的缩略图（长度前缀二进制包，格式见 thumbnails.pack_thumbnail_bundle）。"""
+        store = PromptVaultStore.get()
+        try:
+            payload = await request.json()
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        payload = payload if isinstance(payload, dict) else {}
+        try:
+            size = int(payload.get("size") or 0) or None
+        except (TypeError, ValueError):
+            return _bad_request("size 必须是整数")
+        formats = payload.get("formats") or ["png"]
+        loop = asyncio.get_running_loop()
+        try:
+            items, missing = await loop.run_in_executor(
+                None,
+                lambda: store.get_thumbnails(payload.get("ids") or [], width=size, accept_webp="webp" in formats),
+            )
+        except ValueError as exc:
+            return _bad_request(str(exc))
         return web.Response(
-            body=thumb["png"],
-            content_type="image/png",
-            headers={"Cache-Control": "public, max-age=3600"},
+            body=pack_thumbnail_bundle(items, missing),
+            content_type=BUNDLE_MIME,
+            headers={"Cache-Control": "no-store"},
         )
 
     @routes.put("/promptvault/entries/{entry_id}")
@@ -226,6 +598,26 @@ def setup_routes():
             return _json_response({"error": "未找到记录"}, status=404)
         return entry if isinstance(entry, web.Response) else _json_response(entry)
 
+    @routes.patch("/promptvault/entries/{entry_id}")
+    async def patch_entry(request):
+        store = PromptVaultStore.get()
+        entry_id = request.match_info["entry_id"]
+        try:
+            payload = await request.json()
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        if not isinstance(payload, dict):
+            return _bad_request("请求体必须是 JSON 对象")
+        try:
+            result = store.patch_entry(entry_id, payload)
+        except KeyError:
+            return _json_response({"error": "未找到记录"}, status=404)
+        except OptimisticLockError as exc:
+            return _json_response({"error": str(exc)}, status=409)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        return _json_response(result)
+
     @routes.delete("/promptvault/entries/{entry_id}")
     async def delete_entry(request):
         store = PromptVaultStore.get()
@@ -247,6 +639,19 @@ def setup_routes():
         items = store.list_entry_versions(entry_id)
         return _json_response({"items": items})
 
+    @routes.get("/promptvault/entries/{entry_id}/versions/{version}")
+    async def get_version(request):
+        store = PromptVaultStore.get()
+        try:
+            version = int(request.match_info["version"])
+        except ValueError:
+            return _bad_request("version 必须是整数")
+        try:
+            item = store.get_entry_version(request.match_info["entry_id"], version)
+        except KeyError:
+            return _json_response({"error": "未找到该版本"}, status=404)
+        return _json_response(item)
+
     @routes.post("/promptvault/assemble")
     async def assemble(request):
         store = PromptVaultStore.get()
@@ -281,70 +686,104 @@ def setup_routes():
     async def export_promptvault(request):
         store = PromptVaultStore.get()
         fmt = str(request.query.get("format", "json") or "json").strip().lower()
-        if fmt == "json":
-            text = json.dumps(store.export_bundle(), ensure_ascii=False, indent=2)
-            return web.Response(
-                text=text,
-                content_type="application/json",
-                headers={"Content-Disposition": f'attachment; filename="{_download_name("json")}"'},
-            )
-        if fmt == "csv":
-            text = store.export_bundle_csv()
-            return web.Response(
-                text=text,
-                content_type="text/csv",
-                headers={"Content-Disposition": f'attachment; filename="{_download_name("csv")}"'},
-            )
-        return _bad_request("仅支持 json 或 csv 格式导出")
+        if fmt not in store.EXPORT_FORMATS:
+            return _bad_request("仅支持 json、ndjson 或 csv 格式导出")
+        compress = _is_truthy(request.query.get("gzip"))
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "application/gzip" if compress else f"{EXPORT_CONTENT_TYPES[fmt]}; charset=utf-8",
+                "Content-Disposition": f'attachment; filename="{_download_name(fmt + ".gz" if compress else fmt)}"',
+            }
+        )
+        await response.prepare(request)
+        await _write_from_worker(response, lambda: _encode_export_chunks(store.iter_export_text(fmt), compress))
+        await response.write_eof()
+        return response
 
     @routes.post("/promptvault/import")
     async def import_promptvault(request):
         store = PromptVaultStore.get()
+        loop = asyncio.get_running_loop()
         content_type = (request.content_type or "").lower()
-        conflict_strategy = "merge"
-
-        if content_type.startswith("multipart/"):
-            form = await request.post()
-            upload = form.get("file")
-            conflict_strategy = str(form.get("conflict_strategy", "merge") or "merge").strip().lower()
-            fmt = str(form.get("format", "") or "").strip().lower()
-            if not upload or not getattr(upload, "file", None):
-                return _bad_request("缺少导入文件")
-            raw_bytes = upload.file.read()
-            if not fmt:
-                filename = str(getattr(upload, "filename", "") or "").lower()
-                if filename.endswith(".csv"):
-                    fmt = "csv"
-                else:
-                    fmt = "json"
-        else:
-            try:
-                payload = await request.json()
-            except Exception:
-                return _bad_request("无法解析导入请求")
-            if not isinstance(payload, dict):
-                return _bad_request("请求体必须是 JSON 对象")
-            fmt = str(payload.get("format", "json") or "json").strip().lower()
-            conflict_strategy = str(payload.get("conflict_strategy", "merge") or "merge").strip().lower()
-            raw_text = str(payload.get("content", "") or "")
-            raw_bytes = raw_text.encode("utf-8")
-
-        if conflict_strategy != "merge":
-            return _bad_request("当前仅支持 merge 冲突策略")
-        try:
-            text = _decode_import_bytes(raw_bytes)
-        except Exception:
-            return _bad_request("导入文件编码不支持，请使用 UTF-8 或 GB18030/GBK")
-
+        upload_path = store.new_import_upload_path()
+        filename = ""
+        checkpoint = None
         try:
-            if fmt == "csv":
-                result = store.import_csv_text(text, conflict_strategy=conflict_strategy)
+            if content_type.startswith("multipart/"):
+                # 逐块把上传文件写到磁盘，不经过 request.post()（整个请求体受 client_max_size 限制）
+                fields = {}
+                saved = False
+                reader = await request.multipart()
+                async for part in reader:
+                    if part.name == "file" and not saved:
+                        filename = part.filename or ""
+                        await _save_upload(part, upload_path)
+                        saved = True
+                    else:
+                        fields[part.name] = await part.text()
+                if not saved:
+                    return _bad_request("缺少导入文件")
             else:
-                bundle = json.loads(text or "{}")
-                result = store.import_bundle(bundle, conflict_strategy=conflict_strategy)
-        except Exception as exc:
-            return _json_response({"error": str(exc)}, status=400)
-        return _json_response(result)
+                try:
+                    fields = await request.json()
+                except Exception:
+                    return _bad_request("无法解析导入请求")
+                if not isinstance(fields, dict):
+                    return _bad_request("请求体必须是 JSON 对象")
+                content = str(fields.get("content", "") or "").encode("utf-8")
+                await loop.run_in_executor(None, _write_file, upload_path, content)
+            fmt = str(fields.get("format", "") or "").strip().lower()
+            conflict_strategy = str(fields.get("conflict_strategy", "merge") or "merge").strip().lower()
+            if conflict_strategy != "merge":
+                return _bad_request("当前仅支持 merge 冲突策略")
+            checkpoint = store.create_import(upload_path, filename=filename, fmt=fmt, owns_source=True)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        finally:
+            # 没能登记成导入任务（请求无效或上传中断）时删掉已写的临时文件
+            if checkpoint is None and os.path.exists(upload_path):
+                os.remove(upload_path)
+
+        import_id = checkpoint["import_id"]
+
+        def job(progress):
+            return store.run_import(import_id, progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.get("/promptvault/imports")
+    async def list_imports(_request):
+        store = PromptVaultStore.get()
+        return _json_response({"imports": store.list_imports()})
+
+    @routes.get("/promptvault/imports/{import_id}")
+    async def get_import(request):
+        store = PromptVaultStore.get()
+        try:
+            return _json_response(store.get_import(request.match_info["import_id"]))
+        except KeyError:
+            return _json_response({"error": "未找到导入任务"}, status=404)
+
+    @routes.post("/promptvault/imports/{import_id}/resume")
+    async def resume_import(request):
+        store = PromptVaultStore.get()
+        import_id = request.match_info["import_id"]
+
+        def job(progress):
+            return store.run_import(import_id, progress=progress)
+
+        return await _run_job(request, job, stream=_is_truthy(request.query.get("stream")))
+
+    @routes.delete("/promptvault/imports/{import_id}")
+    async def discard_import(request):
+        store = PromptVaultStore.get()
+        try:
+            store.discard_import(request.match_info["import_id"])
+        except KeyError:
+            return _json_response({"error": "未找到导入任务"}, status=404)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        return _json_response({"ok": True})
 
     @routes.post("/promptvault/fragments")
     async def upsert_fragment(request):
@@ -386,6 +825,24 @@ def setup_routes():
             return _json_response({"error": "未找到模板"}, status=404)
         return _json_response(tpl)
 
+    @routes.get("/promptvault/settings")
+    async def get_settings(_request):
+        store = PromptVaultStore.get()
+        return _json_response(store.get_settings())
+
+    @routes.put("/promptvault/settings")
+    async def put_settings(request):
+        store = PromptVaultStore.get()
+        try:
+            payload = await request.json()
+        except Exception:
+            return _bad_request("JSON 解析失败")
+        try:
+            settings = store.set_settings(payload)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        return _json_response(settings)
+
     @routes.get("/promptvault/llm/config")
     async def get_llm_config(_request):
         config, _error = _load_llm_config(require_enabled=False)
@@ -524,6 +981,21 @@ def setup_routes():
         items = store.list_tags(limit=limit)
         return _json_response({"items": items, "limit": limit})
 
+    @routes.get("/promptvault/autocomplete")
+    async def autocomplete(request):
+        store = PromptVaultStore.get()
+        field = request.query.get("field", "tag").strip().lower()
+        q = request.query.get("q", "")
+        try:
+            limit = max(1, min(50, int(request.query.get("limit", "10"))))
+        except (TypeError, ValueError):
+            limit = 10
+        try:
+            items = store.autocomplete(field, q, limit=limit)
+        except ValueError as exc:
+            return _bad_request(str(exc))
+        return _json_response({"items": items, "field": field, "q": q, "limit": limit})
+
     @routes.post("/promptvault/extract_image_metadata")
     async def extract_image_metadata(request):
         import io
@@ -595,6 +1067,21 @@ def setup_routes():
 
         return _json_response({"found": list(found.keys()), "data": data})
 
+    @routes.get("/promptvault/save_jobs")
+    async def save_jobs(_request):
+        from ..nodes import get_save_queue
+
+        return _json_response(get_save_queue().stats())
+
+    @routes.get("/promptvault/save_jobs/{job_id}")
+    async def save_job_status(request):
+        from ..nodes import get_save_queue
+
+        status = get_save_queue().status(request.match_info["job_id"])
+        if status is None:
+            return _json_response({"error": "未找到保存任务"}, status=404)
+        return _json_response(status)
+
     @routes.get("/promptvault/model_resolutions")
     async def model_resolutions(_request):
         from ..nodes import MODEL_RESOLUTIONS
@@ -603,3 +1090,13 @@ def setup_routes():
         for model, sizes in MODEL_RESOLUTIONS.items():
             data[model] = [f"{w}x{h}" for w, h in sizes]
         return _json_response(data)
+
+    # 路由注册完成即 ComfyUI 已启动，开始后台版本压缩（首轮在启动一段时间后才执行）
+    PromptVaultStore.get().start_background_compaction()
+    # 旧库的缩略图在后台分批搬到按哈希去重的 thumbnail_blobs，搬完即停
+    PromptVaultStore.get().start_thumbnail_migration()
+
+    # 继续处理上次退出时仍在后台保存队列里的任务
+    from ..nodes import get_save_queue
+
+    get_save_queue().start()
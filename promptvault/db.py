@@ -1,19 +1,33 @@
 import base64
 import csv
 import io
+import itertools
 import json
 import logging
 import os
 import sqlite3
 import sys
 import threading
+import time
 import uuid
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
 
 logger = logging.getLogger("PromptVault")
 
 from .paths import get_db_path
-from .schema import SCHEMA_SQL
-from .utils import json_dumps, normalize_tags, normalize_text, now_iso, stable_hash
+from .schema import FTS_DROP_SQL, FTS_SCHEMA_SQL, FTS_SCHEMA_VERSION, SCHEMA_SQL
+from .utils import (
+    apply_json_delta,
+    content_hash,
+    json_delta,
+    json_dumps,
+    normalize_tags,
+    normalize_text,
+    now_iso,
+    stable_hash,
+)
 
 
 class OptimisticLockError(ValueError):
@@ -31,8 +45,110 @@ class PromptVaultStore:
                 cls._instance = cls()
             return cls._instance
 
-    def __init__(self):
-        self.db_path = get_db_path()
+    AUTOCOMPLETE_FIELDS = ("title", "tag", "model")
+    AUTOCOMPLETE_CACHE_SIZE = 512
+    AUTOCOMPLETE_CACHE_TTL = 30.0
+    CREATE_BATCH_LIMIT = 1000
+    PURGE_CHUNK_SIZE = 200
+    # 每次 incremental_vacuum 释放的页数，单步持锁时间保持在毫秒级。
+    VACUUM_STEP_PAGES = 2048
+    AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+    # 每隔多少个版本写一次完整快照；重建任一版本最多解码这么多行。
+    VERSION_KEYFRAME_INTERVAL = 16
+    # 缩略图不做版本化（只保留 has_thumbnail / 尺寸），导入路径带进快照的 base64 在写入时剔除。
+    VERSION_SNAPSHOT_EXCLUDE = ("thumbnail_b64", "thumbnail_png")
+    COMPRESS_VERSIONS_BATCH = 100
+    # 后台版本压缩：每批处理的记录数、每次最多连续处理的批数、批次之间与启动后的等待秒数。
+    COMPACTION_BATCH_SIZE = 50
+    COMPACTION_MAX_BATCHES = 20
+    COMPACTION_BATCH_PAUSE = 1.0
+    COMPACTION_STARTUP_DELAY = 60.0
+    # 旧库缩略图迁移：每批搬运的行数与批间停顿（秒），让前台写入可以插队
+    THUMBNAIL_MIGRATION_BATCH_SIZE = 200
+    THUMBNAIL_MIGRATION_PAUSE = 0.05
+    # 不指定 size 时缩略图接口按这个宽度挑选副本；后台转换 WebP 副本时每批处理的缩略图数
+    THUMBNAIL_DEFAULT_WIDTH = 256
+    THUMBNAIL_CONVERT_BATCH_SIZE = 50
+    # 批量取缩略图时单次最多的 id 数
+    THUMBNAIL_BATCH_LIMIT = 500
+    # 流式返回缩略图时每次从 blob 读出的字节数
+    THUMBNAIL_STREAM_CHUNK_SIZE = 64 * 1024
+    # 感知哈希与占位图回填时每批处理的缩略图数
+    THUMBNAIL_FEATURES_BATCH_SIZE = 200
+    # 检索结果里内联占位图（data URL）的总字符数上限，超出后的条目只带平均色
+    PLACEHOLDER_RESPONSE_BUDGET = 24 * 1024
+    # 相似检索的默认 / 最大汉明距离。
+    # 距离换算到每个 16 位分段不超过 PHASH_MIH_MAX_RADIUS 位时走多索引哈希，否则全表比对
+    PHASH_DEFAULT_DISTANCE = 10
+    PHASH_MAX_DISTANCE = 32
+    PHASH_MIH_MAX_RADIUS = 3
+    PHASH_CHUNK_SQL = (
+        "((phash >> 48) & 65535)",
+        "((phash >> 32) & 65535)",
+        "((phash >> 16) & 65535)",
+        "(phash & 65535)",
+    )
+    EXPORT_VERSION = "1.0"
+    EXPORT_FORMATS = ("json", "ndjson", "csv")
+    # (record_type, 导出 JSON 里的数组键)，也是导出时各类记录的先后顺序
+    EXPORT_SECTIONS = (("template", "templates"), ("fragment", "fragments"), ("entry", "entries"))
+    # 每次从游标取的行数（记录带整张缩略图，不宜过大），以及 iter_export_text 每块的目标字符数
+    EXPORT_BATCH_SIZE = 100
+    EXPORT_CHUNK_SIZE = 256 * 1024
+    # 流式导入每个事务合并的记录数，以及导入状态里最多保留的错误明细条数
+    IMPORT_BATCH_SIZE = 200
+    IMPORT_MAX_ERRORS = 100
+
+    # 存储层可调选项，保存在 meta 表的 store_settings 中。
+    DEFAULT_SETTINGS = {
+        # 收藏、评分这类元数据修改是否也写入 entry_versions 快照。
+        "version_metadata_changes": True,
+        # 版本保留策略：每条记录至少保留最近 N 个版本，并保留最近 D 天内的全部版本；
+        # 更早的版本在 version_thin_daily 为真时每天只留最后一个，否则删除。
+        "version_keep_last": 20,
+        "version_keep_days": 30,
+        "version_thin_daily": True,
+        # 后台压缩两轮之间的间隔（秒），0 表示关闭后台压缩。
+        "version_compaction_interval": 3600,
+        # 缩略图 WebP 副本的宽度（像素），以及编码质量（0-100）/ 是否无损。空列表表示不生成副本。
+        "thumbnail_webp_sizes": [96, 256, 512],
+        "thumbnail_webp_quality": 80,
+        "thumbnail_webp_lossless": False,
+    }
+    PATCH_FIELDS = ("favorite", "score", "status", "tags")
+    ENTRY_STATUSES = ("active", "deleted")
+    # 除缩略图 blob 外的全部列；读取记录元数据时避免把缩略图读进内存。
+    # 缩略图按 thumbnail_hash 存放在 thumbnail_blobs；迁移完成前旧行的 blob 仍在 entries.thumbnail_png，
+    # 因此 has_thumbnail 也认内联列（IS NOT NULL 只读记录头，不读溢出页）。
+    HAS_THUMBNAIL_SQL = "(has_thumbnail OR thumbnail_png IS NOT NULL)"
+    # 缩略图仍内联在 entries 的记录（entries 需以 e 为别名），它们的引用不计入 thumbnail_blobs.refcount
+    LEGACY_THUMBNAIL_SQL = "(e.thumbnail_png IS NOT NULL)"
+    # 还需 migrate_thumbnails() 处理的行：blob 仍内联在 entries，或写入时尚未记录内容哈希
+    THUMBNAIL_PENDING_SQL = "thumbnail_png IS NOT NULL OR (has_thumbnail AND thumbnail_hash IS NULL)"
+    # 读取一条记录（别名 e）的原始 PNG：先按哈希取去重表，迁移完成前退回内联列
+    THUMBNAIL_DATA_SQL = (
+        "COALESCE((SELECT b.data FROM thumbnail_blobs b WHERE b.blob_hash = e.thumbnail_hash), e.thumbnail_png)"
+    )
+    THUMBNAIL_TABLE_VERSION = "3"
+    ENTRY_FIELDS = (
+        "id, title, status, version, lang, template_id, tags_json, model_scope_json, "
+        "variables_json, fragments_json, raw_json, negative_json, params_json, "
+        f"{HAS_THUMBNAIL_SQL} AS has_thumbnail, thumbnail_hash, thumbnail_width, thumbnail_height, "
+        "favorite, score, hash, created_at, updated_at"
+    )
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or get_db_path()
+        self._autocomplete_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_stop = threading.Event()
+        self._compaction_thread = None
+        self.compaction_status = None
+        self._thumbnail_migration_thread = None
+        self.thumbnail_migration_status = None
+        self._import_lock = threading.Lock()
+        self._running_imports = set()
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         self._init_db()
 
@@ -66,10 +182,26 @@ class PromptVaultStore:
             conn.execute("ALTER TABLE entries ADD COLUMN thumbnail_width INTEGER")
         if "thumbnail_height" not in cols:
             conn.execute("ALTER TABLE entries ADD COLUMN thumbnail_height INTEGER")
+        if "has_thumbnail" not in cols:
+            # 旧行的缩略图仍在 thumbnail_png，由 migrate_thumbnails() 分批搬到 thumbnail_blobs
+            conn.execute("ALTER TABLE entries ADD COLUMN has_thumbnail INTEGER NOT NULL DEFAULT 0")
+        if "thumbnail_hash" not in cols:
+            conn.execute("ALTER TABLE entries ADD COLUMN thumbnail_hash TEXT")
         if "favorite" not in cols:
             conn.execute("ALTER TABLE entries ADD COLUMN favorite INTEGER NOT NULL DEFAULT 0")
         if "score" not in cols:
             conn.execute("ALTER TABLE entries ADD COLUMN score REAL NOT NULL DEFAULT 0.0")
+        version_cols = {row["name"] for row in conn.execute("PRAGMA table_info(entry_versions)").fetchall()}
+        if "snapshot_blob" not in version_cols:
+            conn.execute("ALTER TABLE entry_versions ADD COLUMN snapshot_blob BLOB")
+        if "keyframe" not in version_cols:
+            # 旧行都是完整快照，默认值 1 即可；由 compress_entry_versions() 按需转成差量
+            conn.execute("ALTER TABLE entry_versions ADD COLUMN keyframe INTEGER NOT NULL DEFAULT 1")
+        tag_cols = {row["name"] for row in conn.execute("PRAGMA table_info(tags)").fetchall()}
+        if "ref_count" not in tag_cols:
+            conn.execute("ALTER TABLE tags ADD COLUMN ref_count INTEGER NOT NULL DEFAULT 0")
+        if "last_used" not in tag_cols:
+            conn.execute("ALTER TABLE tags ADD COLUMN last_used TEXT")
         conn.executescript(
             """
             CREATE TABLE IF NOT EXISTS entry_tags (
@@ -92,6 +224,16 @@ class PromptVaultStore:
               ON entries(status, favorite DESC, score DESC, updated_at DESC, id ASC);
             CREATE INDEX IF NOT EXISTS idx_entry_tags_tag_entry ON entry_tags(tag, entry_id);
             CREATE INDEX IF NOT EXISTS idx_entry_models_model_entry ON entry_models(model, entry_id);
+            CREATE INDEX IF NOT EXISTS idx_entries_title_nocase_status
+              ON entries(title COLLATE NOCASE, status);
+            CREATE INDEX IF NOT EXISTS idx_tags_name_nocase ON tags(name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_entry_models_model_nocase ON entry_models(model COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS models (
+              name TEXT PRIMARY KEY COLLATE NOCASE,
+              ref_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_thumbnail_hash
+              ON entries(thumbnail_hash) WHERE thumbnail_hash IS NOT NULL;
             """
         )
         lookup_version = conn.execute(
@@ -103,37 +245,69 @@ class PromptVaultStore:
                 "INSERT OR REPLACE INTO meta(key,value) VALUES('lookup_index_version', ?)",
                 ("1",),
             )
-
-    def _fts_upsert(self, conn, entry):
-        tags = " ".join(entry.get("tags", []))
-        content = " ".join(
-            [
-                entry.get("raw", {}).get("positive", ""),
-                entry.get("raw", {}).get("negative", ""),
-                json.dumps(entry.get("variables", {}), ensure_ascii=False),
-                json.dumps(entry.get("params", {}), ensure_ascii=False),
-            ]
-        )
-        conn.execute("DELETE FROM entries_fts WHERE entry_id = ?", (entry["id"],))
-        conn.execute(
-            "INSERT INTO entries_fts(entry_id,title,content,tags) VALUES(?,?,?,?)",
-            (entry["id"], entry.get("title", ""), content, tags),
-        )
-
-    @staticmethod
-    def _sync_lookup_rows(conn, entry_id, tags, model_scope):
-        conn.execute("DELETE FROM entry_tags WHERE entry_id = ?", (entry_id,))
-        conn.execute("DELETE FROM entry_models WHERE entry_id = ?", (entry_id,))
-        for tag in normalize_tags(tags or []):
+        refcount_version = conn.execute("SELECT value FROM meta WHERE key = 'tag_refcount_version'").fetchone()
+        if not refcount_version or refcount_version["value"] != "1":
+            self._reconcile_tags_table(conn)
+            conn.execute("UPDATE tags SET last_used = created_at WHERE last_used IS NULL")
             conn.execute(
-                "INSERT OR IGNORE INTO entry_tags(entry_id,tag) VALUES(?,?)",
-                (entry_id, tag),
+                "INSERT OR REPLACE INTO meta(key,value) VALUES('tag_refcount_version', ?)",
+                ("1",),
+            )
+        model_version = conn.execute("SELECT value FROM meta WHERE key = 'model_refcount_version'").fetchone()
+        if not model_version or model_version["value"] != "1":
+            self._reconcile_models_table(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta(key,value) VALUES('model_refcount_version', ?)",
+                ("1",),
             )
-        for model in normalize_tags(model_scope or []):
+        fts_version = conn.execute("SELECT value FROM meta WHERE key = 'fts_version'").fetchone()
+        if not fts_version or fts_version["value"] != FTS_SCHEMA_VERSION:
+            # 旧版 entries_fts 是自带内容副本、以 entry_id 关联的独立表，整体换成 external-content 表后重建。
+            conn.executescript(FTS_DROP_SQL)
+            conn.executescript(FTS_SCHEMA_SQL)
+            conn.execute("INSERT INTO entries_fts(entries_fts) VALUES('rebuild')")
             conn.execute(
-                "INSERT OR IGNORE INTO entry_models(entry_id,model) VALUES(?,?)",
-                (entry_id, model),
+                "INSERT OR REPLACE INTO meta(key,value) VALUES('fts_version', ?)",
+                (FTS_SCHEMA_VERSION,),
             )
+        else:
+            conn.executescript(FTS_SCHEMA_SQL)
+        thumb_version = conn.execute("SELECT value FROM meta WHERE key = 'thumbnail_table_version'").fetchone()
+        if not thumb_version or thumb_version["value"] != self.THUMBNAIL_TABLE_VERSION:
+            # 没有待处理的行（新库或已处理完）时直接标记完成；否则留给 migrate_thumbnails() 在线分批处理
+            if not conn.execute(f"SELECT 1 FROM entries WHERE {self.THUMBNAIL_PENDING_SQL} LIMIT 1").fetchone():
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta(key,value) VALUES('thumbnail_table_version', ?)",
+                    (self.THUMBNAIL_TABLE_VERSION,),
+                )
+
+    @staticmethod
+    def _sync_lookup_rows(conn, entry_id, tags, model_scope, old_tags=None, old_model_scope=None):
+        """按差异维护 entry_tags / entry_models，只删除移除的行、只插入新增的行。
+
+        old_tags / old_model_scope 为 None 表示该记录此前没有查找行（新建）。
+        """
+        changed = False
+        for table, column, values, old_values in (
+            ("entry_tags", "tag", tags, old_tags),
+            ("entry_models", "model", model_scope, old_model_scope),
+        ):
+            new_set = set(normalize_tags(values or []))
+            old_set = set(normalize_tags(old_values or []))
+            removed = sorted(old_set - new_set)
+            added = sorted(new_set - old_set)
+            if removed:
+                conn.executemany(
+                    f"DELETE FROM {table} WHERE entry_id = ? AND {column} = ?",
+                    [(entry_id, value) for value in removed],
+                )
+            if added:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {table}(entry_id,{column}) VALUES(?,?)",
+                    [(entry_id, value) for value in added],
+                )
+            changed = changed or bool(removed or added)
+        return changed
 
     def _rebuild_lookup_indexes(self, conn):
         conn.execute("DELETE FROM entry_tags")
@@ -153,41 +327,185 @@ class PromptVaultStore:
             self._sync_lookup_rows(conn, row["id"], tags, model_scope)
 
     @staticmethod
-    def _reconcile_tags_table(conn):
-        entry_rows = conn.execute(
-            "SELECT tags_json FROM entries WHERE status != 'deleted'"
-        ).fetchall()
-        used_tags = set()
-        for er in entry_rows:
-            try:
-                tag_list = json.loads(er["tags_json"] or "[]")
-            except Exception:
-                tag_list = []
-            for tag in normalize_tags(tag_list):
-                used_tags.add(tag)
-
-        rows = conn.execute("SELECT name FROM tags").fetchall()
-        all_tag_names = [r["name"] for r in rows]
-        removed = 0
-        for name in all_tag_names:
-            if name not in used_tags:
-                conn.execute("DELETE FROM tags WHERE name = ?", (name,))
-                removed += 1
-
-        existing_rows = conn.execute("SELECT name FROM tags").fetchall()
-        existing = {r["name"] for r in existing_rows}
-        missing = sorted(used_tags - existing)
-        now = now_iso()
-        added = 0
-        for name in missing:
-            conn.execute(
-                "INSERT OR IGNORE INTO tags(name,created_at) VALUES(?,?)",
-                (name, now),
+    def _tag_deltas(old_tags, old_status, new_tags, new_status):
+        """一次写入对标签（或模型）引用计数的增量；只统计未删除记录上的值。"""
+        old_set = set(normalize_tags(old_tags or [])) if old_status != "deleted" else set()
+        new_set = set(normalize_tags(new_tags or [])) if new_status != "deleted" else set()
+        deltas = {tag: 1 for tag in new_set - old_set}
+        deltas.update({tag: -1 for tag in old_set - new_set})
+        return deltas
+
+    @staticmethod
+    def _apply_tag_deltas(conn, deltas, now):
+        """按增量维护 tags.ref_count 与 last_used，计数归零的标签随即删除。"""
+        increments = [(tag, now, delta, now) for tag, delta in sorted(deltas.items()) if delta > 0]
+        decrements = [(-delta, tag) for tag, delta in sorted(deltas.items()) if delta < 0]
+        if increments:
+            conn.executemany(
+                """
+                INSERT INTO tags(name,created_at,ref_count,last_used) VALUES(?,?,?,?)
+                ON CONFLICT(name) DO UPDATE SET
+                  ref_count = ref_count + excluded.ref_count,
+                  last_used = excluded.last_used
+                """,
+                increments,
+            )
+        if decrements:
+            conn.executemany("UPDATE tags SET ref_count = ref_count - ? WHERE name = ?", decrements)
+            conn.executemany(
+                "DELETE FROM tags WHERE name = ? AND ref_count <= 0",
+                [(tag,) for _delta, tag in decrements],
             )
-            added += 1
-        return {"removed": removed, "added": added}
 
-    def create_entry(self, payload):
+    @staticmethod
+    def _apply_model_deltas(conn, deltas):
+        """按增量维护 models.ref_count，计数归零的模型随即删除；与 _apply_tag_deltas 对应。"""
+        increments = [(model, delta) for model, delta in sorted(deltas.items()) if delta > 0]
+        decrements = [(-delta, model) for model, delta in sorted(deltas.items()) if delta < 0]
+        if increments:
+            conn.executemany(
+                """
+                INSERT INTO models(name,ref_count) VALUES(?,?)
+                ON CONFLICT(name) DO UPDATE SET ref_count = ref_count + excluded.ref_count
+                """,
+                increments,
+            )
+        if decrements:
+            conn.executemany("UPDATE models SET ref_count = ref_count - ? WHERE name = ?", decrements)
+            conn.executemany(
+                "DELETE FROM models WHERE name = ? AND ref_count <= 0",
+                [(model,) for _delta, model in decrements],
+            )
+
+    @staticmethod
+    def _reconcile_models_table(conn):
+        """以 entry_models 为准重建 models 表的引用计数（大小写不同的模型名合并计数）。"""
+        conn.execute("DELETE FROM models")
+        conn.execute(
+            """
+            INSERT INTO models(name,ref_count)
+            SELECT MIN(em.model), COUNT(*)
+            FROM entry_models em
+            JOIN entries e ON e.id = em.entry_id
+            WHERE e.status != 'deleted'
+            GROUP BY em.model COLLATE NOCASE
+            """
+        )
+
+    @staticmethod
+    def _reconcile_tags_table(conn):
+        """以 entry_tags 为准校正 tags 表：删除无引用的标签、补齐缺失的标签、修正引用计数。"""
+        # 只取 entries 靠前的 status 列：缩略图 blob 之后的列会读到溢出页，整库统计时代价很高。
+        conn.execute("DROP TABLE IF EXISTS temp.tag_uses")
+        conn.execute(
+            """
+            CREATE TEMP TABLE tag_uses AS
+            SELECT et.tag AS name, COUNT(*) AS uses
+            FROM entry_tags et
+            JOIN entries e ON e.id = et.entry_id
+            WHERE e.status != 'deleted'
+            GROUP BY et.tag
+            """
+        )
+        conn.execute("CREATE UNIQUE INDEX temp.tag_uses_name ON tag_uses(name)")
+        try:
+            removed = conn.execute(
+                "DELETE FROM tags WHERE NOT EXISTS (SELECT 1 FROM temp.tag_uses u WHERE u.name = tags.name)"
+            ).rowcount
+            fixed = conn.execute(
+                """
+                UPDATE tags SET ref_count = u.uses
+                FROM temp.tag_uses u
+                WHERE u.name = tags.name AND tags.ref_count != u.uses
+                """
+            ).rowcount
+            added = conn.execute(
+                """
+                INSERT INTO tags(name,created_at,ref_count,last_used)
+                SELECT u.name, ?1, u.uses, ?1
+                FROM temp.tag_uses u
+                WHERE NOT EXISTS (SELECT 1 FROM tags t WHERE t.name = u.name)
+                """,
+                (now_iso(),),
+            ).rowcount
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.tag_uses")
+        return {"removed": removed, "added": added, "fixed": fixed}
+
+    _ENTRY_INSERT_SQL = """
+        INSERT INTO entries(
+          id,title,status,version,lang,template_id,tags_json,model_scope_json,
+          variables_json,fragments_json,raw_json,negative_json,params_json,
+          has_thumbnail,thumbnail_hash,thumbnail_width,thumbnail_height,hash,created_at,updated_at
+        ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """
+
+    _VERSION_INSERT_SQL = (
+        "INSERT INTO entry_versions(entry_id,version,snapshot_json,snapshot_blob,keyframe,created_at) "
+        "VALUES(?,?,'',?,?,?)"
+    )
+
+    @staticmethod
+    def _pack_snapshot(obj):
+        return sqlite3.Binary(zlib.compress(json_dumps(obj).encode("utf-8"), 6))
+
+    @staticmethod
+    def _unpack_snapshot(row):
+        if row["snapshot_blob"] is None:
+            return json.loads(row["snapshot_json"])
+        return json.loads(zlib.decompress(row["snapshot_blob"]).decode("utf-8"))
+
+    @classmethod
+    def _version_snapshot(cls, entry):
+        return json.loads(json_dumps({k: v for k, v in entry.items() if k not in cls.VERSION_SNAPSHOT_EXCLUDE}))
+
+    def _load_version(self, conn, entry_id, version=None):
+        """从最近的关键帧起依次应用差量，还原 version（默认最新）对应的快照。
+
+        返回 (row, snapshot, chain_length)；不存在时返回 (None, None, 0)。
+        游标按版本倒序读取，遇到关键帧即停止，不会读取更早的历史。
+        """
+        sql = "SELECT version, created_at, keyframe, snapshot_json, snapshot_blob FROM entry_versions WHERE entry_id = ?"
+        params = [entry_id]
+        if version is not None:
+            sql += " AND version <= ?"
+            params.append(int(version))
+        chain = []
+        for row in conn.execute(sql + " ORDER BY version DESC, id DESC", params):
+            chain.append(row)
+            if row["keyframe"]:
+                break
+        if not chain or not chain[-1]["keyframe"]:
+            return None, None, 0
+        snapshot = self._unpack_snapshot(chain[-1])
+        for row in reversed(chain[:-1]):
+            snapshot = apply_json_delta(snapshot, self._unpack_snapshot(row))
+        return chain[0], snapshot, len(chain)
+
+    def _write_version(self, conn, entry, created_at, new=False):
+        """写入一行版本历史：距上一关键帧满 VERSION_KEYFRAME_INTERVAL 时写完整快照，否则写差量。"""
+        snapshot = self._version_snapshot(entry)
+        previous, chain_length = None, 0
+        if not new:
+            _row, previous, chain_length = self._load_version(conn, entry["id"])
+        if previous is None or chain_length >= self.VERSION_KEYFRAME_INTERVAL:
+            payload, keyframe = snapshot, 1
+        else:
+            payload, keyframe = json_delta(previous, snapshot), 0
+        conn.execute(
+            self._VERSION_INSERT_SQL,
+            (entry["id"], entry["version"], self._pack_snapshot(payload), keyframe, created_at),
+        )
+
+    @staticmethod
+    def new_entry_id():
+        """生成记录 id；后台保存在写库之前就要返回 id，因此单独提供。"""
+        return f"entry_{uuid.uuid4().hex}"
+
+    def _new_entry_obj(self, payload, now):
+        """把新建请求规范化为 (entry_obj, thumbnail_blob)，不触碰数据库。"""
+        if not isinstance(payload, dict):
+            raise ValueError("记录必须是 JSON 对象")
         title = normalize_text(payload.get("title", "")) or "未命名"
         tags = normalize_tags(payload.get("tags", []))
         model_scope = normalize_tags(payload.get("model_scope", []))
@@ -205,8 +523,7 @@ class PromptVaultStore:
         thumb_w = int(payload.get("thumbnail_width") or 0) or None
         thumb_h = int(payload.get("thumbnail_height") or 0) or None
 
-        entry_id = payload.get("id") or f"entry_{uuid.uuid4().hex}"
-        now = now_iso()
+        entry_id = payload.get("id") or self.new_entry_id()
 
         entry_obj = {
             "id": entry_id,
@@ -223,58 +540,157 @@ class PromptVaultStore:
             "negative": payload.get("negative") or {"fragments": [], "raw": raw_neg},
             "params": params,
             "has_thumbnail": has_thumbnail,
+            "thumbnail_hash": content_hash(thumbnail_png) if has_thumbnail else None,
             "thumbnail_width": thumb_w,
             "thumbnail_height": thumb_h,
         }
         entry_obj["hash"] = stable_hash(entry_obj)
         entry_obj["created_at"] = now
         entry_obj["updated_at"] = now
+        blob = sqlite3.Binary(bytes(thumbnail_png)) if has_thumbnail else None
+        return entry_obj, blob
+
+    @staticmethod
+    def _entry_insert_params(entry_obj):
+        return (
+            entry_obj["id"],
+            entry_obj["title"],
+            entry_obj["status"],
+            entry_obj["version"],
+            entry_obj["lang"],
+            entry_obj["template_id"],
+            json_dumps(entry_obj["tags"]),
+            json_dumps(entry_obj["model_scope"]),
+            json_dumps(entry_obj["variables"]),
+            json_dumps(entry_obj["fragments"]),
+            json_dumps(entry_obj["raw"]),
+            json_dumps(entry_obj["negative"]),
+            json_dumps(entry_obj["params"]),
+            int(bool(entry_obj["has_thumbnail"])),
+            entry_obj["thumbnail_hash"],
+            entry_obj["thumbnail_width"],
+            entry_obj["thumbnail_height"],
+            entry_obj["hash"],
+            entry_obj["created_at"],
+            entry_obj["updated_at"],
+        )
+
+    def create_entry(self, payload):
+        now = now_iso()
+        entry_obj, thumbnail_blob = self._new_entry_obj(payload, now)
 
         conn = self._connect()
         try:
-            conn.execute(
-                """
-                INSERT INTO entries(
-                  id,title,status,version,lang,template_id,tags_json,model_scope_json,
-                  variables_json,fragments_json,raw_json,negative_json,params_json,
-                  thumbnail_png,thumbnail_width,thumbnail_height,hash,created_at,updated_at
-                ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """,
-                (
-                    entry_obj["id"],
-                    entry_obj["title"],
-                    entry_obj["status"],
-                    entry_obj["version"],
-                    entry_obj["lang"],
-                    entry_obj["template_id"],
-                    json_dumps(entry_obj["tags"]),
-                    json_dumps(entry_obj["model_scope"]),
-                    json_dumps(entry_obj["variables"]),
-                    json_dumps(entry_obj["fragments"]),
-                    json_dumps(entry_obj["raw"]),
-                    json_dumps(entry_obj["negative"]),
-                    json_dumps(entry_obj["params"]),
-                    sqlite3.Binary(bytes(thumbnail_png)) if has_thumbnail else None,
-                    entry_obj["thumbnail_width"],
-                    entry_obj["thumbnail_height"],
-                    entry_obj["hash"],
-                    entry_obj["created_at"],
-                    entry_obj["updated_at"],
-                ),
-            )
-            conn.execute(
-                "INSERT INTO entry_versions(entry_id,version,snapshot_json,created_at) VALUES(?,?,?,?)",
-                (entry_obj["id"], 1, json_dumps(entry_obj), now),
-            )
-            for t in tags:
-                conn.execute("INSERT OR IGNORE INTO tags(name,created_at) VALUES(?,?)", (t, now))
+            thumb_hash = entry_obj["thumbnail_hash"]
+            features = self._compute_thumbnail_features(conn, [(thumb_hash, thumbnail_blob)])
+            conn.execute(self._ENTRY_INSERT_SQL, self._entry_insert_params(entry_obj))
+            if thumbnail_blob is not None:
+                self._add_thumbnail_refs(
+                    conn,
+                    [(thumb_hash, thumbnail_blob, payload.get("thumbnail_renditions"), features.get(thumb_hash))],
+                )
+            self._write_version(conn, entry_obj, now, new=True)
+            self._apply_tag_deltas(conn, {t: 1 for t in entry_obj["tags"]}, now)
+            self._apply_model_deltas(conn, {m: 1 for m in entry_obj["model_scope"]})
             self._sync_lookup_rows(conn, entry_obj["id"], entry_obj["tags"], entry_obj["model_scope"])
-            self._fts_upsert(conn, entry_obj)
             conn.commit()
+            self._invalidate_read_caches()
             return entry_obj
         finally:
             conn.close()
 
+    def create_entries(self, payloads):
+        """批量新建记录：逐条校验、规范化后用 executemany 在一个事务里写入。
+
+        返回 {"items": [...], "created": n, "failed": m}，items 与 payloads 一一对应，
+        成功项为 {"index", "ok": True, "entry"}，失败项为 {"index", "ok": False, "error"}。
+        单条失败不影响其余记录。
+        """
+        if not isinstance(payloads, list):
+            raise ValueError("entries 必须是数组")
+        if len(payloads) > self.CREATE_BATCH_LIMIT:
+            raise ValueError(f"单次最多新建 {self.CREATE_BATCH_LIMIT} 条记录")
+
+        now = now_iso()
+        results = []
+        accepted = []
+        seen_ids = set()
+        for index, payload in enumerate(payloads):
+            try:
+                entry_obj, thumbnail_blob = self._new_entry_obj(payload, now)
+            except (TypeError, ValueError) as exc:
+                results.append({"index": index, "ok": False, "error": str(exc)})
+                continue
+            if entry_obj["id"] in seen_ids:
+                results.append({"index": index, "ok": False, "error": f"记录 ID 重复: {entry_obj['id']}"})
+                continue
+            seen_ids.add(entry_obj["id"])
+            results.append({"index": index, "ok": True, "entry": entry_obj})
+            accepted.append((index, entry_obj, thumbnail_blob))
+
+        conn = self._connect()
+        try:
+            if accepted:
+                # 调用方显式指定的 ID 可能已存在，先剔除，避免整批因主键冲突回滚。
+                explicit_ids = [entry["id"] for _index, entry, _blob in accepted]
+                existing = set()
+                for start in range(0, len(explicit_ids), 500):
+                    chunk = explicit_ids[start:start + 500]
+                    placeholders = ",".join("?" for _ in chunk)
+                    existing.update(
+                        row["id"]
+                        for row in conn.execute(f"SELECT id FROM entries WHERE id IN ({placeholders})", chunk)
+                    )
+                if existing:
+                    for index, entry, _blob in accepted:
+                        if entry["id"] in existing:
+                            results[index] = {"index": index, "ok": False, "error": f"记录已存在: {entry['id']}"}
+                    accepted = [item for item in accepted if item[1]["id"] not in existing]
+
+            entries = [entry for _index, entry, _blob in accepted]
+            features = self._compute_thumbnail_features(
+                conn, [(entry["thumbnail_hash"], blob) for _index, entry, blob in accepted]
+            )
+            if entries:
+                conn.executemany(
+                    self._ENTRY_INSERT_SQL,
+                    [self._entry_insert_params(entry) for _index, entry, _blob in accepted],
+                )
+                self._add_thumbnail_refs(
+                    conn,
+                    [
+                        (
+                            entry["thumbnail_hash"],
+                            blob,
+                            payloads[index].get("thumbnail_renditions"),
+                            features.get(entry["thumbnail_hash"]),
+                        )
+                        for index, entry, blob in accepted
+                        if blob is not None
+                    ],
+                )
+                conn.executemany(
+                    self._VERSION_INSERT_SQL,
+                    [(entry["id"], 1, self._pack_snapshot(entry), 1, now) for entry in entries],
+                )
+                self._apply_tag_deltas(conn, Counter(tag for entry in entries for tag in entry["tags"]), now)
+                self._apply_model_deltas(conn, Counter(model for entry in entries for model in entry["model_scope"]))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO entry_tags(entry_id,tag) VALUES(?,?)",
+                    [(entry["id"], tag) for entry in entries for tag in entry["tags"]],
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO entry_models(entry_id,model) VALUES(?,?)",
+                    [(entry["id"], model) for entry in entries for model in entry["model_scope"]],
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        if entries:
+            self._invalidate_read_caches()
+        created = sum(1 for item in results if item["ok"])
+        return {"items": results, "created": created, "failed": len(results) - created}
+
     def upsert_fragment(self, payload):
         frag_id = payload.get("id") or f"frag_{uuid.uuid4().hex}"
         title = normalize_text(payload.get("title", "")) or "未命名片段"
@@ -380,17 +796,102 @@ class PromptVaultStore:
         conn = self._connect()
         try:
             rows = conn.execute(
-                "SELECT name, created_at FROM tags ORDER BY name ASC LIMIT ?",
+                "SELECT name, created_at, ref_count, last_used FROM tags ORDER BY name ASC LIMIT ?",
                 (int(limit),),
             ).fetchall()
-            return [{"name": r["name"], "created_at": r["created_at"]} for r in rows]
+            return [
+                {
+                    "name": r["name"],
+                    "created_at": r["created_at"],
+                    "count": int(r["ref_count"] or 0),
+                    "last_used": r["last_used"],
+                }
+                for r in rows
+            ]
+        finally:
+            conn.close()
+
+    def autocomplete(self, field, prefix="", limit=10):
+        """按前缀补全标题/标签/模型，按使用次数排序。
+
+        走 COLLATE NOCASE 索引上的区间扫描（prefix <= x < prefix + U+10FFFF），
+        结果在进程内做小型 LRU 缓存，写操作后整体失效。
+        """
+        field = normalize_text(field).lower()
+        if field not in self.AUTOCOMPLETE_FIELDS:
+            raise ValueError(f"unsupported autocomplete field: {field}")
+        prefix = normalize_text(prefix)
+        limit = max(1, min(50, int(limit)))
+        if field == "title" and not prefix:
+            return []
+        key = (field, prefix.lower(), limit)
+
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._autocomplete_cache.get(key)
+            if cached and now - cached[0] < self.AUTOCOMPLETE_CACHE_TTL:
+                self._autocomplete_cache.move_to_end(key)
+                return [dict(item) for item in cached[1]]
+
+        sql, params = self._autocomplete_query(field, prefix, limit)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
         finally:
             conn.close()
+        items = [{"value": r["value"], "count": int(r["uses"] or 0)} for r in rows]
+
+        with self._cache_lock:
+            self._autocomplete_cache[key] = (now, items)
+            self._autocomplete_cache.move_to_end(key)
+            while len(self._autocomplete_cache) > self.AUTOCOMPLETE_CACHE_SIZE:
+                self._autocomplete_cache.popitem(last=False)
+        return [dict(item) for item in items]
+
+    @staticmethod
+    def _autocomplete_query(field, prefix, limit):
+        # tags / models 表只保留仍被有效记录引用的值，次数即增量维护的 ref_count。
+        if field == "tag":
+            column, source = "t.name", "tags t"
+        elif field == "model":
+            column, source = "m.name", "models m"
+        else:
+            column, source = "e.title", "entries e"
+        where = []
+        params = []
+        if prefix:
+            where.append(f"{column} COLLATE NOCASE >= ? AND {column} COLLATE NOCASE < ?")
+            params.extend([prefix, prefix + "\U0010ffff"])
+        if field == "title":
+            where.append("e.status != 'deleted'")
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        if field != "title":
+            sql = f"""
+            SELECT {column} AS value, ref_count AS uses
+            FROM {source}
+            {where_sql}
+            ORDER BY uses DESC, value ASC
+            LIMIT ?
+            """
+        else:
+            sql = f"""
+            SELECT {column} AS value, COUNT(*) AS uses
+            FROM {source}
+            {where_sql}
+            GROUP BY {column} COLLATE NOCASE
+            ORDER BY uses DESC, value ASC
+            LIMIT ?
+            """
+        return sql, params + [int(limit)]
+
+    def _invalidate_read_caches(self):
+        with self._cache_lock:
+            self._autocomplete_cache.clear()
 
     def get_entry(self, entry_id):
         conn = self._connect()
         try:
-            row = conn.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            row = conn.execute(f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE id = ?", (entry_id,)).fetchone()
             if not row:
                 raise KeyError("entry not found")
             return self._row_to_entry(row)
@@ -401,7 +902,10 @@ class PromptVaultStore:
         conn = self._connect()
         try:
             row = conn.execute(
-                "SELECT thumbnail_png, thumbnail_width, thumbnail_height FROM entries WHERE id = ?",
+                f"""
+                SELECT {self.THUMBNAIL_DATA_SQL} AS thumbnail_png, e.thumbnail_width, e.thumbnail_height
+                FROM entries e WHERE e.id = ?
+                """,
                 (entry_id,),
             ).fetchone()
             if not row:
@@ -417,29 +921,351 @@ class PromptVaultStore:
         finally:
             conn.close()
 
+    def _locate_thumbnail(self, conn, entry_id, width=None, accept_webp=True, known_hashes=()):
+        """按宽度挑选要返回的缩略图，只读元数据和 blob 所在行的位置，不读 blob。
+
+        客户端接受 WebP 且存在副本时，取宽度不小于 width 的最小副本（都比 width 小则取最大的）；
+        否则退回原始 PNG。返回 {format, width, height, hash, thumbnail_hash, matched, source}，
+        source 为 blobopen 用的 (表, 列, rowid)；matched 表示选中内容的哈希在 known_hashes 中
+        （条件请求命中）。没有缩略图返回 None，记录不存在时抛 KeyError。
+        """
+        width = int(width or self.THUMBNAIL_DEFAULT_WIDTH)
+        row = None
+        if accept_webp:
+            row = conn.execute(
+                """
+                SELECT r.format, r.width, r.height, r.hash, e.thumbnail_hash, r.rowid AS source_rowid
+                FROM entries e JOIN thumbnail_renditions r ON r.blob_hash = e.thumbnail_hash
+                WHERE e.id = ? AND r.format = 'webp'
+                ORDER BY r.width < ?, CASE WHEN r.width >= ? THEN r.width ELSE -r.width END
+                LIMIT 1
+                """,
+                (entry_id, width, width),
+            ).fetchone()
+        if row is not None:
+            source = ("thumbnail_renditions", "data", row["source_rowid"])
+        else:
+            row = conn.execute(
+                """
+                SELECT 'png' AS format, e.thumbnail_width AS width, e.thumbnail_height AS height,
+                  e.thumbnail_hash AS hash, e.thumbnail_hash,
+                  (SELECT b.rowid FROM thumbnail_blobs b WHERE b.blob_hash = e.thumbnail_hash) AS blob_rowid,
+                  CASE WHEN e.thumbnail_png IS NOT NULL THEN e.rowid END AS inline_rowid
+                FROM entries e WHERE e.id = ?
+                """,
+                (entry_id,),
+            ).fetchone()
+            if row is None:
+                raise KeyError("entry not found")
+            # 与 THUMBNAIL_DATA_SQL 的优先顺序一致：去重表，迁移完成前退回内联列
+            candidates = (
+                ("thumbnail_blobs", "data", row["blob_rowid"]),
+                ("entries", "thumbnail_png", row["inline_rowid"]),
+            )
+            source = next((item for item in candidates if item[2] is not None), None)
+            if source is None:
+                return None
+        return {
+            "format": row["format"],
+            "width": row["width"],
+            "height": row["height"],
+            "hash": row["hash"],
+            "thumbnail_hash": row["thumbnail_hash"],
+            "matched": bool(row["hash"]) and row["hash"] in (known_hashes or ()),
+            "source": source,
+        }
+
+    def get_thumbnail_rendition(self, entry_id, width=None, accept_webp=True, known_hashes=()):
+        """按宽度挑选并读出缩略图，选取规则见 _locate_thumbnail。
+
+        返回 {data, format, width, height, hash, thumbnail_hash}，thumbnail_hash 是原始 PNG 的哈希。
+        条件请求命中时不读取 blob，data 为 None。没有缩略图返回 None，记录不存在时抛 KeyError。
+        """
+        conn = self._connect()
+        try:
+            picked = self._locate_thumbnail(conn, entry_id, width, accept_webp, known_hashes)
+            if picked is None:
+                return None
+            data = None
+            if not picked["matched"]:
+                with conn.blobopen(*picked["source"], readonly=True) as blob:
+                    data = blob.read()
+        finally:
+            conn.close()
+        return {
+            "data": data,
+            "format": picked["format"],
+            "width": picked["width"],
+            "height": picked["height"],
+            "hash": picked["hash"],
+            "thumbnail_hash": picked["thumbnail_hash"],
+        }
+
+    def open_thumbnail_stream(self, entry_id, width=None, accept_webp=True, known_hashes=(), chunk_size=None):
+        """同 get_thumbnail_rendition，但不把 blob 整个读进内存：返回的 chunks 是按块读取
+        （sqlite3 增量 blob I/O）的迭代器，另带 length 字节数。
+
+        连接在 chunks 读完、被 close() 或被回收时释放，调用方需在 try/finally 中消费。条件请求命中或
+        没有缩略图时不打开 blob，chunks 为 None。库是 WAL 模式，流式读取期间不阻塞写入；
+        若该 blob 在读取途中被删除，读取会抛 sqlite3.OperationalError。
+        """
+        chunk_size = max(1, int(chunk_size or self.THUMBNAIL_STREAM_CHUNK_SIZE))
+        conn = self._connect()
+        try:
+            picked = self._locate_thumbnail(conn, entry_id, width, accept_webp, known_hashes)
+            if picked is None or picked["matched"]:
+                conn.close()
+                return picked and {**picked, "length": None, "chunks": None}
+            blob = conn.blobopen(*picked["source"], readonly=True)
+        except Exception:
+            conn.close()
+            raise
+        return {**picked, "length": len(blob), "chunks": self._iter_blob_chunks(conn, blob, chunk_size)}
+
+    @staticmethod
+    def _iter_blob_chunks(conn, blob, chunk_size):
+        try:
+            while True:
+                chunk = blob.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            blob.close()
+            conn.close()
+
+    def get_thumbnails(self, entry_ids, width=None, accept_webp=True):
+        """一次查询取出一组记录的缩略图，选取规则同 get_thumbnail_rendition。
+
+        返回 (items, missing)：items 按请求顺序排列，每项为 {id, data, format, width, height, hash}；
+        missing 是不存在或没有缩略图的 id。
+        """
+        if not isinstance(entry_ids, list) or not all(isinstance(i, str) for i in entry_ids):
+            raise ValueError("ids 必须是字符串数组")
+        if len(entry_ids) > self.THUMBNAIL_BATCH_LIMIT:
+            raise ValueError(f"单次最多获取 {self.THUMBNAIL_BATCH_LIMIT} 个缩略图")
+        ids = list(dict.fromkeys(entry_ids))
+        if not ids:
+            return [], []
+        width = int(width or self.THUMBNAIL_DEFAULT_WIDTH)
+        conn = self._connect()
+        try:
+            # 先只对副本的 rowid 排名，再按 rowid 回表取 blob，未选中的副本不会被读出
+            rows = conn.execute(
+                f"""
+                WITH wanted AS (SELECT DISTINCT value AS entry_id FROM json_each(?)),
+                ranked AS (
+                  SELECT r.rowid AS rid, e.id AS entry_id,
+                    ROW_NUMBER() OVER (
+                      PARTITION BY e.id
+                      ORDER BY r.width < ?, CASE WHEN r.width >= ? THEN r.width ELSE -r.width END
+                    ) AS rank
+                  FROM wanted w
+                  JOIN entries e ON e.id = w.entry_id
+                  JOIN thumbnail_renditions r ON r.blob_hash = e.thumbnail_hash
+                  WHERE ? AND r.format = 'webp'
+                )
+                SELECT e.id,
+                  COALESCE(k.format, 'png') AS format,
+                  COALESCE(k.width, e.thumbnail_width) AS width,
+                  COALESCE(k.height, e.thumbnail_height) AS height,
+                  CASE WHEN k.rowid IS NOT NULL THEN k.hash ELSE e.thumbnail_hash END AS hash,
+                  CASE WHEN k.rowid IS NOT NULL THEN k.data ELSE {self.THUMBNAIL_DATA_SQL} END AS data
+                FROM wanted w
+                JOIN entries e ON e.id = w.entry_id
+                LEFT JOIN ranked x ON x.entry_id = e.id AND x.rank = 1
+                LEFT JOIN thumbnail_renditions k ON k.rowid = x.rid
+                """,
+                (json.dumps(ids), width, width, 1 if accept_webp else 0),
+            ).fetchall()
+        finally:
+            conn.close()
+        found = {
+            row["id"]: {
+                "id": row["id"],
+                "data": bytes(row["data"]),
+                "format": row["format"],
+                "width": row["width"],
+                "height": row["height"],
+                "hash": row["hash"],
+            }
+            for row in rows
+            if row["data"] is not None
+        }
+        return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+    _RENDITION_INSERT_SQL = (
+        "INSERT OR REPLACE INTO thumbnail_renditions(blob_hash,format,width,height,data,hash) "
+        "VALUES(?,?,?,?,?,?)"
+    )
+
+    @staticmethod
+    def _rendition_rows(blob_hash, renditions):
+        """把 [{format, width, height, data}] 规范化为 thumbnail_renditions 的插入参数。"""
+        rows = []
+        for item in renditions or []:
+            data = item.get("data") if isinstance(item, dict) else None
+            if not isinstance(data, (bytes, bytearray)) or not data:
+                continue
+            rows.append(
+                (
+                    blob_hash,
+                    str(item.get("format") or "webp"),
+                    int(item["width"]),
+                    int(item["height"]),
+                    sqlite3.Binary(bytes(data)),
+                    content_hash(data),
+                )
+            )
+        return rows
+
+    @staticmethod
+    def _existing_thumbnail_hashes(conn, hashes):
+        """返回 hashes 中已在 thumbnail_blobs 里的哈希；只查主键索引，不读 blob。"""
+        hashes = list(dict.fromkeys(h for h in hashes if h))
+        existing = set()
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            existing.update(
+                row["blob_hash"]
+                for row in conn.execute(
+                    f"SELECT blob_hash FROM thumbnail_blobs WHERE blob_hash IN ({placeholders})", chunk
+                )
+            )
+        return existing
+
+    def _add_thumbnail_refs(self, conn, items):
+        """登记一批缩略图引用，items 为 [(thumbnail_hash, blob, renditions, features)]。
+
+        哈希已存在的只增加引用计数，blob 和副本都不写；blob 为 None 的项要求哈希已存在。
+        features 是事务开始前由 _compute_thumbnail_features 算好的结果，为 None 时留给
+        backfill_thumbnail_features 补算。返回实际写入的 blob 数。
+        """
+        items = [item for item in items if item[0]]
+        if not items:
+            return 0
+        existing = self._existing_thumbnail_hashes(conn, [item[0] for item in items])
+        fresh = {}
+        for thumb_hash, blob, renditions, features in items:
+            if thumb_hash not in existing and thumb_hash not in fresh:
+                if blob is None:
+                    raise ValueError(f"缩略图不存在: {thumb_hash}")
+                fresh[thumb_hash] = (blob, renditions, features)
+        if fresh:
+            conn.executemany(
+                "INSERT INTO thumbnail_blobs(blob_hash, data, refcount) VALUES(?, ?, 0)",
+                [(thumb_hash, blob) for thumb_hash, (blob, _r, _f) in fresh.items()],
+            )
+            conn.executemany(
+                self._RENDITION_INSERT_SQL,
+                [
+                    row
+                    for thumb_hash, (_b, renditions, _f) in fresh.items()
+                    for row in self._rendition_rows(thumb_hash, renditions)
+                ],
+            )
+            self._write_thumbnail_features(
+                conn,
+                [(thumb_hash, features) for thumb_hash, (_b, _r, features) in fresh.items() if features is not None],
+            )
+        self._apply_thumbnail_refs(conn, Counter(item[0] for item in items))
+        return len(fresh)
+
+    def _compute_thumbnail_features(self, conn, items):
+        """为 [(thumbnail_hash, png)] 里库中还没有的缩略图计算感知哈希和列表占位图。
+
+        必须在写事务开始之前调用，PNG 解码和占位图编码不占着写锁。返回 {thumbnail_hash: features}，
+        无法解码的为 {}（写入时两者记为 NULL，不再重试）。
+        """
+        from .thumbnails import thumbnail_features
+
+        pending = {}
+        for thumb_hash, blob in items:
+            if thumb_hash and blob is not None:
+                pending.setdefault(thumb_hash, blob)
+        if not pending:
+            return {}
+        existing = self._existing_thumbnail_hashes(conn, list(pending))
+        hashes = [thumb_hash for thumb_hash in pending if thumb_hash not in existing]
+        features = thumbnail_features([bytes(pending[thumb_hash]) for thumb_hash in hashes])
+        return {thumb_hash: feature or {} for thumb_hash, feature in zip(hashes, features)}
+
+    @staticmethod
+    def _write_thumbnail_features(conn, items):
+        """写入一批已经算好的 (thumbnail_hash, features)，只写仍存在的 blob。返回写入数。"""
+        written = conn.executemany(
+            """
+            INSERT OR REPLACE INTO thumbnail_phashes(blob_hash, phash)
+            SELECT ?, ? WHERE EXISTS (SELECT 1 FROM thumbnail_blobs WHERE blob_hash = ?)
+            """,
+            [(thumb_hash, features.get("phash"), thumb_hash) for thumb_hash, features in items],
+        ).rowcount
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO thumbnail_placeholders(blob_hash, color, data)
+            SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM thumbnail_blobs WHERE blob_hash = ?)
+            """,
+            [
+                (thumb_hash, features.get("color"), features.get("placeholder"), thumb_hash)
+                for thumb_hash, features in items
+            ],
+        )
+        return max(0, written)
+
+    @staticmethod
+    def _apply_thumbnail_refs(conn, deltas):
+        """按增量维护 thumbnail_blobs.refcount，计数归零的 blob 随即删除（副本随外键级联删除）。
+
+        返回删除的 blob 数。
+        """
+        deltas = {thumb_hash: delta for thumb_hash, delta in deltas.items() if thumb_hash and delta}
+        if not deltas:
+            return 0
+        conn.executemany(
+            "UPDATE thumbnail_blobs SET refcount = refcount + ? WHERE blob_hash = ?",
+            [(delta, thumb_hash) for thumb_hash, delta in sorted(deltas.items())],
+        )
+        decrements = [(thumb_hash,) for thumb_hash, delta in sorted(deltas.items()) if delta < 0]
+        if not decrements:
+            return 0
+        return conn.executemany("DELETE FROM thumbnail_blobs WHERE blob_hash = ? AND refcount <= 0", decrements).rowcount
+
+    def _replace_thumbnail(self, conn, entry_id, old_hash, new_hash, blob=None, renditions=None, features=None):
+        """把一条记录的缩略图引用从 old_hash 换成 new_hash（均可为 None）。
+
+        缩略图还内联在 entries 时一并清除，且旧引用没有计数、不扣减。调用方负责更新
+        entries 上的 has_thumbnail / thumbnail_hash / 尺寸列。
+        """
+        if conn.execute(
+            "UPDATE entries SET thumbnail_png = NULL WHERE id = ? AND thumbnail_png IS NOT NULL", (entry_id,)
+        ).rowcount:
+            old_hash = None
+        if new_hash:
+            self._add_thumbnail_refs(conn, [(new_hash, blob, renditions, features)])
+        if old_hash:
+            self._apply_thumbnail_refs(conn, {old_hash: -1})
+
     def update_entry(self, entry_id, payload):
         conn = self._connect()
         try:
-            row = conn.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            row = conn.execute(f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE id = ?", (entry_id,)).fetchone()
             if not row:
                 raise KeyError("entry not found")
-            payload_version = payload.get("version")
-            payload_updated_at = normalize_text(payload.get("updated_at", ""))
-            if payload_version is None and not payload_updated_at:
-                raise ValueError("update requires version or updated_at")
-            if payload_version is not None:
-                try:
-                    expected_version = int(payload_version)
-                except (TypeError, ValueError):
-                    raise ValueError("invalid version")
+            expected_version, expected_updated_at = self._expected_revision(payload)
+            if expected_version is not None:
                 if expected_version != int(row["version"]):
                     raise OptimisticLockError("stale version")
-            elif payload_updated_at != normalize_text(row["updated_at"]):
+            elif expected_updated_at != normalize_text(row["updated_at"]):
                 raise OptimisticLockError("stale updated_at")
             entry = self._row_to_entry(row)
+            old_tags = list(entry["tags"])
+            old_model_scope = list(entry["model_scope"])
+            old_status = entry["status"]
 
-            current_thumb_blob = row["thumbnail_png"]
-            thumb_blob = current_thumb_blob
+            thumb_changed = False
+            has_thumbnail = bool(row["has_thumbnail"])
+            thumb_hash = row["thumbnail_hash"]
             thumb_w = row["thumbnail_width"]
             thumb_h = row["thumbnail_height"]
 
@@ -474,6 +1300,7 @@ class PromptVaultStore:
                     entry["score"] = 0.0
             if "thumbnail_png" in payload:
                 new_thumb = payload.get("thumbnail_png")
+                thumb_changed = True
                 if isinstance(new_thumb, (bytes, bytearray)) and len(new_thumb) > 0:
                     thumb_blob = sqlite3.Binary(bytes(new_thumb))
                     thumb_w = int(payload.get("thumbnail_width") or 0) or None
@@ -482,16 +1309,30 @@ class PromptVaultStore:
                     thumb_blob = None
                     thumb_w = None
                     thumb_h = None
+                has_thumbnail = thumb_blob is not None
+                thumb_hash = content_hash(thumb_blob) if has_thumbnail else None
 
-            entry["has_thumbnail"] = thumb_blob is not None
+            entry["has_thumbnail"] = has_thumbnail
+            entry["thumbnail_hash"] = thumb_hash
             entry["thumbnail_width"] = thumb_w
             entry["thumbnail_height"] = thumb_h
             entry["version"] = int(entry.get("version", 1)) + 1
             entry["updated_at"] = now_iso()
             entry["hash"] = stable_hash(entry)
 
+            if thumb_changed:
+                features = self._compute_thumbnail_features(conn, [(thumb_hash, thumb_blob)])
+                self._replace_thumbnail(
+                    conn,
+                    entry["id"],
+                    row["thumbnail_hash"],
+                    thumb_hash,
+                    thumb_blob,
+                    payload.get("thumbnail_renditions"),
+                    features.get(thumb_hash),
+                )
             conn.execute(
-                """
+                f"""
                 UPDATE entries SET
                   title=?,
                   status=?,
@@ -502,7 +1343,8 @@ class PromptVaultStore:
                   raw_json=?,
                   negative_json=?,
                   params_json=?,
-                  thumbnail_png=?,
+                  has_thumbnail=?,
+                  thumbnail_hash=?,
                   thumbnail_width=?,
                   thumbnail_height=?,
                   favorite=?,
@@ -521,7 +1363,8 @@ class PromptVaultStore:
                     json_dumps(entry["raw"]),
                     json_dumps(entry["negative"]),
                     json_dumps(entry.get("params", {})),
-                    thumb_blob,
+                    int(has_thumbnail),
+                    thumb_hash,
                     thumb_w,
                     thumb_h,
                     entry.get("favorite", 0),
@@ -531,26 +1374,314 @@ class PromptVaultStore:
                     entry["id"],
                 ),
             )
-            conn.execute(
-                "INSERT INTO entry_versions(entry_id,version,snapshot_json,created_at) VALUES(?,?,?,?)",
-                (entry["id"], entry["version"], json_dumps(entry), entry["updated_at"]),
+            self._write_version(conn, entry, entry["updated_at"])
+            self._apply_tag_deltas(
+                conn,
+                self._tag_deltas(old_tags, old_status, entry["tags"], entry["status"]),
+                entry["updated_at"],
+            )
+            self._apply_model_deltas(
+                conn, self._tag_deltas(old_model_scope, old_status, entry["model_scope"], entry["status"])
+            )
+            self._sync_lookup_rows(
+                conn, entry["id"], entry["tags"], entry["model_scope"], old_tags, old_model_scope
             )
-            for t in entry["tags"]:
-                conn.execute("INSERT OR IGNORE INTO tags(name,created_at) VALUES(?,?)", (t, entry["updated_at"]))
-            self._sync_lookup_rows(conn, entry["id"], entry["tags"], entry["model_scope"])
-            self._fts_upsert(conn, entry)
             conn.commit()
+            self._invalidate_read_caches()
             return entry
         finally:
             conn.close()
 
+    @staticmethod
+    def _expected_revision(payload):
+        """取出乐观锁条件：返回 (version, updated_at)，优先使用 version。"""
+        payload_version = payload.get("version")
+        payload_updated_at = normalize_text(payload.get("updated_at", ""))
+        if payload_version is None and not payload_updated_at:
+            raise ValueError("update requires version or updated_at")
+        if payload_version is None:
+            return None, payload_updated_at
+        try:
+            return int(payload_version), None
+        except (TypeError, ValueError):
+            raise ValueError("invalid version")
+
+    def _normalize_patch(self, payload):
+        unknown = sorted(k for k in payload if k not in self.PATCH_FIELDS and k not in ("version", "updated_at"))
+        if unknown:
+            raise ValueError(f"PATCH 不支持的字段: {', '.join(unknown)}")
+        changes = {}
+        if "favorite" in payload:
+            changes["favorite"] = 1 if payload.get("favorite") else 0
+        if "score" in payload:
+            try:
+                changes["score"] = float(payload.get("score") or 0.0)
+            except (TypeError, ValueError):
+                raise ValueError("invalid score")
+        if "status" in payload:
+            status = normalize_text(payload.get("status"))
+            if status not in self.ENTRY_STATUSES:
+                raise ValueError(f"invalid status: {status}")
+            changes["status"] = status
+        if "tags" in payload:
+            tags = payload.get("tags") or []
+            if isinstance(tags, str):
+                tags = tags.split(",")
+            if not isinstance(tags, list):
+                raise ValueError("tags 必须是数组")
+            changes["tags"] = normalize_tags(tags)
+        if not changes:
+            raise ValueError("没有可更新的字段")
+        return changes
+
+    def patch_entry(self, entry_id, payload):
+        """只更新 favorite / score / status / tags 中给出的字段。
+
+        用一条带乐观锁条件的 UPDATE 写入变化的列，不读也不重写缩略图。收藏、评分属于元数据，
+        不参与内容 hash；settings 中 version_metadata_changes 关闭时也不写版本快照（版本号仍递增，
+        供乐观锁使用）。标签、状态变化总是写快照。
+        """
+        payload = payload or {}
+        changes = self._normalize_patch(payload)
+        expected_version, expected_updated_at = self._expected_revision(payload)
+        versioned = self._patch_is_versioned(changes)
+        if expected_version is not None:
+            condition, expected = "version = ?", expected_version
+        else:
+            condition, expected = "updated_at = ?", expected_updated_at
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            entry = None
+            if versioned:
+                row = conn.execute(f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE id = ?", (entry_id,)).fetchone()
+                if not row:
+                    raise KeyError("entry not found")
+                entry = self._row_to_entry(row)
+            result = self._patch_entry_conn(conn, entry_id, changes, now_iso(), versioned, condition, expected, entry)
+            if result is None:
+                if conn.execute("SELECT 1 FROM entries WHERE id = ?", (entry_id,)).fetchone() is None:
+                    raise KeyError("entry not found")
+                raise OptimisticLockError("stale version" if expected_version is not None else "stale updated_at")
+            conn.commit()
+            self._invalidate_read_caches()
+            return result
+        finally:
+            conn.close()
+
+    def _patch_is_versioned(self, changes):
+        if "tags" in changes or "status" in changes:
+            return True
+        return bool(self.get_settings()["version_metadata_changes"])
+
+    def _patch_entry_conn(self, conn, entry_id, changes, now, versioned, condition, expected, entry=None):
+        """在调用方的事务里写入一条 PATCH，乐观锁条件不满足时返回 None。
+
+        entry 为不含 blob 的当前记录（_row_to_entry 结果），写快照或修改标签/状态时必须提供。
+        """
+        content_change = "tags" in changes or "status" in changes
+        old_tags = old_status = None
+        assignments = []
+        params = []
+        for column in ("favorite", "score", "status"):
+            if column in changes:
+                assignments.append(f"{column} = ?")
+                params.append(changes[column])
+        if "tags" in changes:
+            assignments.append("tags_json = ?")
+            params.append(json_dumps(changes["tags"]))
+        if entry is not None:
+            old_tags = list(entry["tags"])
+            old_status = entry["status"]
+            entry.update(changes)
+            entry["version"] += 1
+            entry["updated_at"] = now
+            if content_change:
+                entry["hash"] = stable_hash(entry)
+                assignments.append("hash = ?")
+                params.append(entry["hash"])
+
+        result = conn.execute(
+            f"""
+            UPDATE entries SET {', '.join(assignments)}, version = version + 1, updated_at = ?
+            WHERE id = ? AND {condition}
+            RETURNING id, status, version, tags_json, favorite, score, updated_at
+            """,
+            params + [now, entry_id, expected],
+        ).fetchone()
+        if result is None:
+            return None
+
+        if content_change:
+            self._apply_tag_deltas(conn, self._tag_deltas(old_tags, old_status, entry["tags"], entry["status"]), now)
+            if "status" in changes:
+                self._apply_model_deltas(
+                    conn, self._tag_deltas(entry["model_scope"], old_status, entry["model_scope"], entry["status"])
+                )
+        if "tags" in changes:
+            self._sync_lookup_rows(
+                conn, entry_id, changes["tags"], entry["model_scope"], old_tags, entry["model_scope"]
+            )
+        if versioned:
+            self._write_version(conn, entry, now)
+        return {
+            "id": result["id"],
+            "status": result["status"],
+            "version": int(result["version"]),
+            "tags": json.loads(result["tags_json"] or "[]"),
+            "favorite": int(result["favorite"] or 0),
+            "score": float(result["score"] or 0.0),
+            "updated_at": result["updated_at"],
+            "versioned": versioned,
+        }
+
+    BULK_OPS = ("delete", "restore", "tag", "untag", "favorite", "score")
+    BULK_FILTER_KEYS = ("q", "tags", "model", "status", "favorite_only", "has_thumbnail")
+    BULK_CHUNK_SIZE = 200
+
+    def bulk_update(self, op, ids=None, filters=None, value=None, dry_run=False, chunk_size=None, progress=None):
+        """对一批记录执行同一个操作：delete / restore / tag / untag / favorite / score。
+
+        目标由 ids 列表或与 search_entries 相同的 filters 给出（二选一），开始时一次性解析为 id 列表，
+        之后按 chunk_size 分块、每块一个短事务写入，块与块之间不持有写锁。每条记录沿用 PATCH 的写法，
+        已满足目标状态的记录计为 unchanged。dry_run 只解析目标并返回数量与样例 id。
+        progress(dict) 在每块提交后回调，参数与最终返回值结构相同。
+        """
+        if op not in self.BULK_OPS:
+            raise ValueError(f"unknown bulk op: {op}")
+        value = self._normalize_bulk_value(op, value)
+        chunk_size = max(1, int(chunk_size or self.BULK_CHUNK_SIZE))
+        target_ids = self._resolve_bulk_ids(ids, filters)
+        summary = {"op": op, "dry_run": bool(dry_run), "matched": len(target_ids)}
+        if dry_run:
+            summary["sample_ids"] = target_ids[:20]
+            return summary
+
+        summary.update({"done": 0, "changed": 0, "unchanged": 0, "missing": 0})
+        version_metadata = bool(self.get_settings()["version_metadata_changes"])
+        for start in range(0, len(target_ids), chunk_size):
+            chunk = target_ids[start:start + chunk_size]
+            now = now_iso()
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                placeholders = ",".join("?" for _ in chunk)
+                rows = conn.execute(
+                    f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE id IN ({placeholders})", chunk
+                ).fetchall()
+                found = {row["id"]: row for row in rows}
+                for entry_id in chunk:
+                    row = found.get(entry_id)
+                    if row is None:
+                        summary["missing"] += 1
+                        continue
+                    entry = self._row_to_entry(row)
+                    changes = self._bulk_changes(op, entry, value)
+                    if not changes:
+                        summary["unchanged"] += 1
+                        continue
+                    versioned = "tags" in changes or "status" in changes or version_metadata
+                    self._patch_entry_conn(
+                        conn, entry_id, changes, now, versioned, "version = ?", entry["version"], entry
+                    )
+                    summary["changed"] += 1
+                conn.commit()
+            finally:
+                conn.close()
+            summary["done"] = start + len(chunk)
+            if summary["changed"]:
+                self._invalidate_read_caches()
+            if progress:
+                progress(dict(summary))
+        return summary
+
+    @staticmethod
+    def _normalize_bulk_value(op, value):
+        if op in ("tag", "untag"):
+            tags = value.split(",") if isinstance(value, str) else value
+            if not isinstance(tags, list) or not normalize_tags(tags):
+                raise ValueError(f"{op} 需要非空的标签列表")
+            return normalize_tags(tags)
+        if op == "favorite":
+            return 1 if value in (None, True, 1, "1", "true") else 0
+        if op == "score":
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                raise ValueError("score 需要数值")
+        return None
+
+    @staticmethod
+    def _bulk_changes(op, entry, value):
+        """计算一条记录需要的 PATCH 变化；已是目标状态时返回空 dict。"""
+        if op == "delete":
+            return {"status": "deleted"} if entry["status"] != "deleted" else {}
+        if op == "restore":
+            return {"status": "active"} if entry["status"] == "deleted" else {}
+        if op == "tag":
+            existing = {tag.lower() for tag in entry["tags"]}
+            tags = list(entry["tags"]) + [tag for tag in value if tag.lower() not in existing]
+            return {"tags": tags} if tags != entry["tags"] else {}
+        if op == "untag":
+            remove = {tag.lower() for tag in value}
+            tags = [tag for tag in entry["tags"] if tag.lower() not in remove]
+            return {"tags": tags} if tags != entry["tags"] else {}
+        if op == "favorite":
+            return {"favorite": value} if int(entry["favorite"]) != value else {}
+        if op == "score":
+            return {"score": value} if float(entry["score"]) != value else {}
+        return {}
+
+    def _resolve_bulk_ids(self, ids=None, filters=None):
+        if (ids is None) == (filters is None):
+            raise ValueError("ids 与 filters 需且只能提供一个")
+        if ids is not None:
+            if not isinstance(ids, list):
+                raise ValueError("ids 必须是数组")
+            return list(dict.fromkeys(str(entry_id) for entry_id in ids if entry_id))
+        if not isinstance(filters, dict):
+            raise ValueError("filters 必须是 JSON 对象")
+        unknown = sorted(k for k in filters if k not in self.BULK_FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"不支持的过滤条件: {', '.join(unknown)}")
+        tags = filters.get("tags") or []
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        q = normalize_text(filters.get("q", ""))
+        status = normalize_text(filters.get("status", "")) or "active"
+        where, params = self._entry_filters(
+            status=status,
+            tags=normalize_tags(tags),
+            model=normalize_text(filters.get("model", "")),
+            favorite_only=bool(filters.get("favorite_only")),
+            has_thumbnail=bool(filters.get("has_thumbnail")),
+        )
+        conn = self._connect()
+        try:
+            if not q:
+                sql = f"SELECT e.id FROM entries e WHERE {' AND '.join(where)}"
+                return [row["id"] for row in conn.execute(sql, params)]
+            # 与 count_entries 的关键词语义一致：FTS ∪ 标题 LIKE，无结果时退回 LIKE。
+            if status == "active" and not self._should_prefer_like(q):
+                try:
+                    rows = conn.execute(*self._fts_ids_query(q, where, params)).fetchall()
+                except sqlite3.OperationalError:
+                    rows = []
+                if rows:
+                    return [row["id"] for row in rows]
+            return [row["id"] for row in conn.execute(*self._like_ids_query(q, where, params))]
+        finally:
+            conn.close()
+
     def delete_entry(self, entry_id):
         conn = self._connect()
         try:
-            row = conn.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            row = conn.execute(f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE id = ?", (entry_id,)).fetchone()
             if not row:
                 raise KeyError("entry not found")
             entry = self._row_to_entry(row)
+            old_status = entry["status"]
             entry["status"] = "deleted"
             entry["version"] = int(entry.get("version", 1)) + 1
             entry["updated_at"] = now_iso()
@@ -560,54 +1691,184 @@ class PromptVaultStore:
                 "UPDATE entries SET status=?, version=?, hash=?, updated_at=? WHERE id=?",
                 (entry["status"], entry["version"], entry["hash"], entry["updated_at"], entry_id),
             )
-            conn.execute(
-                "INSERT INTO entry_versions(entry_id,version,snapshot_json,created_at) VALUES(?,?,?,?)",
-                (entry["id"], entry["version"], json_dumps(entry), entry["updated_at"]),
+            self._write_version(conn, entry, entry["updated_at"])
+            # 软删除不改变标签和模型，查找行保持原样；全文索引由触发器移除该记录。
+            self._apply_tag_deltas(
+                conn, self._tag_deltas(entry["tags"], old_status, entry["tags"], "deleted"), entry["updated_at"]
+            )
+            self._apply_model_deltas(
+                conn, self._tag_deltas(entry["model_scope"], old_status, entry["model_scope"], "deleted")
             )
-            self._sync_lookup_rows(conn, entry["id"], entry["tags"], entry["model_scope"])
-            self._fts_upsert(conn, entry)
-            self._reconcile_tags_table(conn)
             conn.commit()
+            self._invalidate_read_caches()
             return entry
         finally:
             conn.close()
 
-    def purge_deleted_entries(self):
-        """硬删除所有已软删除的记录及其相关索引/版本。"""
+    def purge_deleted_entries(self, chunk_size=None, progress=None, vacuum=True):
+        """分块硬删除所有已软删除的记录及其版本和查找行，并删除因此不再被引用的缩略图。
+
+        每块在独立的短事务里完成，块之间释放写锁，节点保存不会被整个清理过程阻塞；
+        中途中断后再次调用会从剩余的记录继续。progress(dict) 在每块提交后回调。
+        vacuum 为真时随后执行 incremental_vacuum，把释放的页归还给文件系统。
+        返回 {total, deleted, chunks, thumbnails, vacuum}，thumbnails 为删除的缩略图 blob 数。
+        """
+        chunk_size = max(1, min(int(chunk_size or self.PURGE_CHUNK_SIZE), self.CREATE_BATCH_LIMIT))
         conn = self._connect()
         try:
-            # 先收集所有待删除的 entry_id，便于清理关联表
-            rows = conn.execute("SELECT id FROM entries WHERE status = 'deleted'").fetchall()
-            ids = [r["id"] for r in rows]
-            if not ids:
-                return 0
-
-            # 使用参数化的 IN 子句删除 entry_versions 和 entries_fts 中的对应记录
-            placeholders = ",".join(["?"] * len(ids))
-            conn.execute(f"DELETE FROM entry_versions WHERE entry_id IN ({placeholders})", ids)
-            conn.execute(f"DELETE FROM entries_fts WHERE entry_id IN ({placeholders})", ids)
-            conn.execute(f"DELETE FROM entry_tags WHERE entry_id IN ({placeholders})", ids)
-            conn.execute(f"DELETE FROM entry_models WHERE entry_id IN ({placeholders})", ids)
-            conn.execute(f"DELETE FROM entries WHERE id IN ({placeholders})", ids)
-            conn.commit()
-            return len(ids)
+            total = conn.execute("SELECT COUNT(*) FROM entries WHERE status = 'deleted'").fetchone()[0]
+            summary = {"total": int(total), "deleted": 0, "chunks": 0, "thumbnails": 0}
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                # 在写事务内重新选取，避免删掉刚被恢复的记录
+                ids = [
+                    row["id"]
+                    for row in conn.execute(
+                        "SELECT id FROM entries WHERE status = 'deleted' LIMIT ?", (chunk_size,)
+                    ).fetchall()
+                ]
+                if not ids:
+                    # 兜底：计数异常（如中断的迁移）遗留的无引用 blob
+                    summary["thumbnails"] += conn.execute("DELETE FROM thumbnail_blobs WHERE refcount <= 0").rowcount
+                    conn.commit()
+                    break
+                # 全文索引只收录 active 记录；软删除时标签引用计数已扣减，这里无需处理
+                placeholders = ",".join(["?"] * len(ids))
+                thumb_refs = conn.execute(
+                    f"""
+                    SELECT e.thumbnail_hash, COUNT(*) AS refs FROM entries e
+                    WHERE e.id IN ({placeholders}) AND e.thumbnail_hash IS NOT NULL AND NOT {self.LEGACY_THUMBNAIL_SQL}
+                    GROUP BY e.thumbnail_hash
+                    """,
+                    ids,
+                ).fetchall()
+                conn.execute(f"DELETE FROM entry_versions WHERE entry_id IN ({placeholders})", ids)
+                conn.execute(f"DELETE FROM entry_tags WHERE entry_id IN ({placeholders})", ids)
+                conn.execute(f"DELETE FROM entry_models WHERE entry_id IN ({placeholders})", ids)
+                conn.execute(f"DELETE FROM entries WHERE id IN ({placeholders})", ids)
+                # 不再被任何记录引用的缩略图随之删除
+                summary["thumbnails"] += self._apply_thumbnail_refs(
+                    conn, {row["thumbnail_hash"]: -row["refs"] for row in thumb_refs}
+                )
+                conn.commit()
+                summary["deleted"] += len(ids)
+                summary["chunks"] += 1
+                # 清理期间新删除的记录也会被处理，total 随之上调
+                summary["total"] = max(summary["total"], summary["deleted"])
+                if progress:
+                    progress({"phase": "purge", **summary})
+        finally:
+            conn.close()
+        if summary["deleted"]:
+            self._invalidate_read_caches()
+        summary["vacuum"] = self.incremental_vacuum(progress=progress) if vacuum else None
+        return summary
+
+    def vacuum_status(self):
+        """返回 auto_vacuum 模式、页大小、总页数与空闲页数。"""
+        conn = self._connect()
+        try:
+            return self._vacuum_status(conn)
+        finally:
+            conn.close()
+
+    def _vacuum_status(self, conn):
+        mode = int(conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+        page_size = int(conn.execute("PRAGMA page_size").fetchone()[0])
+        return {
+            "auto_vacuum": self.AUTO_VACUUM_MODES.get(mode, str(mode)),
+            "page_size": page_size,
+            "page_count": int(conn.execute("PRAGMA page_count").fetchone()[0]),
+            "freelist_count": int(conn.execute("PRAGMA freelist_count").fetchone()[0]),
+        }
+
+    def enable_incremental_vacuum(self):
+        """把旧库迁移到 auto_vacuum=INCREMENTAL。
+
+        切换模式需要一次整库 VACUUM（耗时与库大小成正比，期间独占数据库），新建的库
+        已在建表前设置，无需调用。VACUUM 可能重排 entries 的 rowid，之后重建全文索引。
+        返回迁移后的 vacuum_status()，附带 migrated 标记。
+        """
+        conn = self._connect()
+        try:
+            if self._vacuum_status(conn)["auto_vacuum"] == "incremental":
+                return {**self._vacuum_status(conn), "migrated": False}
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        self.rebuild_fts_index()
+        return {**self.vacuum_status(), "migrated": True}
+
+    def incremental_vacuum(self, max_pages=None, progress=None):
+        """分步执行 PRAGMA incremental_vacuum，把空闲页归还给文件系统。
+
+        每步最多释放 VACUUM_STEP_PAGES 页并单独提交；max_pages 限制本次总共释放的页数。
+        库仍是 auto_vacuum=NONE 时只返回状态（reclaimed_pages 为 0），需先 enable_incremental_vacuum()。
+        """
+        conn = self._connect()
+        try:
+            status = self._vacuum_status(conn)
+            result = {**status, "reclaimed_pages": 0, "reclaimed_bytes": 0}
+            if status["auto_vacuum"] != "incremental":
+                return result
+            remaining = status["freelist_count"] if max_pages is None else min(int(max_pages), status["freelist_count"])
+            while remaining > 0:
+                step = min(remaining, self.VACUUM_STEP_PAGES)
+                before = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                # sqlite3 的 execute 只 step 一次，incremental_vacuum 每次 step 仅释放一页；
+                # executescript 走 sqlite3_exec，会把整步执行完并自动提交
+                conn.executescript(f"PRAGMA incremental_vacuum({step});")
+                freed = before - int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                if freed <= 0:
+                    break
+                remaining -= freed
+                result["reclaimed_pages"] += freed
+                result["reclaimed_bytes"] = result["reclaimed_pages"] * status["page_size"]
+                if progress:
+                    progress({"phase": "vacuum", **result})
+            if result["reclaimed_pages"]:
+                # WAL 模式下文件在检查点时才截断；PASSIVE 不等待读者
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+            result.update(self._vacuum_status(conn))
+            return result
         finally:
             conn.close()
 
     def tidy_tags(self):
-        """整理标签：
+        """整理标签（一致性检查，引用计数正常时无需调用）：
         1）删除在 entries 中已不存在的标签；
-        2）补充 entries 中出现但 tags 表中缺失的标签。
-        返回 {removed, added} 统计。
+        2）补充 entries 中出现但 tags 表中缺失的标签；
+        3）修正与实际引用数不符的 ref_count。
+        返回 {removed, added, fixed} 统计。
         """
         conn = self._connect()
         try:
             result = self._reconcile_tags_table(conn)
             conn.commit()
+            self._invalidate_read_caches()
             return result
         finally:
             conn.close()
 
+    def rebuild_fts_index(self, optimize=True):
+        """从 entries_fts_source 视图重建全文索引，并可选地合并 FTS 段。
+
+        索引由触发器自动维护，正常情况下无需调用；整库 VACUUM 之后 entries 的 rowid
+        可能重排，或怀疑索引与数据不一致时执行。返回重建后的索引行数。
+        """
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO entries_fts(entries_fts) VALUES('rebuild')")
+            if optimize:
+                conn.execute("INSERT INTO entries_fts(entries_fts) VALUES('optimize')")
+            conn.commit()
+            self._invalidate_read_caches()
+            row = conn.execute("SELECT COUNT(*) AS total FROM entries_fts_source").fetchone()
+            return int(row["total"])
+        finally:
+            conn.close()
+
     @staticmethod
     def _escape_fts_query(raw):
         """Wrap each token in double-quotes so FTS5 treats special chars as literals."""
@@ -629,7 +1890,14 @@ class PromptVaultStore:
         sort="updated_desc",
         favorite_only=False,
         has_thumbnail=False,
+        similar_to="",
+        placeholder_budget=None,
     ):
+        """sort="similar" 时按缩略图与 similar_to 记录的感知哈希距离升序排列（没有缩略图的排在最后，
+        条目带 distance）；参考记录不存在或没有缩略图时退回按更新时间排序。
+
+        条目带列表占位图 placeholder（WebP data URL）和 placeholder_color，见 _attach_placeholders。
+        """
         tags = normalize_tags(tags or [])
         q = normalize_text(q)
         model = normalize_text(model)
@@ -649,32 +1917,28 @@ class PromptVaultStore:
 
         conn = self._connect()
         try:
-            where = ["e.status = ?"]
-            params = [status]
-
-            if model:
-                where.append(
-                    "EXISTS (SELECT 1 FROM entry_models em WHERE em.entry_id = e.id AND em.model = ?)"
-                )
-                params.append(model)
-
-            for t in tags:
-                where.append(
-                    "EXISTS (SELECT 1 FROM entry_tags et WHERE et.entry_id = e.id AND et.tag = ?)"
-                )
-                params.append(t)
-
-            if favorite_only:
-                where.append("e.favorite = 1")
-
-            if has_thumbnail:
-                where.append("e.thumbnail_png IS NOT NULL")
-
-            select_fields = (
-                "e.id, e.title, e.tags_json, e.model_scope_json, e.updated_at, "
-                "e.raw_json, e.favorite, e.score, e.thumbnail_png IS NOT NULL AS has_thumbnail"
+            where, params = self._entry_filters(
+                status=status,
+                tags=tags,
+                model=model,
+                favorite_only=favorite_only,
+                has_thumbnail=has_thumbnail,
             )
-            order_by = self._search_order_by(sort=sort, with_fts=bool(q))
+            select_fields = self.SEARCH_SELECT_FIELDS
+            if sort == "similar":
+                try:
+                    reference = self._entry_phash(conn, normalize_text(similar_to)) if similar_to else None
+                except KeyError:
+                    reference = None
+                if reference is None:
+                    sort = "updated_desc"
+                else:
+                    from .thumbnails import hamming_distance
+
+                    conn.create_function(
+                        "pv_phash_distance", 1, lambda phash: hamming_distance(phash, reference), deterministic=True
+                    )
+                    select_fields = f"{select_fields}, {self.PHASH_DISTANCE_SQL} AS distance"
 
             if q:
                 rows = self._search_rows_with_keyword(
@@ -686,48 +1950,174 @@ class PromptVaultStore:
                     sort=sort,
                     limit=limit,
                     offset=offset,
+                    use_fts=status == "active",
                 )
             else:
-                sql = f"""
-                SELECT {select_fields}
-                FROM entries e
-                WHERE {' AND '.join(where)}
-                ORDER BY {self._search_order_by(sort=sort, with_fts=False)}
-                LIMIT ? OFFSET ?
-                """
-                rows = conn.execute(sql, params + [int(limit), int(offset)]).fetchall()
+                rows = conn.execute(
+                    *self._plain_search_query(where, params, select_fields, sort, limit, offset)
+                ).fetchall()
                 logger.debug("no-q rows=%d", len(rows))
 
-            items = []
-            for r in rows:
-                tags_list = json.loads(r["tags_json"] or "[]")
-                model_scope_list = json.loads(r["model_scope_json"] or "[]")
-                positive_preview = self._positive_preview_from_raw_json(r["raw_json"])
-                items.append(
-                    {
-                        "id": r["id"],
-                        "title": r["title"],
-                        "tags": tags_list,
-                        "model_scope": model_scope_list,
-                        "favorite": int(r["favorite"] or 0),
-                        "score": float(r["score"] or 0.0),
-                        "has_thumbnail": bool(r["has_thumbnail"]),
-                        "positive_preview": positive_preview,
-                        "match_reasons": self._build_match_reasons(
-                            q=q,
-                            tags=tags_list,
-                            title=r["title"],
-                            positive_preview=positive_preview,
-                        ),
-                        "updated_at": r["updated_at"],
-                    }
-                )
+            items = [self._search_item(r, q=q) for r in rows]
             items = self._prioritize_title_matches(items, q=q)
+            self._attach_placeholders(conn, items, placeholder_budget)
             logger.debug("return_items=%d", len(items))
             return items
         finally:
             conn.close()
 
+    def _search_item(self, r, q=""):
+        tags_list = json.loads(r["tags_json"] or "[]")
+        model_scope_list = json.loads(r["model_scope_json"] or "[]")
+        positive_preview = self._positive_preview_from_raw_json(r["raw_json"])
+        item = {
+            "id": r["id"],
+            "title": r["title"],
+            "tags": tags_list,
+            "model_scope": model_scope_list,
+            "favorite": int(r["favorite"] or 0),
+            "score": float(r["score"] or 0.0),
+            "has_thumbnail": bool(r["has_thumbnail"]),
+            "thumbnail_hash": r["thumbnail_hash"],
+            "positive_preview": positive_preview,
+            "match_reasons": self._build_match_reasons(
+                q=q,
+                tags=tags_list,
+                title=r["title"],
+                positive_preview=positive_preview,
+            ),
+            "updated_at": r["updated_at"],
+        }
+        if "distance" in r.keys():
+            item["distance"] = r["distance"]
+        return item
+
+    def _attach_placeholders(self, conn, items, budget=None):
+        """给检索结果补上占位图：placeholder_color 总是带上，placeholder（WebP data URL）按列表顺序
+        放入，总字符数不超过 budget（默认 PLACEHOLDER_RESPONSE_BUDGET），放不下的只有平均色。
+        """
+        budget = self.PLACEHOLDER_RESPONSE_BUDGET if budget is None else max(0, int(budget))
+        hashes = list(dict.fromkeys(item["thumbnail_hash"] for item in items if item.get("thumbnail_hash")))
+        found = {}
+        if hashes:
+            found = {
+                row["blob_hash"]: row
+                for row in conn.execute(
+                    """
+                    SELECT blob_hash, color, data FROM thumbnail_placeholders
+                    WHERE blob_hash IN (SELECT value FROM json_each(?))
+                    """,
+                    (json.dumps(hashes),),
+                )
+            }
+        for item in items:
+            row = found.get(item.get("thumbnail_hash"))
+            item["placeholder_color"] = (row["color"] if row else None) or ""
+            item["placeholder"] = ""
+            if row and row["data"] is not None:
+                url = "data:image/webp;base64," + base64.b64encode(bytes(row["data"])).decode("ascii")
+                if len(url) <= budget:
+                    item["placeholder"] = url
+                    budget -= len(url)
+        return items
+
+    def _entry_phash(self, conn, entry_id):
+        """取一条记录缩略图的感知哈希；尚未回填时现算（不写库）。没有缩略图返回 None。"""
+        row = conn.execute(
+            """
+            SELECT e.thumbnail_hash, p.phash, p.blob_hash IS NOT NULL AS indexed
+            FROM entries e LEFT JOIN thumbnail_phashes p ON p.blob_hash = e.thumbnail_hash
+            WHERE e.id = ?
+            """,
+            (entry_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError("entry not found")
+        if row["phash"] is not None or row["indexed"]:
+            return row["phash"]
+        data = conn.execute(
+            f"SELECT {self.THUMBNAIL_DATA_SQL} AS data FROM entries e WHERE e.id = ?", (entry_id,)
+        ).fetchone()["data"]
+        if data is None:
+            return None
+        from .thumbnails import perceptual_hash
+
+        return perceptual_hash(bytes(data))
+
+    @staticmethod
+    def _phash_chunk_neighbors(value, radius):
+        """16 位分段值 value 在汉明距离 radius 以内的全部取值（含自身）。"""
+        values = [value]
+        for bits in range(1, radius + 1):
+            for flips in itertools.combinations(range(16), bits):
+                mask = 0
+                for bit in flips:
+                    mask |= 1 << bit
+                values.append(value ^ mask)
+        return values
+
+    def _similar_thumbnail_hashes(self, conn, phash, max_distance):
+        """返回 {thumbnail_hash: 距离}，只含与 phash 的汉明距离不超过 max_distance 的缩略图。
+
+        每段允许的距离 r // 4 不超过 PHASH_MIH_MAX_RADIUS 时按四个分段的表达式索引取候选
+        （多索引哈希，鸽巢原理保证不漏），否则扫描整张 thumbnail_phashes；最后逐个精确计算距离。
+        """
+        from .thumbnails import hamming_distance
+
+        radius = max_distance // len(self.PHASH_CHUNK_SQL)
+        if radius <= self.PHASH_MIH_MAX_RADIUS:
+            shifts = (48, 32, 16, 0)
+            sql = " UNION ".join(
+                f"SELECT blob_hash, phash FROM thumbnail_phashes WHERE {chunk} IN (SELECT value FROM json_each(?))"
+                for chunk in self.PHASH_CHUNK_SQL
+            )
+            params = [
+                json.dumps(self._phash_chunk_neighbors((phash >> shift) & 0xFFFF, radius)) for shift in shifts
+            ]
+            rows = conn.execute(sql, params).fetchall()
+        else:
+            rows = conn.execute("SELECT blob_hash, phash FROM thumbnail_phashes WHERE phash IS NOT NULL").fetchall()
+        found = {}
+        for row in rows:
+            distance = hamming_distance(phash, row["phash"])
+            if distance <= max_distance:
+                found[row["blob_hash"]] = distance
+        return found
+
+    def find_similar_entries(self, entry_id, max_distance=None, limit=20, status="active", placeholder_budget=None):
+        """按缩略图感知哈希找外观相近的记录（不含自身），按距离升序、同距离按更新时间倒序。
+
+        条目格式同 search_entries，另带 distance（0 为像素级重复或仅有轻微缩放、调色差异）。
+        记录不存在抛 KeyError；参考记录没有缩略图时返回空列表。
+        """
+        max_distance = self.PHASH_DEFAULT_DISTANCE if max_distance is None else int(max_distance)
+        if not 0 <= max_distance <= self.PHASH_MAX_DISTANCE:
+            raise ValueError(f"max_distance 必须在 0 到 {self.PHASH_MAX_DISTANCE} 之间")
+        conn = self._connect()
+        try:
+            phash = self._entry_phash(conn, entry_id)
+            if phash is None:
+                return []
+            distances = self._similar_thumbnail_hashes(conn, phash, max_distance)
+            if not distances:
+                return []
+            rows = conn.execute(
+                f"""
+                SELECT {self.SEARCH_SELECT_FIELDS} FROM entries e
+                WHERE e.status = ? AND e.id != ? AND e.thumbnail_hash IN (SELECT value FROM json_each(?))
+                ORDER BY e.updated_at DESC, e.id ASC
+                """,
+                (status, entry_id, json.dumps(list(distances))),
+            ).fetchall()
+            items = []
+            for r in sorted(rows, key=lambda r: distances[r["thumbnail_hash"]])[: max(1, int(limit))]:
+                item = self._search_item(r)
+                item["distance"] = distances[r["thumbnail_hash"]]
+                items.append(item)
+            return self._attach_placeholders(conn, items, placeholder_budget)
+        finally:
+            conn.close()
+
     def count_entries(self, q="", tags=None, model="", status="active", favorite_only=False, has_thumbnail=False):
         tags = normalize_tags(tags or [])
         q = normalize_text(q)
@@ -735,42 +2125,158 @@ class PromptVaultStore:
 
         conn = self._connect()
         try:
-            where = ["e.status = ?"]
-            params = [status]
-
-            if model:
-                where.append(
-                    "EXISTS (SELECT 1 FROM entry_models em WHERE em.entry_id = e.id AND em.model = ?)"
+            where, params = self._entry_filters(
+                status=status,
+                tags=tags,
+                model=model,
+                favorite_only=favorite_only,
+                has_thumbnail=has_thumbnail,
+            )
+            if q:
+                return self._count_rows_with_keyword(
+                    conn=conn, q=q, where=where, params=params, use_fts=status == "active"
                 )
-                params.append(model)
 
-            for tag in tags:
-                where.append(
-                    "EXISTS (SELECT 1 FROM entry_tags et WHERE et.entry_id = e.id AND et.tag = ?)"
-                )
-                params.append(tag)
+            row = conn.execute(*self._plain_count_query(where, params)).fetchone()
+            return int((row or {})["total"] if row else 0)
+        finally:
+            conn.close()
 
-            if favorite_only:
-                where.append("e.favorite = 1")
+    SEARCH_SELECT_FIELDS = (
+        "e.id, e.title, e.tags_json, e.model_scope_json, e.updated_at, "
+        "e.raw_json, e.favorite, e.score, (e.has_thumbnail OR e.thumbnail_png IS NOT NULL) AS has_thumbnail, "
+        "e.thumbnail_hash"
+    )
+    # sort="similar" 时每行到参考缩略图的距离；pv_phash_distance 在查询前按参考哈希注册
+    PHASH_DISTANCE_SQL = (
+        "pv_phash_distance((SELECT p.phash FROM thumbnail_phashes p WHERE p.blob_hash = e.thumbnail_hash))"
+    )
 
-            if has_thumbnail:
-                where.append("e.thumbnail_png IS NOT NULL")
+    @staticmethod
+    def _entry_filters(status="active", tags=None, model="", favorite_only=False, has_thumbnail=False):
+        """构造 search/count 共用的 WHERE 条件。
 
-            if q:
-                return self._count_rows_with_keyword(conn=conn, q=q, where=where, params=params)
+        标签/模型用 ``e.id IN (SELECT ...)`` 而不是相关 EXISTS 子查询，
+        这样 SQLite 会走 idx_entry_tags_tag_entry / idx_entry_models_model_entry
+        一次性取出候选 id，而不是对每条记录回查一次 entry_tags。
+        """
+        where = ["e.status = ?"]
+        params = [status]
 
-            sql = f"""
-            SELECT COUNT(*) AS total
-            FROM entries e
-            WHERE {' AND '.join(where)}
-            """
-            row = conn.execute(sql, params).fetchone()
-            return int((row or {})["total"] if row else 0)
-        finally:
-            conn.close()
+        if model:
+            where.append("e.id IN (SELECT em.entry_id FROM entry_models em WHERE em.model = ?)")
+            params.append(model)
+
+        for tag in tags or []:
+            where.append("e.id IN (SELECT et.entry_id FROM entry_tags et WHERE et.tag = ?)")
+            params.append(tag)
+
+        if favorite_only:
+            where.append("e.favorite = 1")
+
+        if has_thumbnail:
+            where.append("(e.has_thumbnail OR e.thumbnail_png IS NOT NULL)")
+        return where, params
+
+    @classmethod
+    def _plain_search_query(cls, where, params, select_fields, sort, limit, offset):
+        sql = f"""
+        SELECT {select_fields}
+        FROM entries e
+        WHERE {' AND '.join(where)}
+        ORDER BY {cls._search_order_by(sort=sort, with_fts=False)}
+        LIMIT ? OFFSET ?
+        """
+        return sql, list(params) + [int(limit), int(offset)]
+
+    @staticmethod
+    def _plain_count_query(where, params):
+        sql = f"""
+        SELECT COUNT(*) AS total
+        FROM entries e
+        WHERE {' AND '.join(where)}
+        """
+        return sql, list(params)
+
+    @classmethod
+    def _fts_search_query(cls, q, where, params, select_fields, sort, limit, offset):
+        # CROSS JOIN 固定 FTS 在外层：否则规划器可能先扫 entries，再对每行做一次 rowid+MATCH。
+        sql = f"""
+        SELECT {select_fields}
+        FROM entries_fts f
+        CROSS JOIN entries e ON e.rowid = f.rowid
+        WHERE ({' AND '.join(where)}) AND entries_fts MATCH ?
+        ORDER BY {cls._search_order_by(sort=sort, with_fts=True)}
+        LIMIT ? OFFSET ?
+        """
+        return sql, list(params) + [cls._escape_fts_query(q), int(limit), int(offset)]
+
+    @classmethod
+    def _title_like_search_query(cls, q, where, params, select_fields, sort, limit):
+        title_where = list(where)
+        title_where.append("e.title LIKE ?")
+        sql = f"""
+        SELECT {select_fields}
+        FROM entries e
+        WHERE {' AND '.join(title_where)}
+        ORDER BY {cls._search_order_by(sort=sort, with_fts=False)}
+        LIMIT ?
+        """
+        return sql, list(params) + [f"%{q}%", int(limit)]
+
+    @classmethod
+    def _like_search_query(cls, q, where, params, select_fields, sort, limit, offset):
+        like_where = list(where)
+        like_where.append("(e.title LIKE ? OR e.raw_json LIKE ? OR e.negative_json LIKE ?)")
+        like_q = f"%{q}%"
+        sql = f"""
+        SELECT {select_fields}
+        FROM entries e
+        WHERE {' AND '.join(like_where)}
+        ORDER BY {cls._search_order_by(sort=sort, with_fts=False)}
+        LIMIT ? OFFSET ?
+        """
+        return sql, list(params) + [like_q, like_q, like_q, int(limit), int(offset)]
+
+    @classmethod
+    def _fts_ids_query(cls, q, where, params):
+        sql = f"""
+        SELECT e.id
+        FROM entries_fts f
+        CROSS JOIN entries e ON e.rowid = f.rowid
+        WHERE ({' AND '.join(where)}) AND entries_fts MATCH ?
+        UNION
+        SELECT e.id
+        FROM entries e
+        WHERE ({' AND '.join(where)}) AND e.title LIKE ?
+        """
+        return sql, list(params) + [cls._escape_fts_query(q)] + list(params) + [f"%{q}%"]
+
+    @classmethod
+    def _fts_count_query(cls, q, where, params):
+        ids_sql, args = cls._fts_ids_query(q, where, params)
+        return f"SELECT COUNT(*) AS total FROM ({ids_sql}) merged", args
+
+    @staticmethod
+    def _like_ids_query(q, where, params, select="e.id"):
+        like_where = list(where)
+        like_where.append("(e.title LIKE ? OR e.raw_json LIKE ? OR e.negative_json LIKE ?)")
+        like_q = f"%{q}%"
+        sql = f"""
+        SELECT {select}
+        FROM entries e
+        WHERE {' AND '.join(like_where)}
+        """
+        return sql, list(params) + [like_q, like_q, like_q]
+
+    @classmethod
+    def _like_count_query(cls, q, where, params):
+        return cls._like_ids_query(q, where, params, select="COUNT(*) AS total")
 
-    @staticmethod
-    def _search_order_by(sort="updated_desc", with_fts=False):
+    @classmethod
+    def _search_order_by(cls, sort="updated_desc", with_fts=False):
+        if sort == "similar":
+            return f"{cls.PHASH_DISTANCE_SQL} ASC NULLS LAST, e.updated_at DESC, e.id ASC"
         if sort == "score_desc":
             return "e.score DESC, e.updated_at DESC, e.id ASC"
         if sort == "favorite_desc":
@@ -845,8 +2351,9 @@ class PromptVaultStore:
             return True
         return False
 
-    def _search_rows_with_keyword(self, conn, q, where, params, select_fields, sort, limit, offset):
-        if self._should_prefer_like(q):
+    def _search_rows_with_keyword(self, conn, q, where, params, select_fields, sort, limit, offset, use_fts=True):
+        # 全文索引只收录 active 记录，回收站等其它状态直接走 LIKE。
+        if not use_fts or self._should_prefer_like(q):
             rows = self._search_rows_like(conn, q, where, params, select_fields, sort, limit, offset)
             logger.debug("LIKE rows=%d (preferred)", len(rows))
             return rows
@@ -861,17 +2368,10 @@ class PromptVaultStore:
             sort,
             fetch_limit,
         )
-        fts_q = self._escape_fts_query(q)
-        sql = f"""
-        SELECT {select_fields}
-        FROM entries_fts f
-        JOIN entries e ON e.id = f.entry_id
-        WHERE ({' AND '.join(where)}) AND entries_fts MATCH ?
-        ORDER BY {self._search_order_by(sort=sort, with_fts=True)}
-        LIMIT ? OFFSET ?
-        """
         try:
-            rows = conn.execute(sql, params + [fts_q, fetch_limit, 0]).fetchall()
+            rows = conn.execute(
+                *self._fts_search_query(q, where, params, select_fields, sort, fetch_limit, 0)
+            ).fetchall()
             logger.debug("FTS rows=%d", len(rows))
         except sqlite3.OperationalError:
             logger.warning("FTS failed, fallback to LIKE")
@@ -899,54 +2399,21 @@ class PromptVaultStore:
         return merged[start:end]
 
     def _search_rows_title_like(self, conn, q, where, params, select_fields, sort, limit):
-        title_where = list(where)
-        title_where.append("e.title LIKE ?")
-        like_q = f"%{q}%"
-        sql = f"""
-        SELECT {select_fields}
-        FROM entries e
-        WHERE {' AND '.join(title_where)}
-        ORDER BY {self._search_order_by(sort=sort, with_fts=False)}
-        LIMIT ?
-        """
-        return conn.execute(sql, params + [like_q, int(limit)]).fetchall()
+        return conn.execute(
+            *self._title_like_search_query(q, where, params, select_fields, sort, limit)
+        ).fetchall()
 
     def _search_rows_like(self, conn, q, where, params, select_fields, sort, limit, offset):
-        like_where = list(where)
-        like_where.append("(e.title LIKE ? OR e.raw_json LIKE ? OR e.negative_json LIKE ?)")
-        like_q = f"%{q}%"
-        sql_like = f"""
-        SELECT {select_fields}
-        FROM entries e
-        WHERE {' AND '.join(like_where)}
-        ORDER BY {self._search_order_by(sort=sort, with_fts=False)}
-        LIMIT ? OFFSET ?
-        """
         return conn.execute(
-            sql_like,
-            params + [like_q, like_q, like_q, int(limit), int(offset)],
+            *self._like_search_query(q, where, params, select_fields, sort, limit, offset)
         ).fetchall()
 
-    def _count_rows_with_keyword(self, conn, q, where, params):
-        if self._should_prefer_like(q):
+    def _count_rows_with_keyword(self, conn, q, where, params, use_fts=True):
+        if not use_fts or self._should_prefer_like(q):
             return self._count_rows_like(conn, q, where, params)
 
-        fts_q = self._escape_fts_query(q)
-        sql = f"""
-        SELECT COUNT(*) AS total
-        FROM (
-            SELECT e.id
-            FROM entries_fts f
-            JOIN entries e ON e.id = f.entry_id
-            WHERE ({' AND '.join(where)}) AND entries_fts MATCH ?
-            UNION
-            SELECT e.id
-            FROM entries e
-            WHERE ({' AND '.join(where)}) AND e.title LIKE ?
-        ) merged
-        """
         try:
-            row = conn.execute(sql, params + [fts_q] + params + [f"%{q}%"]).fetchone()
+            row = conn.execute(*self._fts_count_query(q, where, params)).fetchone()
             total = int((row or {})["total"] if row else 0)
         except sqlite3.OperationalError:
             return self._count_rows_like(conn, q, where, params)
@@ -955,17 +2422,9 @@ class PromptVaultStore:
             return self._count_rows_like(conn, q, where, params)
         return total
 
-    @staticmethod
-    def _count_rows_like(conn, q, where, params):
-        like_where = list(where)
-        like_where.append("(e.title LIKE ? OR e.raw_json LIKE ? OR e.negative_json LIKE ?)")
-        like_q = f"%{q}%"
-        sql_like = f"""
-        SELECT COUNT(*) AS total
-        FROM entries e
-        WHERE {' AND '.join(like_where)}
-        """
-        row = conn.execute(sql_like, params + [like_q, like_q, like_q]).fetchone()
+    @classmethod
+    def _count_rows_like(cls, conn, q, where, params):
+        row = conn.execute(*cls._like_count_query(q, where, params)).fetchone()
         return int((row or {})["total"] if row else 0)
 
     @staticmethod
@@ -995,165 +2454,1009 @@ class PromptVaultStore:
         finally:
             conn.close()
 
-    def export_bundle(self):
+    def get_entry_version(self, entry_id, version):
+        """按需还原某个历史版本的完整内容；不存在时抛 KeyError。"""
         conn = self._connect()
         try:
-            template_rows = conn.execute("SELECT * FROM templates ORDER BY updated_at DESC, id ASC").fetchall()
-            fragment_rows = conn.execute("SELECT * FROM fragments ORDER BY updated_at DESC, id ASC").fetchall()
-            entry_rows = conn.execute("SELECT * FROM entries ORDER BY updated_at DESC, id ASC").fetchall()
-            return {
-                "version": "1.0",
-                "exported_at": now_iso(),
-                "templates": [self._row_to_template(row) for row in template_rows],
-                "fragments": [self._row_to_fragment(row) for row in fragment_rows],
-                "entries": [self._row_to_entry(row, include_thumbnail=True) for row in entry_rows],
-            }
+            row, snapshot, _chain = self._load_version(conn, entry_id, version)
+            if row is None or int(row["version"]) != int(version):
+                raise KeyError(f"{entry_id}@{version}")
+            return {"version": row["version"], "created_at": row["created_at"], "snapshot": snapshot}
         finally:
             conn.close()
 
-    def export_bundle_csv(self):
-        bundle = self.export_bundle()
-        fields = [
-            "record_type",
-            "id",
-            "title",
-            "text",
-            "ir_json",
-            "status",
-            "version",
-            "lang",
-            "template_id",
-            "tags_json",
-            "model_scope_json",
-            "variables_json",
-            "fragments_json",
-            "raw_json",
-            "negative_json",
-            "params_json",
-            "favorite",
-            "score",
-            "hash",
-            "thumbnail_b64",
-            "thumbnail_width",
-            "thumbnail_height",
-            "created_at",
-            "updated_at",
-        ]
-        buf = io.StringIO()
-        writer = csv.DictWriter(buf, fieldnames=fields)
-        writer.writeheader()
-        for template in bundle["templates"]:
-            writer.writerow(
-                {
-                    "record_type": "template",
-                    "id": template["id"],
-                    "title": template["title"],
-                    "ir_json": json_dumps(template.get("ir") or {}),
-                    "created_at": template.get("created_at", ""),
-                    "updated_at": template.get("updated_at", ""),
-                }
-            )
-        for fragment in bundle["fragments"]:
-            writer.writerow(
-                {
-                    "record_type": "fragment",
-                    "id": fragment["id"],
-                    "title": fragment["title"],
-                    "text": fragment.get("text", ""),
-                    "tags_json": json_dumps(fragment.get("tags") or []),
-                    "model_scope_json": json_dumps(fragment.get("model_scope") or []),
-                    "created_at": fragment.get("created_at", ""),
-                    "updated_at": fragment.get("updated_at", ""),
-                }
+    def _rewrite_version_chain(self, conn, entry_id, keep=None):
+        """重新编码一条记录的全部历史：依次还原每个版本，删除 keep(rows) 未选中的行，
+        保留的行按 VERSION_KEYFRAME_INTERVAL 重新写成关键帧 + 差量。
+
+        keep 接收按版本升序的行列表，返回要保留的行 id 集合；为 None 时全部保留。
+        返回 {kept, deleted, bytes_before, bytes_after}。
+        """
+        rows = conn.execute(
+            """
+            SELECT id, version, created_at, keyframe, snapshot_json, snapshot_blob FROM entry_versions
+            WHERE entry_id = ? ORDER BY version ASC, id ASC
+            """,
+            (entry_id,),
+        ).fetchall()
+        keep_ids = {row["id"] for row in rows} if keep is None else keep(rows)
+        result = {"kept": 0, "deleted": 0, "bytes_before": 0, "bytes_after": 0}
+        if keep is not None and len(keep_ids) == len(rows):
+            result["kept"] = len(rows)
+            return result
+        updates = []
+        snapshot = None
+        previous = None
+        for row in rows:
+            data = self._unpack_snapshot(row)
+            snapshot = data if row["keyframe"] or snapshot is None else apply_json_delta(snapshot, data)
+            result["bytes_before"] += len(row["snapshot_json"].encode("utf-8")) + len(row["snapshot_blob"] or b"")
+            if row["id"] not in keep_ids:
+                continue
+            stored = self._version_snapshot(snapshot)
+            if len(updates) % self.VERSION_KEYFRAME_INTERVAL == 0:
+                blob, keyframe = self._pack_snapshot(stored), 1
+            else:
+                blob, keyframe = self._pack_snapshot(json_delta(previous, stored)), 0
+            previous = stored
+            result["bytes_after"] += len(blob)
+            updates.append((blob, keyframe, row["id"]))
+        deleted = [(row["id"],) for row in rows if row["id"] not in keep_ids]
+        if deleted:
+            conn.executemany("DELETE FROM entry_versions WHERE id = ?", deleted)
+        conn.executemany(
+            "UPDATE entry_versions SET snapshot_json = '', snapshot_blob = ?, keyframe = ? WHERE id = ?",
+            updates,
+        )
+        result["kept"] = len(updates)
+        result["deleted"] = len(deleted)
+        return result
+
+    def compress_entry_versions(self, batch_size=None, progress=None):
+        """把旧格式的完整快照改写成“关键帧 + zlib 差量”，按记录分批提交，可重复执行。
+
+        同时剔除旧快照里的缩略图 base64（见 VERSION_SNAPSHOT_EXCLUDE）。
+
+        返回 {entries, rows, bytes_before, bytes_after}，字节数为快照列的存储大小。
+        """
+        batch_size = max(1, int(batch_size or self.COMPRESS_VERSIONS_BATCH))
+        summary = {"entries": 0, "rows": 0, "bytes_before": 0, "bytes_after": 0}
+        cursor = ""
+        while True:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # 按 entry_id 游标前进，沿 (entry_id, version) 索引只扫一遍
+                entry_ids = [
+                    row["entry_id"]
+                    for row in conn.execute(
+                        """
+                        SELECT DISTINCT entry_id FROM entry_versions
+                        WHERE entry_id > ? AND snapshot_blob IS NULL
+                        ORDER BY entry_id LIMIT ?
+                        """,
+                        (cursor, batch_size),
+                    ).fetchall()
+                ]
+                if not entry_ids:
+                    conn.rollback()
+                    break
+                for entry_id in entry_ids:
+                    result = self._rewrite_version_chain(conn, entry_id)
+                    summary["rows"] += result["kept"]
+                    summary["bytes_before"] += result["bytes_before"]
+                    summary["bytes_after"] += result["bytes_after"]
+                conn.commit()
+            finally:
+                conn.close()
+            summary["entries"] += len(entry_ids)
+            cursor = entry_ids[-1]
+            if progress:
+                progress(dict(summary))
+        return summary
+
+    def retention_policy(self):
+        settings = self.get_settings()
+        return {
+            "keep_last": max(1, int(settings["version_keep_last"])),
+            "keep_days": int(settings["version_keep_days"]),
+            "thin_daily": bool(settings["version_thin_daily"]),
+        }
+
+    @staticmethod
+    def _retention_keep(policy, cutoff):
+        """按保留策略返回 keep(rows) 函数，供 _rewrite_version_chain 使用。"""
+
+        def keep(rows):
+            kept = set()
+            days = set()
+            for index, row in enumerate(reversed(rows)):
+                day = str(row["created_at"])[:10]
+                if index < policy["keep_last"] or row["created_at"] >= cutoff:
+                    kept.add(row["id"])
+                    days.add(day)
+                elif policy["thin_daily"] and day not in days:
+                    # 从新到旧遍历，每天遇到的第一个即当天最后一个版本
+                    kept.add(row["id"])
+                    days.add(day)
+            return kept
+
+        return keep
+
+    def compact_entry_versions(self, batch_size=None, max_batches=None, cursor="", progress=None):
+        """按保留策略删除多余的历史版本，并把剩余版本重新编码为关键帧 + 差量。
+
+        按 entry_id 游标分批处理，每批一个短事务；max_batches 限制本次处理的批数，
+        返回的 cursor 用于下一次继续，complete 为真表示已扫完一轮（cursor 归零）。
+        返回 {policy, entries_checked, entries_compacted, deleted, kept, bytes_reclaimed, cursor, complete}。
+        """
+        policy = self.retention_policy()
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=policy["keep_days"])).replace(microsecond=0).isoformat()
+        keep = self._retention_keep(policy, cutoff)
+        batch_size = max(1, int(batch_size or self.COMPACTION_BATCH_SIZE))
+        summary = {
+            "policy": policy,
+            "entries_checked": 0,
+            "entries_compacted": 0,
+            "deleted": 0,
+            "kept": 0,
+            "bytes_reclaimed": 0,
+            "cursor": cursor or "",
+            "complete": False,
+        }
+        batches = 0
+        while not max_batches or batches < int(max_batches):
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # 只挑出版本数超过 keep_last 且有早于保留窗口的版本的记录
+                entry_ids = [
+                    row["entry_id"]
+                    for row in conn.execute(
+                        """
+                        SELECT entry_id FROM entry_versions
+                        WHERE entry_id > ?
+                        GROUP BY entry_id
+                        HAVING COUNT(*) > ? AND MIN(created_at) < ?
+                        ORDER BY entry_id LIMIT ?
+                        """,
+                        (summary["cursor"], policy["keep_last"], cutoff, batch_size),
+                    ).fetchall()
+                ]
+                if not entry_ids:
+                    conn.rollback()
+                    summary["cursor"] = ""
+                    summary["complete"] = True
+                    break
+                for entry_id in entry_ids:
+                    result = self._rewrite_version_chain(conn, entry_id, keep=keep)
+                    summary["kept"] += result["kept"]
+                    if result["deleted"]:
+                        summary["entries_compacted"] += 1
+                        summary["deleted"] += result["deleted"]
+                        summary["bytes_reclaimed"] += result["bytes_before"] - result["bytes_after"]
+                conn.commit()
+            finally:
+                conn.close()
+            summary["entries_checked"] += len(entry_ids)
+            summary["cursor"] = entry_ids[-1]
+            batches += 1
+            if progress:
+                progress(dict(summary))
+        return summary
+
+    def start_background_compaction(self):
+        """启动后台版本压缩线程（幂等）。间隔由 version_compaction_interval 设置控制。"""
+        with self._compaction_lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return False
+            self._compaction_stop.clear()
+            self._compaction_thread = threading.Thread(
+                target=self._compaction_loop, name="PromptVaultVersionCompaction", daemon=True
             )
-        for entry in bundle["entries"]:
-            writer.writerow(
-                {
-                    "record_type": "entry",
-                    "id": entry["id"],
-                    "title": entry["title"],
-                    "status": entry.get("status", "active"),
-                    "version": entry.get("version", 1),
-                    "lang": entry.get("lang", "zh-CN"),
-                    "template_id": entry.get("template_id") or "",
-                    "tags_json": json_dumps(entry.get("tags") or []),
-                    "model_scope_json": json_dumps(entry.get("model_scope") or []),
-                    "variables_json": json_dumps(entry.get("variables") or {}),
-                    "fragments_json": json_dumps(entry.get("fragments") or []),
-                    "raw_json": json_dumps(entry.get("raw") or {}),
-                    "negative_json": json_dumps(entry.get("negative") or {}),
-                    "params_json": json_dumps(entry.get("params") or {}),
-                    "favorite": entry.get("favorite", 0),
-                    "score": entry.get("score", 0.0),
-                    "hash": entry.get("hash", ""),
-                    "thumbnail_b64": entry.get("thumbnail_b64", ""),
-                    "thumbnail_width": entry.get("thumbnail_width") or "",
-                    "thumbnail_height": entry.get("thumbnail_height") or "",
-                    "created_at": entry.get("created_at", ""),
-                    "updated_at": entry.get("updated_at", ""),
-                }
+            self._compaction_thread.start()
+            return True
+
+    def stop_background_compaction(self, timeout=None):
+        self._compaction_stop.set()
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _compaction_loop(self):
+        cursor = ""
+        delay = self.COMPACTION_STARTUP_DELAY
+        while not self._compaction_stop.wait(delay):
+            interval = float(self.get_settings()["version_compaction_interval"])
+            if interval <= 0:
+                delay = self.COMPACTION_STARTUP_DELAY
+                continue
+            try:
+                report = self.compact_entry_versions(max_batches=self.COMPACTION_MAX_BATCHES, cursor=cursor)
+                if report["deleted"]:
+                    report["vacuum"] = self.incremental_vacuum()
+            except Exception:
+                logger.exception("background version compaction failed")
+                delay = interval
+                continue
+            cursor = report["cursor"]
+            report["finished_at"] = now_iso()
+            self.compaction_status = report
+            # 一轮没扫完时稍作停顿后继续，扫完一轮再等待完整间隔
+            delay = interval if report["complete"] else self.COMPACTION_BATCH_PAUSE
+
+    def thumbnail_migration_pending(self):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'thumbnail_table_version'").fetchone()
+            return not row or row["value"] != self.THUMBNAIL_TABLE_VERSION
+        finally:
+            conn.close()
+
+    def migrate_thumbnails(self, batch_size=None, max_batches=None, cursor=0, progress=None):
+        """把内联在 entries.thumbnail_png 的旧版缩略图分批搬到按内容哈希去重的 thumbnail_blobs，
+        并补算内容哈希。
+
+        按 rowid 游标推进，每批一个短事务，期间读写照常进行（读取两处都认）。
+        max_batches 限制本次处理的批数，返回的 cursor 用于下一次继续；
+        全部搬完后写入 meta 标记。返回 {moved, deduplicated, bytes, batches, cursor, complete}，
+        deduplicated 为哈希已存在、只增加引用计数的条数。搬完后的空闲页可用 vacuum 回收。
+        """
+        batch_size = max(1, int(batch_size or self.THUMBNAIL_MIGRATION_BATCH_SIZE))
+        summary = {
+            "moved": 0,
+            "deduplicated": 0,
+            "bytes": 0,
+            "batches": 0,
+            "cursor": int(cursor or 0),
+            "complete": False,
+        }
+        while not max_batches or summary["batches"] < int(max_batches):
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    f"""
+                    SELECT rowid, id, thumbnail_png AS data FROM entries
+                    WHERE rowid > ? AND ({self.THUMBNAIL_PENDING_SQL})
+                    ORDER BY rowid LIMIT ?
+                    """,
+                    (summary["cursor"], batch_size),
+                ).fetchall()
+                if not rows:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO meta(key,value) VALUES('thumbnail_table_version', ?)",
+                        (self.THUMBNAIL_TABLE_VERSION,),
+                    )
+                    conn.commit()
+                    summary["complete"] = True
+                    break
+                hashes = {row["id"]: content_hash(row["data"]) for row in rows if row["data"] is not None}
+                existing = self._existing_thumbnail_hashes(conn, hashes.values())
+                conn.executemany(
+                    "INSERT OR IGNORE INTO thumbnail_blobs(blob_hash, data, refcount) VALUES(?, ?, 0)",
+                    [(hashes[row["id"]], row["data"]) for row in rows if row["id"] in hashes],
+                )
+                conn.executemany(
+                    "UPDATE entries SET thumbnail_png = NULL, has_thumbnail = ?, thumbnail_hash = ? WHERE id = ?",
+                    [(int(row["id"] in hashes), hashes.get(row["id"]), row["id"]) for row in rows],
+                )
+                # 旧版位置的引用此前不计数，这里按已迁移的记录重算本批涉及的哈希
+                conn.executemany(
+                    f"""
+                    UPDATE thumbnail_blobs SET refcount = (
+                      SELECT COUNT(*) FROM entries e
+                      WHERE e.thumbnail_hash = thumbnail_blobs.blob_hash AND NOT {self.LEGACY_THUMBNAIL_SQL}
+                    ) WHERE blob_hash = ?
+                    """,
+                    [(thumb_hash,) for thumb_hash in set(hashes.values())],
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            summary["cursor"] = rows[-1]["rowid"]
+            summary["moved"] += len(rows)
+            summary["deduplicated"] += len(hashes) - len(set(hashes.values()) - existing)
+            summary["bytes"] += sum(len(row["data"]) for row in rows if row["data"] is not None)
+            summary["batches"] += 1
+            if progress:
+                progress(dict(summary))
+        return summary
+
+    def start_thumbnail_migration(self):
+        """旧库仍有待迁移的缩略图，或缩略图缺少感知哈希 / 占位图时启动后台线程（幂等），处理完即退出。"""
+        with self._compaction_lock:
+            if self._thumbnail_migration_thread is not None and self._thumbnail_migration_thread.is_alive():
+                return False
+            if not self.thumbnail_migration_pending() and not self.thumbnail_features_pending():
+                return False
+            self._thumbnail_migration_thread = threading.Thread(
+                target=self._thumbnail_migration_loop, name="PromptVaultThumbnailMigration", daemon=True
             )
-        return buf.getvalue()
+            self._thumbnail_migration_thread.start()
+            return True
+
+    def _thumbnail_migration_loop(self):
+        status = {
+            "moved": 0,
+            "deduplicated": 0,
+            "bytes": 0,
+            "batches": 0,
+            "cursor": 0,
+            "complete": False,
+            "started_at": now_iso(),
+        }
+        self.thumbnail_migration_status = status
+        try:
+            while not status["complete"] and not self._compaction_stop.is_set():
+                report = self.migrate_thumbnails(max_batches=1, cursor=status["cursor"])
+                for key in ("moved", "deduplicated", "bytes", "batches"):
+                    status[key] += report[key]
+                status["cursor"] = report["cursor"]
+                status["complete"] = report["complete"]
+                if not status["complete"]:
+                    time.sleep(self.THUMBNAIL_MIGRATION_PAUSE)
+            if status["complete"] and status["moved"]:
+                status["vacuum"] = self.incremental_vacuum()
+            # 迁移完成后为已有缩略图补算感知哈希和占位图，节奏同上
+            features = {"processed": 0, "failed": 0, "cursor": "", "complete": False}
+            status["features"] = features
+            while status["complete"] and not features["complete"] and not self._compaction_stop.is_set():
+                report = self.backfill_thumbnail_features(max_batches=1, cursor=features["cursor"])
+                features["processed"] += report["processed"]
+                features["failed"] += report["failed"]
+                features["cursor"] = report["cursor"]
+                features["complete"] = report["complete"]
+                if not features["complete"]:
+                    time.sleep(self.THUMBNAIL_MIGRATION_PAUSE)
+        except Exception as exc:
+            logger.exception("background thumbnail migration failed")
+            status["error"] = str(exc)
+        status["finished_at"] = now_iso()
+
+    def convert_thumbnail_renditions(self, batch_size=None, max_batches=None, cursor="", force=False, progress=None):
+        """为已有缩略图生成 WebP 副本（尺寸和质量取自设置）。
+
+        按 thumbnail_blobs 的哈希游标分批，内容相同的缩略图只编码一次：先在事务外读出 PNG 并编码，
+        再用一个短事务写入；写入前确认 blob 仍存在（未被并发清理），否则跳过该条。
+        force 为真时重新生成全部副本（修改尺寸或质量后使用）。
+        尚未迁移的旧版缩略图会被跳过，迁移完成后再运行一次即可。
+        返回 {converted, skipped, failed, png_bytes, webp_bytes, webp_bytes_by_width, encode_ms, cursor, complete}。
+        """
+        from .thumbnails import renditions_from_png
+
+        settings = self.get_settings()
+        sizes = list(settings["thumbnail_webp_sizes"] or [])
+        batch_size = max(1, int(batch_size or self.THUMBNAIL_CONVERT_BATCH_SIZE))
+        summary = {
+            "sizes": sizes,
+            "converted": 0,
+            "skipped": 0,
+            "failed": 0,
+            "png_bytes": 0,
+            "webp_bytes": 0,
+            "webp_bytes_by_width": {},
+            "encode_ms": 0.0,
+            "cursor": cursor or "",
+            "complete": False,
+        }
+        if not sizes:
+            summary["complete"] = True
+            return summary
+        missing_sql = (
+            "" if force else
+            " AND NOT EXISTS (SELECT 1 FROM thumbnail_renditions r WHERE r.blob_hash = b.blob_hash)"
+        )
+        batches = 0
+        while not max_batches or batches < int(max_batches):
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    f"SELECT b.blob_hash, b.data FROM thumbnail_blobs b WHERE b.blob_hash > ?{missing_sql} "
+                    "ORDER BY b.blob_hash LIMIT ?",
+                    (summary["cursor"], batch_size),
+                ).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                summary["cursor"] = ""
+                summary["complete"] = True
+                break
+
+            encoded = []
+            for row in rows:
+                try:
+                    renditions = renditions_from_png(
+                        bytes(row["data"]),
+                        sizes=sizes,
+                        quality=settings["thumbnail_webp_quality"],
+                        lossless=settings["thumbnail_webp_lossless"],
+                    )
+                except Exception:
+                    logger.exception("thumbnail rendition failed: %s", row["blob_hash"])
+                    summary["failed"] += 1
+                    continue
+                encoded.append((row, renditions))
+
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for row, renditions in encoded:
+                    # blob 按内容寻址，哈希还在就说明内容没变
+                    present = conn.execute(
+                        "SELECT 1 FROM thumbnail_blobs WHERE blob_hash = ?", (row["blob_hash"],)
+                    ).fetchone()
+                    if not present:
+                        summary["skipped"] += 1
+                        continue
+                    conn.execute("DELETE FROM thumbnail_renditions WHERE blob_hash = ?", (row["blob_hash"],))
+                    conn.executemany(self._RENDITION_INSERT_SQL, self._rendition_rows(row["blob_hash"], renditions))
+                    summary["converted"] += 1
+                    summary["png_bytes"] += len(row["data"])
+                    for item in renditions:
+                        summary["webp_bytes"] += len(item["data"])
+                        by_width = summary["webp_bytes_by_width"]
+                        by_width[item["width"]] = by_width.get(item["width"], 0) + len(item["data"])
+                        summary["encode_ms"] += item["encode_ms"]
+                conn.commit()
+            finally:
+                conn.close()
+            summary["cursor"] = rows[-1]["blob_hash"]
+            batches += 1
+            if progress:
+                progress(dict(summary))
+        summary["encode_ms"] = round(summary["encode_ms"], 1)
+        return summary
+
+    # 还缺感知哈希或占位图的缩略图（thumbnail_blobs 别名 b）
+    THUMBNAIL_FEATURES_MISSING_SQL = (
+        "(NOT EXISTS (SELECT 1 FROM thumbnail_phashes p WHERE p.blob_hash = b.blob_hash)"
+        " OR NOT EXISTS (SELECT 1 FROM thumbnail_placeholders tp WHERE tp.blob_hash = b.blob_hash))"
+    )
+
+    def thumbnail_features_pending(self):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f"SELECT 1 FROM thumbnail_blobs b WHERE {self.THUMBNAIL_FEATURES_MISSING_SQL} LIMIT 1"
+            ).fetchone()
+            return row is not None
+        finally:
+            conn.close()
+
+    def backfill_thumbnail_features(self, batch_size=None, max_batches=None, cursor="", progress=None):
+        """为还没有感知哈希或列表占位图的缩略图补算（新写入和导入的缩略图在写入时已经算好）。
+
+        按 thumbnail_blobs 的哈希游标分批：先在事务外读出 PNG 并整批计算，再用一个短事务写入，
+        期间被清理掉的 blob 直接跳过。返回 {processed, failed, batches, cursor, complete}，
+        failed 为无法解码的缩略图数（记为 NULL，不再重试）。
+        """
+        from .thumbnails import thumbnail_features
+
+        batch_size = max(1, int(batch_size or self.THUMBNAIL_FEATURES_BATCH_SIZE))
+        summary = {"processed": 0, "failed": 0, "batches": 0, "cursor": cursor or "", "complete": False}
+        while not max_batches or summary["batches"] < int(max_batches):
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    f"""
+                    SELECT b.blob_hash, b.data FROM thumbnail_blobs b
+                    WHERE b.blob_hash > ? AND {self.THUMBNAIL_FEATURES_MISSING_SQL}
+                    ORDER BY b.blob_hash LIMIT ?
+                    """,
+                    (summary["cursor"], batch_size),
+                ).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                summary["cursor"] = ""
+                summary["complete"] = True
+                break
+            features = thumbnail_features([bytes(row["data"]) for row in rows])
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                written = self._write_thumbnail_features(
+                    conn, [(row["blob_hash"], feature or {}) for row, feature in zip(rows, features)]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            failed = sum(1 for feature in features if feature is None)
+            summary["processed"] += written - failed
+            summary["failed"] += failed
+            summary["cursor"] = rows[-1]["blob_hash"]
+            summary["batches"] += 1
+            if progress:
+                progress(dict(summary))
+        return summary
+
+    EXPORT_CSV_FIELDS = (
+        "record_type",
+        "id",
+        "title",
+        "text",
+        "ir_json",
+        "status",
+        "version",
+        "lang",
+        "template_id",
+        "tags_json",
+        "model_scope_json",
+        "variables_json",
+        "fragments_json",
+        "raw_json",
+        "negative_json",
+        "params_json",
+        "favorite",
+        "score",
+        "hash",
+        "thumbnail_b64",
+        "thumbnail_width",
+        "thumbnail_height",
+        "created_at",
+        "updated_at",
+    )
+
+    def iter_export_records(self, batch_size=EXPORT_BATCH_SIZE):
+        """依次逐条产出模板、片段、记录的 (record_type, record)，记录带 base64 缩略图。
+
+        整个导出在同一个读事务里完成（WAL 下是一致快照，不阻塞写入），游标每次只取 batch_size 行；
+        按 rowid 而不是 updated_at 排序，免得 SQLite 先把整表连同缩略图排序一遍。
+        连接归创建它的线程所有，生成器必须在同一个线程里迭代和关闭。
+        """
+        batch_size = max(1, int(batch_size))
+        queries = {
+            "template": ("SELECT * FROM templates ORDER BY rowid", self._row_to_template),
+            "fragment": ("SELECT * FROM fragments ORDER BY rowid", self._row_to_fragment),
+            "entry": (
+                f"SELECT {self.ENTRY_FIELDS}, {self.THUMBNAIL_DATA_SQL} AS thumbnail_png"
+                " FROM entries e ORDER BY e.rowid",
+                lambda row: self._row_to_entry(row, include_thumbnail=True),
+            ),
+        }
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            for record_type, _key in self.EXPORT_SECTIONS:
+                sql, convert = queries[record_type]
+                cursor = conn.execute(sql)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield record_type, convert(row)
+        finally:
+            conn.close()
+
+    def iter_export_text(self, fmt="json", batch_size=EXPORT_BATCH_SIZE, chunk_size=EXPORT_CHUNK_SIZE):
+        """把整库导出编码为 json / ndjson / csv 文本，按约 chunk_size 个字符一块产出，内存占用与库大小无关。
 
-    def import_bundle(self, bundle, conflict_strategy="merge"):
+        - json：与 export_bundle 相同的键，数组里每条记录占一行；
+        - ndjson：首行 {"record_type": "meta", "version", "exported_at"}，之后每行一条带 record_type 的记录；
+        - csv：表头 + 每条记录一行，列见 EXPORT_CSV_FIELDS。
+        """
+        if fmt not in self.EXPORT_FORMATS:
+            raise ValueError(f"unsupported export format: {fmt}")
+        pieces = []
+        size = 0
+        for piece in self._iter_export_pieces(fmt, batch_size):
+            pieces.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield "".join(pieces)
+                pieces = []
+                size = 0
+        if pieces:
+            yield "".join(pieces)
+
+    def _iter_export_pieces(self, fmt, batch_size):
+        records = self.iter_export_records(batch_size)
+        try:
+            if fmt == "csv":
+                buf = io.StringIO()
+                writer = csv.DictWriter(buf, fieldnames=self.EXPORT_CSV_FIELDS)
+                writer.writeheader()
+                for record_type, record in records:
+                    writer.writerow(self._record_to_csv_row(record_type, record))
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+                if buf.tell():
+                    yield buf.getvalue()
+                return
+            exported_at = now_iso()
+            if fmt == "ndjson":
+                meta = {"record_type": "meta", "version": self.EXPORT_VERSION, "exported_at": exported_at}
+                yield json.dumps(meta, ensure_ascii=False) + "\n"
+                for record_type, record in records:
+                    yield json.dumps({"record_type": record_type, **record}, ensure_ascii=False) + "\n"
+                return
+            yield f'{{\n  "version": {json.dumps(self.EXPORT_VERSION)},\n  "exported_at": {json.dumps(exported_at)}'
+            sections = iter(self.EXPORT_SECTIONS)
+            current = None
+            separator = ""
+            for record_type, record in records:
+                while record_type != current:
+                    if current is not None:
+                        yield "\n  ]"
+                    current, key = next(sections)
+                    yield f',\n  "{key}": ['
+                    separator = "\n    "
+                yield separator + json.dumps(record, ensure_ascii=False)
+                separator = ",\n    "
+            if current is not None:
+                yield "\n  ]"
+            for _record_type, key in sections:
+                yield f',\n  "{key}": []'
+            yield "\n}\n"
+        finally:
+            records.close()
+
+    @staticmethod
+    def _record_to_csv_row(record_type, record):
+        if record_type == "template":
+            return {
+                "record_type": "template",
+                "id": record["id"],
+                "title": record["title"],
+                "ir_json": json_dumps(record.get("ir") or {}),
+                "created_at": record.get("created_at", ""),
+                "updated_at": record.get("updated_at", ""),
+            }
+        if record_type == "fragment":
+            return {
+                "record_type": "fragment",
+                "id": record["id"],
+                "title": record["title"],
+                "text": record.get("text", ""),
+                "tags_json": json_dumps(record.get("tags") or []),
+                "model_scope_json": json_dumps(record.get("model_scope") or []),
+                "created_at": record.get("created_at", ""),
+                "updated_at": record.get("updated_at", ""),
+            }
+        return {
+            "record_type": "entry",
+            "id": record["id"],
+            "title": record["title"],
+            "status": record.get("status", "active"),
+            "version": record.get("version", 1),
+            "lang": record.get("lang", "zh-CN"),
+            "template_id": record.get("template_id") or "",
+            "tags_json": json_dumps(record.get("tags") or []),
+            "model_scope_json": json_dumps(record.get("model_scope") or []),
+            "variables_json": json_dumps(record.get("variables") or {}),
+            "fragments_json": json_dumps(record.get("fragments") or []),
+            "raw_json": json_dumps(record.get("raw") or {}),
+            "negative_json": json_dumps(record.get("negative") or {}),
+            "params_json": json_dumps(record.get("params") or {}),
+            "favorite": record.get("favorite", 0),
+            "score": record.get("score", 0.0),
+            "hash": record.get("hash", ""),
+            "thumbnail_b64": record.get("thumbnail_b64", ""),
+            "thumbnail_width": record.get("thumbnail_width") or "",
+            "thumbnail_height": record.get("thumbnail_height") or "",
+            "created_at": record.get("created_at", ""),
+            "updated_at": record.get("updated_at", ""),
+        }
+
+    def export_bundle(self):
+        """把整库读成一个 dict（整库常驻内存，供测试和小库使用；导出接口走 iter_export_text）。"""
+        bundle = {"version": self.EXPORT_VERSION, "exported_at": now_iso()}
+        keys = dict(self.EXPORT_SECTIONS)
+        bundle.update({key: [] for key in keys.values()})
+        for record_type, record in self.iter_export_records():
+            bundle[keys[record_type]].append(record)
+        return bundle
+
+    def export_bundle_csv(self):
+        return "".join(self.iter_export_text("csv"))
+
+    def import_bundle(self, bundle, conflict_strategy="merge", batch_size=None):
+        """合并一个已在内存里的导出包；每 batch_size 条提交一次，单条出错只回滚这一条。"""
         if conflict_strategy != "merge":
             raise ValueError("Only merge conflict strategy is supported")
         if not isinstance(bundle, dict):
             raise ValueError("Import bundle must be a JSON object")
+        records = (
+            (record_type, payload)
+            for record_type, key in self.EXPORT_SECTIONS
+            for payload in (bundle.get(key) or [])
+        )
+        return self._import_records(records, batch_size)
+
+    def import_csv_text(self, csv_text, conflict_strategy="merge", batch_size=None):
+        if conflict_strategy != "merge":
+            raise ValueError("Only merge conflict strategy is supported")
+        self._ensure_csv_field_limit()
+        converters = self._csv_converters()
+        records = (
+            (record_type, converters[record_type](row))
+            for row in csv.DictReader(io.StringIO(csv_text or ""))
+            for record_type in [(row.get("record_type") or "").strip().lower()]
+            if record_type in converters
+        )
+        return self._import_records(records, batch_size)
 
-        templates = bundle.get("templates") or []
-        fragments = bundle.get("fragments") or []
-        entries = bundle.get("entries") or []
+    def _import_records(self, records, batch_size):
+        result = {"created": 0, "updated": 0, "skipped": 0, "errors": [], "error_count": 0, "details": []}
+        batch_size = max(1, int(batch_size or self.IMPORT_BATCH_SIZE))
+        records = iter(records)
+        conn = self._connect()
+        try:
+            for batch in iter(lambda: list(itertools.islice(records, batch_size)), []):
+                features = self._import_thumbnail_features(conn, batch)
+                conn.execute("BEGIN IMMEDIATE")
+                for record_type, payload in batch:
+                    self._import_into(conn, record_type, payload, result, features=features)
+                conn.commit()
+                self._invalidate_read_caches()
+            return result
+        finally:
+            conn.close()
 
-        result = {
-            "created": 0,
-            "updated": 0,
-            "skipped": 0,
-            "errors": [],
-            "details": [],
+    def _import_into(self, conn, record_type, payload, result, max_errors=None, features=None):
+        """在当前事务里合并一条记录并把结果累加到 result。
+
+        每条记录包在一个 SAVEPOINT 里，出错时只回滚这一条；errors 最多保留 max_errors 条，
+        总数见 error_count。result 含 details 列表时逐条记录动作。features 为事务开始前
+        由 _import_thumbnail_features 算好的缩略图特征。
+        """
+        record_id = str(payload.get("id") or "") if isinstance(payload, dict) else ""
+        conn.execute("SAVEPOINT import_record")
+        try:
+            if not isinstance(payload, dict):
+                raise ValueError("record must be a JSON object")
+            action = self._import_record(conn, record_type, payload, features)
+            if action is None:
+                raise ValueError("record id is required")
+        except Exception as exc:
+            conn.execute("ROLLBACK TO import_record")
+            result["error_count"] += 1
+            if max_errors is None or len(result["errors"]) < max_errors:
+                result["errors"].append({"record_type": record_type, "id": record_id, "error": str(exc)})
+            return
+        finally:
+            conn.execute("RELEASE import_record")
+        result[action] += 1
+        if "details" in result:
+            result["details"].append({"record_type": record_type, "id": record_id, "action": action})
+
+    def _csv_converters(self):
+        return {
+            "template": self._csv_row_to_template,
+            "fragment": self._csv_row_to_fragment,
+            "entry": self._csv_row_to_entry,
         }
 
+    # ── 流式导入 ──
+
+    def new_import_upload_path(self):
+        """上传导入文件的临时位置：库文件旁的 imports 目录。"""
+        directory = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), "imports")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{uuid.uuid4().hex}.upload")
+
+    def create_import(self, source_path, filename="", fmt="", owns_source=False):
+        """登记一次从 source_path 读取的流式导入，返回导入状态（见 get_import）。
+
+        fmt 为空时按文件名和内容判断；owns_source 为真时（上传的临时文件）导入完成或放弃后删除该文件。
+        """
+        from .import_reader import IMPORT_FORMATS
+
+        fmt = str(fmt or "").strip().lower()
+        if fmt and fmt not in IMPORT_FORMATS:
+            raise ValueError(f"unsupported import format: {fmt}")
+        import_id = f"import_{uuid.uuid4().hex}"
+        now = now_iso()
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO import_checkpoints(
+                  import_id, source_path, owns_source, filename, format, state, created_at, updated_at
+                ) VALUES(?, ?, ?, ?, ?, 'pending', ?, ?)
+                """,
+                (import_id, os.path.abspath(source_path), int(bool(owns_source)), str(filename or ""), fmt, now, now),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return self.get_import(import_id)
+
+    def list_imports(self, limit=20):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM import_checkpoints ORDER BY created_at DESC, import_id LIMIT ?",
+                (max(1, min(int(limit), 200)),),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_import(row) for row in rows]
+
+    def get_import(self, import_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM import_checkpoints WHERE import_id = ?", (import_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            raise KeyError("import not found")
+        return self._row_to_import(row)
+
+    def discard_import(self, import_id):
+        """删除一次未完成导入的断点，以及它持有的上传文件；已导入的记录保留。"""
+        with self._import_lock:
+            if import_id in self._running_imports:
+                raise ValueError("import is running")
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT source_path, owns_source FROM import_checkpoints WHERE import_id = ?", (import_id,)
+                ).fetchone()
+                if not row:
+                    raise KeyError("import not found")
+                conn.execute("DELETE FROM import_checkpoints WHERE import_id = ?", (import_id,))
+                conn.commit()
+            finally:
+                conn.close()
+        if row["owns_source"]:
+            self._remove_import_source(row["source_path"])
+
+    def import_file(self, path, fmt="", batch_size=None, progress=None):
+        checkpoint = self.create_import(path, filename=os.path.basename(path), fmt=fmt)
+        return self.run_import(checkpoint["import_id"], batch_size=batch_size, progress=progress)
+
+    def run_import(self, import_id, batch_size=None, progress=None):
+        """流式导入（或从断点续导）一个 json / ndjson / csv 文件，可为 gzip 压缩。
+
+        文件逐条解析，每 batch_size 条在一个短的 BEGIN IMMEDIATE 事务里合并，断点（已处理条数、
+        ndjson / csv 的字节位置、累计结果）随同一个事务提交，所以中断后再次调用会从最后提交的那批之后
+        继续，不会重复或遗漏。每批提交后调用 progress(dict)。返回最终的导入状态（见 get_import）。
+        """
+        with self._import_lock:
+            if import_id in self._running_imports:
+                raise ValueError("import is already running")
+            self._running_imports.add(import_id)
+        try:
+            self._run_import(import_id, max(1, int(batch_size or self.IMPORT_BATCH_SIZE)), progress)
+        finally:
+            with self._import_lock:
+                self._running_imports.discard(import_id)
+        return self.get_import(import_id)
+
+    def _run_import(self, import_id, batch_size, progress):
+        from .import_reader import iter_records, open_source, sniff
+
         conn = self._connect()
+        fh = raw = None
         try:
-            for record_type, records in (("template", templates), ("fragment", fragments), ("entry", entries)):
-                for payload in records:
-                    try:
-                        action = self._import_record(conn, record_type, payload or {})
-                        result[action] += 1
-                        result["details"].append(
+            row = conn.execute("SELECT * FROM import_checkpoints WHERE import_id = ?", (import_id,)).fetchone()
+            if not row:
+                raise KeyError("import not found")
+            if row["state"] == "done":
+                return
+            summary = json.loads(row["summary_json"] or "{}")
+            for key in ("created", "updated", "skipped", "error_count"):
+                summary.setdefault(key, 0)
+            summary.setdefault("errors", [])
+            records_done = int(row["records"])
+            try:
+                if not os.path.exists(row["source_path"]):
+                    raise ValueError("import source file is missing")
+                total_bytes = os.path.getsize(row["source_path"])
+                fh, raw = open_source(row["source_path"])
+                encoding, fmt = sniff(fh, row["filename"], row["format"])
+                conn.execute(
+                    "UPDATE import_checkpoints SET format = ?, state = 'running', error = NULL, updated_at = ?"
+                    " WHERE import_id = ?",
+                    (fmt, now_iso(), import_id),
+                )
+                conn.commit()
+
+                def report():
+                    if progress:
+                        progress(
                             {
-                                "record_type": record_type,
-                                "id": str((payload or {}).get("id") or ""),
-                                "action": action,
+                                "import_id": import_id,
+                                "format": fmt,
+                                "records": records_done,
+                                "bytes_read": raw.tell(),
+                                "total_bytes": total_bytes,
+                                **{k: summary[k] for k in ("created", "updated", "skipped", "error_count")},
                             }
                         )
-                    except Exception as exc:
-                        record_id = str((payload or {}).get("id") or "")
-                        result["errors"].append(
-                            {
-                                "record_type": record_type,
-                                "id": record_id,
-                                "error": str(exc),
-                            }
+
+                report()
+                if fmt == "csv":
+                    self._ensure_csv_field_limit()
+                converters = self._csv_converters() if fmt == "csv" else None
+                # json 的元素边界不记字节位置，续导时重新解析并跳过已提交的条数
+                offset = int(row["byte_offset"] or 0) if fmt != "json" else 0
+                stream = iter_records(fh, fmt, encoding, offset)
+                if fmt == "json" and records_done:
+                    for _ in itertools.islice(stream, records_done):
+                        pass
+                for batch in iter(lambda: list(itertools.islice(stream, batch_size)), []):
+                    records = [
+                        (record_type, converters[record_type](payload) if converters else payload)
+                        for record_type, payload, _offset in batch
+                        if record_type in ("template", "fragment", "entry")
+                    ]
+                    features = self._import_thumbnail_features(conn, records)
+                    conn.execute("BEGIN IMMEDIATE")
+                    for record_type, payload in records:
+                        self._import_into(
+                            conn, record_type, payload, summary, max_errors=self.IMPORT_MAX_ERRORS, features=features
                         )
+                    records_done += len(batch)
+                    conn.execute(
+                        """
+                        UPDATE import_checkpoints
+                        SET records = ?, byte_offset = ?, summary_json = ?, updated_at = ?
+                        WHERE import_id = ?
+                        """,
+                        (records_done, batch[-1][2], json_dumps(summary), now_iso(), import_id),
+                    )
+                    conn.commit()
+                    self._invalidate_read_caches()
+                    report()
+            except Exception as exc:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute(
+                    "UPDATE import_checkpoints SET state = 'failed', error = ?, updated_at = ? WHERE import_id = ?",
+                    (str(exc), now_iso(), import_id),
+                )
+                conn.commit()
+                raise
+            conn.execute(
+                "UPDATE import_checkpoints SET state = 'done', updated_at = ? WHERE import_id = ?",
+                (now_iso(), import_id),
+            )
             conn.commit()
-            return result
         finally:
             conn.close()
+            if fh is not None:
+                fh.close()
+            if raw is not None and raw is not fh:
+                raw.close()
+        if row["owns_source"]:
+            self._remove_import_source(row["source_path"])
 
-    def import_csv_text(self, csv_text, conflict_strategy="merge"):
-        self._ensure_csv_field_limit()
-        reader = csv.DictReader(io.StringIO(csv_text or ""))
-        bundle = {"templates": [], "fragments": [], "entries": []}
-        for row in reader:
-            record_type = (row.get("record_type") or "").strip().lower()
-            if record_type == "template":
-                bundle["templates"].append(self._csv_row_to_template(row))
-            elif record_type == "fragment":
-                bundle["fragments"].append(self._csv_row_to_fragment(row))
-            elif record_type == "entry":
-                bundle["entries"].append(self._csv_row_to_entry(row))
-        return self.import_bundle(bundle, conflict_strategy=conflict_strategy)
+    @staticmethod
+    def _remove_import_source(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _row_to_import(self, row):
+        summary = json.loads(row["summary_json"] or "{}")
+        state = row["state"]
+        if row["import_id"] in self._running_imports:
+            state = "running"
+        elif state == "running":
+            # 进程在导入途中退出，断点仍在，可以续导
+            state = "interrupted"
+        return {
+            "import_id": row["import_id"],
+            "filename": row["filename"],
+            "format": row["format"],
+            "state": state,
+            "records": int(row["records"]),
+            "byte_offset": row["byte_offset"],
+            "created": int(summary.get("created", 0)),
+            "updated": int(summary.get("updated", 0)),
+            "skipped": int(summary.get("skipped", 0)),
+            "errors": summary.get("errors", []),
+            "error_count": int(summary.get("error_count", 0)),
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
 
     # ── LLM config helpers ──
 
@@ -1186,10 +3489,67 @@ class PromptVaultStore:
         finally:
             conn.close()
 
+    def get_settings(self) -> dict:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'store_settings'").fetchone()
+        finally:
+            conn.close()
+        settings = dict(self.DEFAULT_SETTINGS)
+        if row:
+            try:
+                stored = json.loads(row["value"])
+            except (json.JSONDecodeError, TypeError):
+                stored = {}
+            if isinstance(stored, dict):
+                settings.update({k: v for k, v in stored.items() if k in self.DEFAULT_SETTINGS})
+        return settings
+
+    def set_settings(self, updates: dict) -> dict:
+        """合并保存设置项；未知键或类型不符时抛出 ValueError，返回保存后的完整设置。"""
+        if not isinstance(updates, dict):
+            raise ValueError("settings 必须是 JSON 对象")
+        settings = self.get_settings()
+        for key, value in updates.items():
+            if key not in self.DEFAULT_SETTINGS:
+                raise ValueError(f"unknown setting: {key}")
+            default = self.DEFAULT_SETTINGS[key]
+            if isinstance(default, bool):
+                if not isinstance(value, bool):
+                    raise ValueError(f"{key} 必须是布尔值")
+            elif isinstance(default, (int, float)):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise ValueError(f"{key} 必须是数字")
+                if value < 0:
+                    raise ValueError(f"{key} 不能为负数")
+                value = type(default)(value)
+            elif isinstance(default, list):
+                if not isinstance(value, list) or any(
+                    isinstance(v, bool) or not isinstance(v, int) or v <= 0 for v in value
+                ):
+                    raise ValueError(f"{key} 必须是正整数数组")
+                value = sorted(set(value))
+            settings[key] = value
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta(key, value) VALUES('store_settings', ?)",
+                (json.dumps(settings, ensure_ascii=False),),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return settings
+
     def _row_to_entry(self, row, include_thumbnail=False):
         thumbnail_b64 = ""
-        if include_thumbnail and row["thumbnail_png"] is not None:
-            thumbnail_b64 = base64.b64encode(bytes(row["thumbnail_png"])).decode("ascii")
+        keys = row.keys()
+        if "thumbnail_png" in keys:
+            has_thumbnail = row["thumbnail_png"] is not None
+            if include_thumbnail and has_thumbnail:
+                thumbnail_b64 = base64.b64encode(bytes(row["thumbnail_png"])).decode("ascii")
+        else:
+            has_thumbnail = bool(row["has_thumbnail"])
         return {
             "id": row["id"],
             "title": row["title"],
@@ -1204,7 +3564,8 @@ class PromptVaultStore:
             "raw": json.loads(row["raw_json"] or "{}"),
             "negative": json.loads(row["negative_json"] or "{}"),
             "params": json.loads(row["params_json"] or "{}"),
-            "has_thumbnail": row["thumbnail_png"] is not None,
+            "has_thumbnail": has_thumbnail,
+            "thumbnail_hash": row["thumbnail_hash"],
             "thumbnail_width": row["thumbnail_width"],
             "thumbnail_height": row["thumbnail_height"],
             "favorite": int(row["favorite"] or 0),
@@ -1235,13 +3596,13 @@ class PromptVaultStore:
             "updated_at": row["updated_at"],
         }
 
-    def _import_record(self, conn, record_type, payload):
+    def _import_record(self, conn, record_type, payload, features=None):
         if record_type == "template":
             return self._merge_template(conn, payload)
         if record_type == "fragment":
             return self._merge_fragment(conn, payload)
         if record_type == "entry":
-            return self._merge_entry(conn, payload)
+            return self._merge_entry(conn, payload, features)
         raise ValueError(f"Unsupported record type: {record_type}")
 
     def _merge_template(self, conn, payload):
@@ -1299,25 +3660,25 @@ class PromptVaultStore:
         )
         return "created"
 
-    def _merge_entry(self, conn, payload):
+    def _merge_entry(self, conn, payload, features=None):
         entry_id = normalize_text(payload.get("id", ""))
         if not entry_id:
             raise ValueError("entry id is required")
-        row = conn.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+        row = conn.execute(f"SELECT {self.ENTRY_FIELDS} FROM entries WHERE id = ?", (entry_id,)).fetchone()
         if row:
-            return self._merge_existing_entry(conn, self._row_to_entry(row), payload, row["thumbnail_png"])
-        return self._create_imported_entry(conn, payload)
+            return self._merge_existing_entry(conn, self._row_to_entry(row), payload, features)
+        return self._create_imported_entry(conn, payload, features)
 
-    def _create_imported_entry(self, conn, payload):
+    def _create_imported_entry(self, conn, payload, features=None):
         entry = self._normalized_import_entry(payload, existing_created_at=None, base_version=0)
-        thumbnail_blob = self._thumbnail_blob_from_payload(entry)
+        thumb_hash, thumbnail_blob = self._import_thumbnail(conn, payload, entry)
         conn.execute(
             """
             INSERT INTO entries(
               id,title,status,version,lang,template_id,tags_json,model_scope_json,
               variables_json,fragments_json,raw_json,negative_json,params_json,
-              thumbnail_png,thumbnail_width,thumbnail_height,favorite,score,hash,created_at,updated_at
-            ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+              has_thumbnail,thumbnail_hash,thumbnail_width,thumbnail_height,favorite,score,hash,created_at,updated_at
+            ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
             """,
             (
                 entry["id"],
@@ -1333,7 +3694,8 @@ class PromptVaultStore:
                 json_dumps(entry["raw"]),
                 json_dumps(entry["negative"]),
                 json_dumps(entry["params"]),
-                thumbnail_blob,
+                int(thumb_hash is not None),
+                thumb_hash,
                 entry["thumbnail_width"],
                 entry["thumbnail_height"],
                 entry["favorite"],
@@ -1343,29 +3705,34 @@ class PromptVaultStore:
                 entry["updated_at"],
             ),
         )
-        conn.execute(
-            "INSERT INTO entry_versions(entry_id,version,snapshot_json,created_at) VALUES(?,?,?,?)",
-            (entry["id"], entry["version"], json_dumps(entry), entry["updated_at"]),
+        self._add_thumbnail_refs(conn, [(thumb_hash, thumbnail_blob, None, (features or {}).get(thumb_hash))])
+        self._write_version(conn, entry, entry["updated_at"])
+        self._apply_tag_deltas(
+            conn, self._tag_deltas([], "deleted", entry["tags"], entry["status"]), entry["updated_at"]
         )
-        for tag in entry["tags"]:
-            conn.execute("INSERT OR IGNORE INTO tags(name,created_at) VALUES(?,?)", (tag, entry["updated_at"]))
+        self._apply_model_deltas(conn, self._tag_deltas([], "deleted", entry["model_scope"], entry["status"]))
         self._sync_lookup_rows(conn, entry["id"], entry["tags"], entry["model_scope"])
-        self._fts_upsert(conn, entry)
         return "created"
 
-    def _merge_existing_entry(self, conn, existing_entry, payload, existing_thumbnail_blob):
+    def _merge_existing_entry(self, conn, existing_entry, payload, features=None):
         entry = self._normalized_import_entry(
             payload,
             existing_created_at=existing_entry.get("created_at"),
             base_version=int(existing_entry.get("version", 1)),
         )
-        thumbnail_blob = self._thumbnail_blob_from_payload(entry, existing_thumbnail_blob)
+        # 导入数据不带缩略图时保留库里现有的缩略图；缩略图没变（哈希相同）时不碰 blob
+        old_hash = existing_entry.get("thumbnail_hash")
+        thumb_hash, thumbnail_blob = self._import_thumbnail(conn, payload, entry)
+        if thumb_hash is not None and thumb_hash != old_hash:
+            self._replace_thumbnail(
+                conn, entry["id"], old_hash, thumb_hash, thumbnail_blob, features=(features or {}).get(thumb_hash)
+            )
         conn.execute(
             """
             UPDATE entries SET
               title=?, status=?, version=?, lang=?, template_id=?, tags_json=?, model_scope_json=?,
               variables_json=?, fragments_json=?, raw_json=?, negative_json=?, params_json=?,
-              thumbnail_png=?, thumbnail_width=?, thumbnail_height=?, favorite=?, score=?, hash=?, updated_at=?
+              has_thumbnail=?, thumbnail_hash=?, thumbnail_width=?, thumbnail_height=?, favorite=?, score=?, hash=?, updated_at=?
             WHERE id=?
             """,
             (
@@ -1381,7 +3748,8 @@ class PromptVaultStore:
                 json_dumps(entry["raw"]),
                 json_dumps(entry["negative"]),
                 json_dumps(entry["params"]),
-                thumbnail_blob,
+                int(thumb_hash is not None or bool(existing_entry.get("has_thumbnail"))),
+                thumb_hash or old_hash,
                 entry["thumbnail_width"],
                 entry["thumbnail_height"],
                 entry["favorite"],
@@ -1391,14 +3759,26 @@ class PromptVaultStore:
                 entry["id"],
             ),
         )
-        conn.execute(
-            "INSERT INTO entry_versions(entry_id,version,snapshot_json,created_at) VALUES(?,?,?,?)",
-            (entry["id"], entry["version"], json_dumps(entry), entry["updated_at"]),
+        self._write_version(conn, entry, entry["updated_at"])
+        self._apply_tag_deltas(
+            conn,
+            self._tag_deltas(existing_entry["tags"], existing_entry["status"], entry["tags"], entry["status"]),
+            entry["updated_at"],
+        )
+        self._apply_model_deltas(
+            conn,
+            self._tag_deltas(
+                existing_entry["model_scope"], existing_entry["status"], entry["model_scope"], entry["status"]
+            ),
+        )
+        self._sync_lookup_rows(
+            conn,
+            entry["id"],
+            entry["tags"],
+            entry["model_scope"],
+            existing_entry["tags"],
+            existing_entry["model_scope"],
         )
-        for tag in entry["tags"]:
-            conn.execute("INSERT OR IGNORE INTO tags(name,created_at) VALUES(?,?)", (tag, entry["updated_at"]))
-        self._sync_lookup_rows(conn, entry["id"], entry["tags"], entry["model_scope"])
-        self._fts_upsert(conn, entry)
         return "updated"
 
     def _normalized_import_entry(self, payload, existing_created_at=None, base_version=0):
@@ -1444,15 +3824,45 @@ class PromptVaultStore:
         entry["hash"] = stable_hash({k: v for k, v in entry.items() if k != "thumbnail_b64"})
         return entry
 
-    def _thumbnail_blob_from_payload(self, entry, existing_blob=None):
+    def _thumbnail_blob_from_payload(self, entry):
         thumb_b64 = entry.get("thumbnail_b64", "")
         if not thumb_b64:
-            return existing_blob
+            return None
         try:
             return sqlite3.Binary(base64.b64decode(thumb_b64))
         except Exception as exc:
             raise ValueError(f"invalid thumbnail_b64: {exc}") from exc
 
+    def _import_thumbnail_features(self, conn, records):
+        """写事务开始前为一批 (record_type, payload) 导入记录里的新缩略图计算特征。
+
+        base64 无效的记录跳过，留到合并时报错。返回值同 _compute_thumbnail_features。
+        """
+        items = []
+        for record_type, payload in records:
+            if record_type != "entry" or not isinstance(payload, dict):
+                continue
+            thumb_b64 = normalize_text(payload.get("thumbnail_b64", ""))
+            if not thumb_b64:
+                continue
+            try:
+                blob = base64.b64decode(thumb_b64)
+            except Exception:
+                continue
+            items.append((content_hash(blob), blob))
+        return self._compute_thumbnail_features(conn, items)
+
+    def _import_thumbnail(self, conn, payload, entry):
+        """解析导入记录的缩略图，返回 (thumbnail_hash, blob)；没有缩略图时为 (None, None)。
+
+        哈希总是按解码后的内容重新计算，不信任导出包里的 thumbnail_hash（手改过 thumbnail_b64
+        的文件会带着旧哈希）；库里已有同哈希的 blob 时由 _add_thumbnail_refs 只增加引用计数。
+        """
+        blob = self._thumbnail_blob_from_payload(entry)
+        if blob is None:
+            return None, None
+        return content_hash(blob), blob
+
     @staticmethod
     def _loads_json_object(raw, default=None):
         if isinstance(raw, dict):
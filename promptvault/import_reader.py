@@ -0,0 +1,244 @@
+"""导入文件的流式读取：识别 gzip、文本编码与格式，逐条产出 (record_type, payload, byte_offset)。
+
+整个文件从不整体读进内存：ndjson / csv 按行读取，json 用 JSONDecoder.raw_decode 在一个滑动缓冲区里
+逐个解析 templates / fragments / entries 数组的元素。byte_offset 是这条记录结束处在（解压后）
+字节流里的位置，断点续导时 ndjson / csv 可以直接 seek 过去；json 的元素边界不按字节记录，为 None，
+续导时按已处理的记录数跳过。
+"""
+
+import codecs
+import csv
+import gzip
+import json
+
+IMPORT_FORMATS = ("json", "ndjson", "csv")
+IMPORT_ENCODINGS = ("utf-8-sig", "utf-8", "gb18030", "cp936")
+# 判断格式时读取的开头字节数，也是校验编码时每次读取的字节数
+SNIFF_BYTES = 1 << 20
+# json 解析时每次补充进缓冲区的字节数，以及单个值最多允许占用的缓冲区字符数（防止坏文件被整个读进内存）
+JSON_READ_SIZE = 1 << 20
+JSON_MAX_VALUE_CHARS = 64 << 20
+# json 顶层对象里按记录逐条导入的数组，以及对应的 record_type
+JSON_SECTIONS = {"templates": "template", "fragments": "fragment", "entries": "entry"}
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_source(path):
+    """以二进制方式打开导入文件，gzip 文件透明解压。返回 (可读对象, 底层文件)，后者用于统计读取进度。"""
+    raw = open(path, "rb")
+    try:
+        if raw.read(2) == GZIP_MAGIC:
+            raw.seek(0)
+            return gzip.GzipFile(fileobj=raw, mode="rb"), raw
+        raw.seek(0)
+        return raw, raw
+    except Exception:
+        raw.close()
+        raise
+
+
+def sniff(fh, filename="", fmt=""):
+    """确定文本编码，未指定格式时再按文件名或开头内容判断格式；读完后回到开头。返回 (encoding, fmt)。
+
+    编码按 IMPORT_ENCODINGS 的顺序逐个用增量解码器把整个文件过一遍（只解码不保存），第一个
+    全程不出错的胜出：只看开头的话，前面全是 ASCII、后面才出现 GBK 字符的文件会被当成 UTF-8，
+    导入提交到一半才失败。常见的 UTF-8 文件只需一遍。
+    """
+    head = fh.read(SNIFF_BYTES)
+    fh.seek(0)
+    encoding = None
+    for candidate in IMPORT_ENCODINGS:
+        if _decodes(fh, candidate):
+            encoding = candidate
+            break
+    if encoding is None:
+        raise ValueError("导入文件编码不支持，请使用 UTF-8 或 GB18030/GBK")
+    if not fmt:
+        fmt = guess_format(filename, codecs.getincrementaldecoder(encoding)().decode(head))
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"unsupported import format: {fmt}")
+    return encoding, fmt
+
+
+def _decodes(fh, encoding):
+    """从头到尾用 encoding 增量解码一遍，返回是否全程无错；结束后回到开头。"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        while True:
+            chunk = fh.read(SNIFF_BYTES)
+            decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        fh.seek(0)
+
+
+def guess_format(filename, text):
+    name = str(filename or "").lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for suffix, fmt in ((".csv", "csv"), (".ndjson", "ndjson"), (".jsonl", "ndjson"), (".json", "json")):
+        if name.endswith(suffix):
+            return fmt
+    stripped = text.lstrip("\ufeff \t\r\n")
+    if not stripped.startswith("{"):
+        return "csv"
+    first_line = stripped.split("\n", 1)[0]
+    try:
+        record = json.loads(first_line)
+    except ValueError:
+        return "json"
+    return "ndjson" if isinstance(record, dict) and "record_type" in record else "json"
+
+
+def iter_records(fh, fmt, encoding, offset=0):
+    """按格式逐条产出 (record_type, payload, byte_offset)；offset 非 0 时从该字节位置续读（仅 ndjson / csv）。
+
+    csv 的 payload 是原样的列字典（含 record_type 列），由调用方转换；ndjson 的 meta 行与未知类型照样
+    产出，由调用方跳过。格式错误抛出 ValueError。
+    """
+    if fmt == "ndjson":
+        return _iter_ndjson(fh, encoding, offset)
+    if fmt == "csv":
+        return _iter_csv(fh, encoding, offset)
+    if fmt == "json":
+        if offset:
+            raise ValueError("json import cannot resume from a byte offset")
+        return _iter_json(fh, encoding)
+    raise ValueError(f"unsupported import format: {fmt}")
+
+
+def _iter_ndjson(fh, encoding, offset):
+    if offset:
+        fh.seek(offset)
+    line_no = 0
+    while True:
+        line = fh.readline()
+        if not line:
+            return
+        line_no += 1
+        text = line.decode(encoding).strip()
+        if not text:
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as exc:
+            raise ValueError(f"invalid NDJSON at line {line_no} (byte {fh.tell() - len(line)}): {exc}") from None
+        if not isinstance(record, dict):
+            raise ValueError(f"NDJSON line {line_no} is not an object")
+        record_type = str(record.pop("record_type", "") or "").strip().lower()
+        yield record_type, record, fh.tell()
+
+
+def _iter_csv(fh, encoding, offset):
+    position = [0]
+
+    def lines():
+        while True:
+            line = fh.readline()
+            if not line:
+                return
+            position[0] = fh.tell()
+            yield line.decode(encoding)
+
+    reader = csv.reader(lines())
+    header = next(reader, None)
+    if header is None:
+        return
+    if offset > position[0]:
+        # 续导：表头总是从文件开头读，其余行直接跳到上次提交的位置
+        fh.seek(offset)
+        position[0] = offset
+    for row in reader:
+        if not row:
+            continue
+        record = dict(zip(header, row))
+        record_type = str(record.get("record_type") or "").strip().lower()
+        yield record_type, record, position[0]
+
+
+class _JsonStream:
+    """在滑动文本缓冲区上做增量 JSON 解析：缓冲区不够一个完整的值时再读一段，已消费的部分随时丢弃。"""
+
+    def __init__(self, fh, encoding):
+        self.fh = fh
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        data = self.fh.read(JSON_READ_SIZE)
+        self.eof = not data
+        self.buf = self.buf[self.pos :] + self.decoder.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符；到文件末尾返回空串。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n\ufeff":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos : self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"invalid JSON bundle: expected {char!r} near offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+            except ValueError as exc:
+                if len(self.buf) - self.pos < JSON_MAX_VALUE_CHARS and self.fill():
+                    continue
+                raise ValueError(f"invalid JSON bundle: {exc}") from None
+            # 数字之类的值恰好停在缓冲区末尾时可能还没读完
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_json(fh, encoding):
+    stream = _JsonStream(fh, encoding)
+    if stream.peek() != "{":
+        raise ValueError("Import bundle must be a JSON object")
+    stream.pos += 1
+    while True:
+        char = stream.peek()
+        if char == "}":
+            return
+        if char == ",":
+            stream.pos += 1
+            continue
+        if not char:
+            raise ValueError("invalid JSON bundle: unexpected end of file")
+        key = stream.value()
+        if not isinstance(key, str):
+            raise ValueError("invalid JSON bundle: object key must be a string")
+        stream.expect(":")
+        record_type = JSON_SECTIONS.get(key)
+        if record_type is None or stream.peek() != "[":
+            stream.value()
+            continue
+        stream.pos += 1
+        while True:
+            char = stream.peek()
+            if char == "]":
+                stream.pos += 1
+                break
+            if char == ",":
+                stream.pos += 1
+                continue
+            if not char:
+                raise ValueError("invalid JSON bundle: unexpected end of file")
+            yield record_type, stream.value(), None
@@ -0,0 +1,137 @@
+"""PromptVault 库的维护命令。
+
+    python -m promptvault.maintenance --db /path/to/promptvault.db rebuild-fts
+    python -m promptvault.maintenance purge --chunk-size 500
+    python -m promptvault.maintenance vacuum --full
+    python -m promptvault.maintenance compress-versions
+    python -m promptvault.maintenance compact-versions
+    python -m promptvault.maintenance migrate-thumbnails
+    python -m promptvault.maintenance convert-thumbnails
+    python -m promptvault.maintenance backfill-thumbnail-features
+    python -m promptvault.maintenance import vault.ndjson.gz
+    python -m promptvault.maintenance import --resume import_xxx
+"""
+
+import argparse
+import json
+import sys
+
+from .db import PromptVaultStore
+
+
+def _open_store(db_path):
+    return PromptVaultStore(db_path=db_path) if db_path else PromptVaultStore.get()
+
+
+def cmd_rebuild_fts(store, args):
+    indexed = store.rebuild_fts_index(optimize=not args.no_optimize)
+    return {"indexed": indexed}
+
+
+def _print_progress(info):
+    print(json.dumps({"event": "progress", **info}, ensure_ascii=False), file=sys.stderr)
+
+
+def cmd_purge(store, args):
+    return store.purge_deleted_entries(
+        chunk_size=args.chunk_size, progress=_print_progress, vacuum=not args.no_vacuum
+    )
+
+
+def cmd_vacuum(store, args):
+    migrated = store.enable_incremental_vacuum()["migrated"] if args.full else False
+    result = store.incremental_vacuum(max_pages=args.max_pages, progress=_print_progress)
+    return {**result, "migrated": migrated}
+
+
+def cmd_compress_versions(store, args):
+    return store.compress_entry_versions(batch_size=args.batch_size, progress=_print_progress)
+
+
+def cmd_compact_versions(store, args):
+    return store.compact_entry_versions(batch_size=args.batch_size, progress=_print_progress)
+
+
+def cmd_migrate_thumbnails(store, args):
+    result = store.migrate_thumbnails(batch_size=args.batch_size, progress=_print_progress)
+    if not args.no_vacuum:
+        result["vacuum"] = store.incremental_vacuum(progress=_print_progress)
+    return result
+
+
+def cmd_convert_thumbnails(store, args):
+    return store.convert_thumbnail_renditions(
+        batch_size=args.batch_size, force=args.force, progress=_print_progress
+    )
+
+
+def cmd_backfill_thumbnail_features(store, args):
+    return store.backfill_thumbnail_features(batch_size=args.batch_size, progress=_print_progress)
+
+
+def cmd_import(store, args):
+    if args.resume:
+        return store.run_import(args.resume, batch_size=args.batch_size, progress=_print_progress)
+    if not args.path:
+        raise SystemExit("import: 需要导入文件路径或 --resume")
+    return store.import_file(args.path, fmt=args.format, batch_size=args.batch_size, progress=_print_progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PromptVault maintenance commands")
+    parser.add_argument("--db", default="", help="数据库路径，默认使用插件当前的库")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = sub.add_parser("rebuild-fts", help="从 entries 重建全文索引")
+    rebuild.add_argument("--no-optimize", action="store_true", help="重建后不合并索引段")
+    rebuild.set_defaults(func=cmd_rebuild_fts)
+
+    purge = sub.add_parser("purge", help="分块清空回收站，随后回收空闲页")
+    purge.add_argument("--chunk-size", type=int, default=None, help="每个事务删除的记录数")
+    purge.add_argument("--no-vacuum", action="store_true", help="只删除记录，不执行 incremental_vacuum")
+    purge.set_defaults(func=cmd_purge)
+
+    vacuum = sub.add_parser("vacuum", help="回收空闲页")
+    vacuum.add_argument("--full", action="store_true", help="旧库先整库 VACUUM 并切换到 auto_vacuum=INCREMENTAL")
+    vacuum.add_argument("--max-pages", type=int, default=None, help="本次最多释放的页数")
+    vacuum.set_defaults(func=cmd_vacuum)
+
+    compress = sub.add_parser("compress-versions", help="把旧的完整版本快照改写为关键帧 + 差量")
+    compress.add_argument("--batch-size", type=int, default=None, help="每个事务处理的记录数")
+    compress.set_defaults(func=cmd_compress_versions)
+
+    compact = sub.add_parser("compact-versions", help="按保留策略清理历史版本")
+    compact.add_argument("--batch-size", type=int, default=None, help="每个事务处理的记录数")
+    compact.set_defaults(func=cmd_compact_versions)
+
+    thumbs = sub.add_parser("migrate-thumbnails", help="把旧库的缩略图搬到按哈希去重的 thumbnail_blobs 表")
+    thumbs.add_argument("--batch-size", type=int, default=None, help="每个事务搬运的记录数")
+    thumbs.add_argument("--no-vacuum", action="store_true", help="搬完后不执行 incremental_vacuum")
+    thumbs.set_defaults(func=cmd_migrate_thumbnails)
+
+    convert = sub.add_parser("convert-thumbnails", help="为已有缩略图生成多尺寸 WebP 副本")
+    convert.add_argument("--batch-size", type=int, default=None, help="每个事务写入的缩略图数")
+    convert.add_argument("--force", action="store_true", help="重新生成全部副本（修改尺寸或质量后使用）")
+    convert.set_defaults(func=cmd_convert_thumbnails)
+
+    features = sub.add_parser(
+        "backfill-thumbnail-features", help="为已有缩略图补算感知哈希（相似图检索）和列表占位图"
+    )
+    features.add_argument("--batch-size", type=int, default=None, help="每个事务写入的缩略图数")
+    features.set_defaults(func=cmd_backfill_thumbnail_features)
+
+    importer = sub.add_parser("import", help="流式导入 json / ndjson / csv（可为 .gz）文件，分批提交，可断点续导")
+    importer.add_argument("path", nargs="?", default="", help="导入文件路径")
+    importer.add_argument("--format", default="", choices=["", "json", "ndjson", "csv"], help="默认按文件名和内容判断")
+    importer.add_argument("--resume", default="", metavar="IMPORT_ID", help="从断点继续一次中断的导入")
+    importer.add_argument("--batch-size", type=int, default=None, help="每个事务合并的记录数")
+    importer.set_defaults(func=cmd_import)
+
+    args = parser.parse_args(argv)
+    result = args.func(_open_store(args.db), args)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""检索 SQL 的 EXPLAIN QUERY PLAN 检查。
+
+枚举 search_entries / count_entries / _search_rows_like / _count_rows_with_keyword
+可能生成的全部 SQL 形态，对每条执行 EXPLAIN QUERY PLAN，找出本应走索引却出现的
+全表扫描或临时 B 树排序。既供单元测试使用，也可以直接对用户的真实库诊断：
+
+    python -m promptvault.query_plan --db /path/to/promptvault.db
+"""
+
+import argparse
+import itertools
+import json
+import re
+import sqlite3
+import sys
+
+from .db import PromptVaultStore
+
+SORTS = ("updated_desc", "score_desc", "favorite_desc", "similar")
+# sort="similar" 按 pv_phash_distance（逐行计算的 UDF）排序，没有索引能提供这个顺序，只能对过滤后的
+# 结果集做一次临时 B 树排序；只放行这一种，GROUP BY / DISTINCT 的临时 B 树仍算问题
+SIMILAR_TEMP_BTREES = ("USE TEMP B-TREE FOR ORDER BY",)
+
+# 这些表上的 SCAN 视为全表/全索引扫描；FTS 虚表的 "SCAN f VIRTUAL TABLE" 是正常的 MATCH。
+_INDEXED_TABLES = {"e", "entries", "et", "entry_tags", "em", "entry_models"}
+_SCAN_RE = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?$")
+_TEMP_BTREE_RE = re.compile(r"USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY|GROUP BY|DISTINCT)")
+
+# 代表性的关键词：与 PromptVaultStore._should_prefer_like 的两条分支一一对应。
+LIKE_QUERY = "少女"
+FTS_QUERY = "cinematic lighting"
+
+
+def _filter_combos():
+    for status, model, tag_count, favorite_only, has_thumbnail in itertools.product(
+        ("active", "deleted"),
+        ("", "SDXL"),
+        (0, 1, 2),
+        (False, True),
+        (False, True),
+    ):
+        tags = ["portrait", "photo"][:tag_count]
+        name = f"status={status}"
+        if model:
+            name += ",model"
+        if tags:
+            name += f",tags={len(tags)}"
+        if favorite_only:
+            name += ",favorite_only"
+        if has_thumbnail:
+            name += ",has_thumbnail"
+        yield name, {
+            "status": status,
+            "tags": tags,
+            "model": model,
+            "favorite_only": favorite_only,
+            "has_thumbnail": has_thumbnail,
+        }
+
+
+def _expected_indexes(filters):
+    expected = []
+    if filters["model"]:
+        expected.append("idx_entry_models_model_entry")
+    if filters["tags"]:
+        expected.append("idx_entry_tags_tag_entry")
+    return expected
+
+
+def iter_query_shapes(store_cls=PromptVaultStore):
+    """生成全部查询形态，每项为 dict(name, sql, params, allow_temp_btree, allowed_temp_btrees, expect_indexes)。
+
+    allow_temp_btree 对以下形态为真，因为结果集并非按 entries 上的排序索引产生：
+    - 按 bm25 排序的 FTS 检索和 UNION 计数，候选集由 MATCH 决定；
+    - 带标签/模型过滤的检索，规划器可能先从查找索引取出候选 id 再排序。
+    allowed_temp_btrees 逐条列出其余形态预期的临时 B 树（目前只有 sort="similar"，见 SIMILAR_TEMP_BTREES）。
+    expect_indexes 列出计划中必须出现的查找索引。
+    """
+    fields = store_cls.SEARCH_SELECT_FIELDS
+    for filter_name, filters in _filter_combos():
+        where, params = store_cls._entry_filters(**filters)
+        expect = _expected_indexes(filters)
+        lookup = bool(expect)
+
+        def shape(name, query, allow_temp_btree=lookup, allowed_temp_btrees=()):
+            sql, args = query
+            return {
+                "name": f"{name}[{filter_name}]",
+                "sql": sql,
+                "params": args,
+                "allow_temp_btree": allow_temp_btree,
+                "allowed_temp_btrees": allowed_temp_btrees,
+                "expect_indexes": expect,
+            }
+
+        # 全文索引只收录 active 记录，其它状态的关键词检索走 LIKE，不生成 FTS 形态。
+        use_fts = filters["status"] == "active"
+        yield shape("count", store_cls._plain_count_query(where, params))
+        yield shape("count_like", store_cls._like_count_query(LIKE_QUERY, where, params))
+        if use_fts:
+            yield shape("count_fts", store_cls._fts_count_query(FTS_QUERY, where, params), True)
+        for sort in SORTS:
+            select_fields = fields
+            allowed = ()
+            if sort == "similar":
+                select_fields = f"{fields}, {store_cls.PHASH_DISTANCE_SQL} AS distance"
+                allowed = SIMILAR_TEMP_BTREES
+            yield shape(
+                f"search:{sort}",
+                store_cls._plain_search_query(where, params, select_fields, sort, 20, 0),
+                allowed_temp_btrees=allowed,
+            )
+            yield shape(
+                f"search_like:{sort}",
+                store_cls._like_search_query(LIKE_QUERY, where, params, select_fields, sort, 20, 0),
+                allowed_temp_btrees=allowed,
+            )
+            yield shape(
+                f"search_title_like:{sort}",
+                store_cls._title_like_search_query(FTS_QUERY, where, params, select_fields, sort, 20),
+                allowed_temp_btrees=allowed,
+            )
+            if use_fts:
+                yield shape(
+                    f"search_fts:{sort}",
+                    store_cls._fts_search_query(FTS_QUERY, where, params, select_fields, sort, 20, 0),
+                    True,
+                )
+
+
+def explain(conn, sql, params):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [str(row[3]) for row in rows]
+
+
+def find_plan_problems(details, allow_temp_btree=False, expect_indexes=(), allowed_temp_btrees=()):
+    problems = []
+    plan_text = "\n".join(details)
+    for index_name in expect_indexes:
+        if index_name not in plan_text:
+            problems.append(f"index not used: {index_name}")
+    for detail in details:
+        match = _SCAN_RE.match(detail.strip())
+        if match and match.group(1) in _INDEXED_TABLES:
+            problems.append(f"full scan: {detail}")
+        if not allow_temp_btree and _TEMP_BTREE_RE.search(detail) and detail.strip() not in allowed_temp_btrees:
+            problems.append(f"temp b-tree: {detail}")
+    return problems
+
+
+def check_query_plans(conn, store_cls=PromptVaultStore):
+    """对所有查询形态执行 EXPLAIN QUERY PLAN，返回每条的计划与问题列表。"""
+    # sort="similar" 的 SQL 引用按参考哈希注册的 UDF，编译计划时只需要它存在
+    conn.create_function("pv_phash_distance", 1, lambda phash: None, deterministic=True)
+    report = []
+    for shape in iter_query_shapes(store_cls):
+        details = explain(conn, shape["sql"], shape["params"])
+        report.append(
+            {
+                "name": shape["name"],
+                "sql": " ".join(shape["sql"].split()),
+                "plan": details,
+                "problems": find_plan_problems(
+                    details,
+                    allow_temp_btree=shape["allow_temp_btree"],
+                    expect_indexes=shape["expect_indexes"],
+                    allowed_temp_btrees=shape["allowed_temp_btrees"],
+                ),
+            }
+        )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check PromptVault search query plans")
+    parser.add_argument("--db", default="", help="数据库路径，默认使用插件当前的库")
+    parser.add_argument("--json", action="store_true", help="输出完整 JSON 报告")
+    parser.add_argument("--all", action="store_true", help="文本模式下也列出没有问题的查询")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        # 只读打开，避免诊断时触发迁移或写入用户的库。
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(PromptVaultStore.get().db_path)
+    try:
+        report = check_query_plans(conn)
+    except sqlite3.OperationalError as exc:
+        # 只读打开不会迁移：旧版本的库缺少新列或新表时，检索 SQL 本身就无法编译
+        print(f"无法检查查询计划: {exc}", file=sys.stderr)
+        print("数据库结构不是当前版本，需要先迁移：用当前版本的插件打开一次该库后再检查。", file=sys.stderr)
+        return 2
+    finally:
+        conn.close()
+
+    bad = [item for item in report if item["problems"]]
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for item in report if args.all else bad:
+            print(item["name"])
+            for detail in item["plan"]:
+                print(f"    {detail}")
+            for problem in item["problems"]:
+                print(f"  !! {problem}")
+        print(f"{len(report)} query shapes checked, {len(bad)} with problems")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
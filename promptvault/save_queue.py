@@ -0,0 +1,231 @@
+"""落盘的后台保存队列。
+
+每个任务由两个文件组成：<seq>_<job_id>.bin（可选的二进制附件，如缩略图像素）和
+<seq>_<job_id>.json（任务参数）。json 最后以原子改名写入，作为任务已提交的标记；
+处理成功后删除，失败时连同错误信息移入 failed/ 目录。进程崩溃后重新 start() 会按序号
+继续处理残留任务，因此 handler 必须是幂等的。
+
+数据库暂时被占用（sqlite3.OperationalError，如压缩或缩略图迁移持有写锁）时任务留在队首，
+退避后重试 MAX_RETRIES 次才判为失败：节点早已把预分配的记录 ID 返回给用户。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .utils import now_iso
+
+logger = logging.getLogger("PromptVault")
+
+
+class SaveQueueFull(RuntimeError):
+    pass
+
+
+class SaveQueue:
+    HISTORY_SIZE = 256
+    # 可重试的暂时性错误、最多重试次数，以及首次重试前的等待秒数（之后每次翻倍）
+    RETRY_EXCEPTIONS = (sqlite3.OperationalError,)
+    MAX_RETRIES = 3
+    RETRY_DELAY = 1.0
+
+    def __init__(self, queue_dir, handler, max_pending=32):
+        self.queue_dir = queue_dir
+        self.failed_dir = os.path.join(queue_dir, "failed")
+        self.max_pending = int(max_pending)
+        self._handler = handler
+        self._cond = threading.Condition()
+        self._statuses = OrderedDict()
+        self._running = None
+        self._thread = None
+        self._retries = {}
+        # 本进程内无法移入 failed/ 的任务文件名：跳过以免反复处理，重启后再按残留任务处理
+        self._stuck = set()
+
+    # ---- 文件布局 ----
+    @staticmethod
+    def _job_id_from_name(name):
+        return name.split("_", 1)[1].rsplit(".", 1)[0]
+
+    def _pending_names(self):
+        try:
+            names = os.listdir(self.queue_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if n.endswith(".json") and "_" in n and n not in self._stuck)
+
+    def _find_pending(self, job_id):
+        for name in self._pending_names():
+            if self._job_id_from_name(name) == job_id:
+                return name
+        return None
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+
+    def _remember(self, job_id, status):
+        self._statuses[job_id] = status
+        self._statuses.move_to_end(job_id)
+        while len(self._statuses) > self.HISTORY_SIZE:
+            self._statuses.popitem(last=False)
+
+    # ---- 对外接口 ----
+    def start(self):
+        """启动后台线程（幂等）；残留的任务会按提交顺序重新处理。"""
+        with self._cond:
+            os.makedirs(self.failed_dir, exist_ok=True)
+            if self._thread is not None and self._thread.is_alive():
+                return
+            pending = self._pending_names()
+            committed = {name[: -len(".json")] for name in pending}
+            for name in os.listdir(self.queue_dir):
+                # 提交前或删除中途崩溃留下的附件 / 临时文件
+                stem = name.rsplit(".", 1)[0]
+                if name.endswith(".tmp") or (name.endswith(".bin") and stem not in committed):
+                    os.remove(os.path.join(self.queue_dir, name))
+            for name in pending:
+                job_id = self._job_id_from_name(name)
+                if job_id not in self._statuses:
+                    self._remember(job_id, {"id": job_id, "state": "queued", "recovered": True})
+            self._thread = threading.Thread(target=self._worker, name="PromptVaultSaveQueue", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, job_id, payload, blob=b""):
+        """写入一个任务并唤醒后台线程；待处理任务数达到 max_pending 时抛 SaveQueueFull。"""
+        with self._cond:
+            os.makedirs(self.failed_dir, exist_ok=True)
+            if len(self._pending_names()) >= self.max_pending:
+                raise SaveQueueFull(f"后台保存队列已满（{self.max_pending}）")
+            base = os.path.join(self.queue_dir, f"{time.time_ns():020d}_{job_id}")
+            if blob:
+                self._write_atomic(base + ".bin", bytes(blob))
+            body = json.dumps({"id": job_id, "payload": payload}, ensure_ascii=False, default=str)
+            self._write_atomic(base + ".json", body.encode("utf-8"))
+            self._remember(job_id, {"id": job_id, "state": "queued", "queued_at": now_iso()})
+            self._cond.notify_all()
+        self.start()
+
+    def status(self, job_id):
+        """返回任务状态 {id, state, ...}，state 为 queued / running / done / failed；未知任务返回 None。"""
+        with self._cond:
+            status = self._statuses.get(job_id)
+            if status is not None:
+                return dict(status)
+            if self._find_pending(job_id):
+                return {"id": job_id, "state": "queued"}
+            path = os.path.join(self.failed_dir, f"{job_id}.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fh:
+                failed = json.load(fh)
+            return {"id": job_id, "state": "failed", "error": failed.get("error", "")}
+        return None
+
+    def stats(self):
+        with self._cond:
+            try:
+                failed = sum(1 for n in os.listdir(self.failed_dir) if n.endswith(".json"))
+            except FileNotFoundError:
+                failed = 0
+            return {
+                "pending": len(self._pending_names()),
+                "max_pending": self.max_pending,
+                "running": self._running,
+                "failed": failed,
+                "recent": [dict(s) for s in reversed(self._statuses.values())][:20],
+            }
+
+    def wait_idle(self, timeout=None):
+        """等待队列清空且没有正在处理的任务，返回是否在超时前清空。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            # 任务文件在锁外删除，只看文件会在状态记为 done 之前提前返回
+            while self._pending_names() or self._running is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    # ---- 后台线程 ----
+    def _worker(self):
+        while True:
+            with self._cond:
+                names = self._pending_names()
+                if not names:
+                    self._cond.wait()
+                    continue
+                name = names[0]
+                job_id = self._job_id_from_name(name)
+                self._running = job_id
+                self._remember(job_id, {"id": job_id, "state": "running", "started_at": now_iso()})
+            base = os.path.join(self.queue_dir, name[: -len(".json")])
+            try:
+                status = self._process(job_id, base)
+            except Exception as exc:
+                retries = self._retries.get(name, 0)
+                if isinstance(exc, self.RETRY_EXCEPTIONS) and retries < self.MAX_RETRIES:
+                    self._retries[name] = retries + 1
+                    logger.warning(
+                        "save job %s hit a transient error, retry %d/%d: %s", job_id, retries + 1, self.MAX_RETRIES, exc
+                    )
+                    with self._cond:
+                        self._running = None
+                        self._remember(
+                            job_id, {"id": job_id, "state": "queued", "retries": retries + 1, "error": str(exc)}
+                        )
+                    time.sleep(self.RETRY_DELAY * 2**retries)
+                    continue
+                logger.exception("save job %s failed", job_id)
+                try:
+                    status = self._fail(job_id, base, str(exc))
+                except Exception:
+                    logger.exception("save job %s could not be moved to %s", job_id, self.failed_dir)
+                    with self._cond:
+                        self._stuck.add(name)
+                    status = {"id": job_id, "state": "failed", "error": str(exc), "finished_at": now_iso()}
+            self._retries.pop(name, None)
+            with self._cond:
+                self._running = None
+                self._remember(job_id, status)
+                self._cond.notify_all()
+
+    def _process(self, job_id, base):
+        with open(base + ".json", "r", encoding="utf-8") as fh:
+            job = json.load(fh)
+        blob = b""
+        if os.path.exists(base + ".bin"):
+            with open(base + ".bin", "rb") as fh:
+                blob = fh.read()
+        result = self._handler(job_id, job.get("payload") or {}, blob) or {}
+        # 先删 json（任务标记），再删附件；中途崩溃只会留下无主的 .bin，不会重复处理
+        os.remove(base + ".json")
+        if os.path.exists(base + ".bin"):
+            os.remove(base + ".bin")
+        return {"id": job_id, "state": "done", "finished_at": now_iso(), **result}
+
+    def _fail(self, job_id, base, error):
+        try:
+            with open(base + ".json", "r", encoding="utf-8") as fh:
+                job = json.load(fh)
+        except Exception:
+            job = {"id": job_id}
+        job["error"] = error
+        job["failed_at"] = now_iso()
+        self._write_atomic(
+            os.path.join(self.failed_dir, f"{job_id}.json"),
+            json.dumps(job, ensure_ascii=False, default=str).encode("utf-8"),
+        )
+        if os.path.exists(base + ".bin"):
+            os.replace(base + ".bin", os.path.join(self.failed_dir, f"{job_id}.bin"))
+        os.remove(base + ".json")
+        return {"id": job_id, "state": "failed", "error": error, "finished_at": now_iso()}
@@ -1,4 +1,6 @@
 SCHEMA_SQL = r"""
+-- 只对新建的空库生效；旧库由 PromptVaultStore.enable_incremental_vacuum() 迁移
+PRAGMA auto_vacuum = INCREMENTAL;
 PRAGMA foreign_keys = ON;
 PRAGMA journal_mode = WAL;
 
@@ -39,9 +41,13 @@ CREATE TABLE IF NOT EXISTS entries (
   raw_json TEXT NOT NULL,
   negative_json TEXT NOT NULL,
   params_json TEXT NOT NULL DEFAULT '{}',
+  -- 旧版内联缩略图，仅待迁移的旧行非空；新数据写入 thumbnail_blobs
   thumbnail_png BLOB,
   thumbnail_width INTEGER,
   thumbnail_height INTEGER,
+  has_thumbnail INTEGER NOT NULL DEFAULT 0,
+  -- 缩略图 PNG 的内容哈希，写入时计算；既是 thumbnail_blobs 的键，也是 ETag 和缩略图 URL 的缓存键
+  thumbnail_hash TEXT,
   favorite INTEGER NOT NULL DEFAULT 0,
   score REAL NOT NULL DEFAULT 0.0,
   hash TEXT NOT NULL,
@@ -50,19 +56,68 @@ CREATE TABLE IF NOT EXISTS entries (
   FOREIGN KEY (template_id) REFERENCES templates(id)
 );
 
+-- 缩略图单独成表并按内容哈希去重：entries 的行保持窄小，相同的图（重复导入、复制的记录）只存一份。
+-- refcount 是 thumbnail_hash 指向它的记录数，归零即删除。
+-- 定长列放在 blob 之前，只读 refcount / hash 时不必沿溢出页链走到行尾。
+CREATE TABLE IF NOT EXISTS thumbnail_blobs (
+  blob_hash TEXT PRIMARY KEY,
+  refcount INTEGER NOT NULL DEFAULT 0,
+  data BLOB NOT NULL
+);
+
+-- 缩略图的多尺寸副本（目前为 WebP），随原图共享，按宽度选取；可由 thumbnail_blobs 重新生成
+CREATE TABLE IF NOT EXISTS thumbnail_renditions (
+  blob_hash TEXT NOT NULL,
+  format TEXT NOT NULL,
+  width INTEGER NOT NULL,
+  height INTEGER NOT NULL,
+  hash TEXT,
+  data BLOB NOT NULL,
+  PRIMARY KEY (blob_hash, format, width),
+  FOREIGN KEY (blob_hash) REFERENCES thumbnail_blobs(blob_hash) ON DELETE CASCADE
+);
+
+-- 缩略图的感知哈希（64 位 dHash，按有符号整数存；无法解码的图为 NULL），随原图共享。
+-- 每个 16 位分段各有一个表达式索引，按汉明距离检索时做多索引哈希（MIH）：
+-- 距离不超过 r 的两个哈希至少有一段相差不超过 r // 4 位
+CREATE TABLE IF NOT EXISTS thumbnail_phashes (
+  blob_hash TEXT PRIMARY KEY,
+  phash INTEGER,
+  FOREIGN KEY (blob_hash) REFERENCES thumbnail_blobs(blob_hash) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_thumbnail_phashes_0 ON thumbnail_phashes(((phash >> 48) & 65535), phash, blob_hash);
+CREATE INDEX IF NOT EXISTS idx_thumbnail_phashes_1 ON thumbnail_phashes(((phash >> 32) & 65535), phash, blob_hash);
+CREATE INDEX IF NOT EXISTS idx_thumbnail_phashes_2 ON thumbnail_phashes(((phash >> 16) & 65535), phash, blob_hash);
+CREATE INDEX IF NOT EXISTS idx_thumbnail_phashes_3 ON thumbnail_phashes((phash & 65535), phash, blob_hash);
+
+-- 列表用的占位图：十几像素宽的 WebP（不超过 thumbnails.PLACEHOLDER_MAX_BYTES）和平均色，
+-- 随检索结果内联返回，缩略图到达前先画出来；两列均为 NULL 表示原图无法解码
+CREATE TABLE IF NOT EXISTS thumbnail_placeholders (
+  blob_hash TEXT PRIMARY KEY,
+  color TEXT,
+  data BLOB,
+  FOREIGN KEY (blob_hash) REFERENCES thumbnail_blobs(blob_hash) ON DELETE CASCADE
+);
+
 CREATE TABLE IF NOT EXISTS entry_versions (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   entry_id TEXT NOT NULL,
   version INTEGER NOT NULL,
-  snapshot_json TEXT NOT NULL,
+  -- 旧格式的完整快照；新行为空串，内容在 snapshot_blob 中
+  snapshot_json TEXT NOT NULL DEFAULT '',
   created_at TEXT NOT NULL,
+  -- zlib 压缩的 JSON：keyframe=1 时是完整快照，否则是相对上一版本的差量
+  snapshot_blob BLOB,
+  keyframe INTEGER NOT NULL DEFAULT 1,
   FOREIGN KEY (entry_id) REFERENCES entries(id)
 );
 
 -- Lightweight tag table (optional; tags are also stored in entries.tags_json)
 CREATE TABLE IF NOT EXISTS tags (
   name TEXT PRIMARY KEY,
-  created_at TEXT NOT NULL
+  created_at TEXT NOT NULL,
+  ref_count INTEGER NOT NULL DEFAULT 0,  -- 引用该标签的未删除记录数
+  last_used TEXT
 );
 
 CREATE TABLE IF NOT EXISTS entry_tags (
@@ -79,13 +134,27 @@ CREATE TABLE IF NOT EXISTS entry_models (
   FOREIGN KEY (entry_id) REFERENCES entries(id) ON DELETE CASCADE
 );
 
--- FTS for fast keyword search; keep it simple for V1.
-CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
-  entry_id UNINDEXED,
-  title,
-  content,
-  tags,
-  tokenize = 'unicode61'
+-- 模型名（不区分大小写）的使用次数，供自动补全排序；与 tags.ref_count 一样只统计未删除记录
+CREATE TABLE IF NOT EXISTS models (
+  name TEXT PRIMARY KEY COLLATE NOCASE,
+  ref_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- 流式导入的断点：每提交一批记录就在同一个事务里更新 records / byte_offset，中断后从这里续导。
+-- byte_offset 是最后一条已提交记录之后在（解压后）文件里的字节位置，json 导入为 NULL、按 records 跳过
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+  import_id TEXT PRIMARY KEY,
+  source_path TEXT NOT NULL,
+  owns_source INTEGER NOT NULL DEFAULT 0,  -- 上传的临时文件，导入完成后删除
+  filename TEXT NOT NULL DEFAULT '',
+  format TEXT NOT NULL DEFAULT '',
+  state TEXT NOT NULL,                     -- pending / running / done / failed
+  records INTEGER NOT NULL DEFAULT 0,
+  byte_offset INTEGER,
+  summary_json TEXT NOT NULL DEFAULT '{}',
+  error TEXT,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL
 );
 
 CREATE INDEX IF NOT EXISTS idx_entries_status_updated ON entries(status, updated_at);
@@ -97,4 +166,93 @@ CREATE INDEX IF NOT EXISTS idx_entries_status_favorite_score_updated_id
   ON entries(status, favorite DESC, score DESC, updated_at DESC, id ASC);
 CREATE INDEX IF NOT EXISTS idx_entry_tags_tag_entry ON entry_tags(tag, entry_id);
 CREATE INDEX IF NOT EXISTS idx_entry_models_model_entry ON entry_models(model, entry_id);
+CREATE INDEX IF NOT EXISTS idx_entries_title_nocase_status ON entries(title COLLATE NOCASE, status);
+CREATE INDEX IF NOT EXISTS idx_tags_name_nocase ON tags(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_entry_models_model_nocase ON entry_models(model COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_entry_versions_entry_version ON entry_versions(entry_id, version);
+"""
+
+
+def _fts_columns(row):
+    """entries 行到全文索引列 (title, content, tags) 的 SQL 表达式，视图与触发器共用同一份。
+
+    external-content 表删除索引行时必须给出与写入时完全一致的列值，所以这里是唯一来源。
+    """
+    title = f"{row}.title"
+    content = (
+        f"(CASE WHEN json_valid({row}.raw_json)"
+        f" THEN coalesce(json_extract({row}.raw_json, '$.positive'), '')"
+        f" || ' ' || coalesce(json_extract({row}.raw_json, '$.negative'), '')"
+        f" ELSE {row}.raw_json END)"
+        f" || ' ' || {row}.variables_json || ' ' || {row}.params_json"
+    )
+    # tags_json 直接交给 unicode61：JSON 的引号、逗号和方括号本身就是分隔符。
+    # （FTS5 从 external-content 视图读取时不支持 json_each 这类表值函数子查询。）
+    tags = f"{row}.tags_json"
+    return title, content, tags
+
+
+def _fts_changed(old="old", new="new"):
+    return " OR ".join(
+        f"{old}.{col} IS NOT {new}.{col}"
+        for col in ("title", "raw_json", "tags_json", "variables_json", "params_json")
+    )
+
+
+FTS_SCHEMA_VERSION = "2"
+
+# 全文索引：external-content FTS5，内容来自只包含 active 记录的文本视图，以 entries 的整数 rowid 为键，
+# 由触发器随 entries 的写入自动维护。entries 没有 INTEGER PRIMARY KEY，整库 VACUUM 可能重排 rowid，
+# 之后必须执行一次 'rebuild'（PromptVaultStore.rebuild_fts_index）。
+FTS_SCHEMA_SQL = r"""
+CREATE VIEW IF NOT EXISTS entries_fts_source AS
+  SELECT e.rowid AS entry_rowid, {e_title} AS title, {e_content} AS content, {e_tags} AS tags
+  FROM entries e
+  WHERE e.status = 'active';
+
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+  title,
+  content,
+  tags,
+  content = 'entries_fts_source',
+  content_rowid = 'entry_rowid',
+  tokenize = 'unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS entries_fts_ai AFTER INSERT ON entries
+WHEN new.status = 'active' BEGIN
+  INSERT INTO entries_fts(rowid, title, content, tags)
+  VALUES (new.rowid, {new_title}, {new_content}, {new_tags});
+END;
+
+CREATE TRIGGER IF NOT EXISTS entries_fts_ad AFTER DELETE ON entries
+WHEN old.status = 'active' BEGIN
+  INSERT INTO entries_fts(entries_fts, rowid, title, content, tags)
+  VALUES ('delete', old.rowid, {old_title}, {old_content}, {old_tags});
+END;
+
+CREATE TRIGGER IF NOT EXISTS entries_fts_au
+AFTER UPDATE OF title, status, raw_json, tags_json, variables_json, params_json ON entries BEGIN
+  INSERT INTO entries_fts(entries_fts, rowid, title, content, tags)
+  SELECT 'delete', old.rowid, {old_title}, {old_content}, {old_tags}
+  WHERE old.status = 'active' AND (new.status != 'active' OR {changed});
+  INSERT INTO entries_fts(rowid, title, content, tags)
+  SELECT new.rowid, {new_title}, {new_content}, {new_tags}
+  WHERE new.status = 'active' AND (old.status != 'active' OR {changed});
+END;
+""".format(
+    changed=_fts_changed(),
+    **{
+        f"{alias}_{name}": expr
+        for alias in ("e", "old", "new")
+        for name, expr in zip(("title", "content", "tags"), _fts_columns(alias))
+    },
+)
+
+FTS_DROP_SQL = r"""
+DROP TRIGGER IF EXISTS entries_fts_ai;
+DROP TRIGGER IF EXISTS entries_fts_ad;
+DROP TRIGGER IF EXISTS entries_fts_au;
+DROP TABLE IF EXISTS entries_fts;
+DROP VIEW IF EXISTS entries_fts_source;
 """
@@ -43,3 +43,44 @@ def stable_hash(payload_obj):
     raw = json_dumps(payload_obj).encode("utf-8")
     return hashlib.sha256(raw).hexdigest()
 
+
+def content_hash(data):
+    """二进制内容（缩略图等）的哈希，128 位十六进制，用作 ETag 和缓存键。"""
+    return hashlib.sha256(bytes(data)).hexdigest()[:32]
+
+
+def json_delta(old, new):
+    """计算把 dict old 变成 new 的差量：{"s": 新值, "d": 删除的键, "n": 子 dict 的差量}。
+
+    只对 dict 递归，列表和标量整体替换；两者相同时返回空 dict。
+    """
+    delta = {}
+    changed = {}
+    nested = {}
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+        elif old[key] != value:
+            if isinstance(value, dict) and isinstance(old[key], dict):
+                nested[key] = json_delta(old[key], value)
+            else:
+                changed[key] = value
+    removed = [key for key in old if key not in new]
+    if changed:
+        delta["s"] = changed
+    if removed:
+        delta["d"] = removed
+    if nested:
+        delta["n"] = nested
+    return delta
+
+
+def apply_json_delta(old, delta):
+    """把 json_delta 的结果应用到 old 上，返回新 dict（不修改 old）。"""
+    out = dict(old)
+    for key in delta.get("d", ()):
+        out.pop(key, None)
+    out.update(delta.get("s", {}))
+    for key, sub in delta.get("n", {}).items():
+        out[key] = apply_json_delta(out.get(key) or {}, sub)
+    return out
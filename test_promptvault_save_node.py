@@ -1,4 +1,9 @@
+import io
+import itertools
+import os
+import sqlite3
 import sys
+import tempfile
 import types
 import unittest
 from pathlib import Path
@@ -14,7 +19,11 @@ sys.modules.setdefault(
     ),
 )
 
+import numpy as np
+from PIL import Image
+
 from ComfyUI_PromptVault import nodes
+from ComfyUI_PromptVault.promptvault.save_queue import SaveQueue, SaveQueueFull
 
 
 class _FakeStore:
@@ -26,6 +35,54 @@ class _FakeStore:
         return {"id": "entry_test"}
 
 
+class _FakeTensor:
+    """只实现节点用到的 detach().cpu().numpy() 接口。"""
+
+    def __init__(self, arr):
+        self.arr = arr
+        self.ndim = arr.ndim
+
+    def __getitem__(self, index):
+        return _FakeTensor(self.arr[index])
+
+    def detach(self):
+        return self
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.arr
+
+
+class _AsyncFakeStore(_FakeStore):
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+
+    def get_entry(self, entry_id):
+        if entry_id not in self.entries:
+            raise KeyError(entry_id)
+        return self.entries[entry_id]
+
+    def create_entry(self, payload):
+        self.payload = payload = dict(payload, id=payload.get("id") or "entry_test")
+        self.entries[payload["id"]] = payload
+        return payload
+
+    def get_settings(self):
+        return dict(nodes.PromptVaultStore.DEFAULT_SETTINGS)
+
+    def create_entries(self, payloads):
+        self.batches = getattr(self, "batches", []) + [payloads]
+        items = []
+        for index, payload in enumerate(payloads):
+            entry = dict(payload, id=payload.get("id") or f"entry_batch_{index}")
+            self.entries[entry["id"]] = entry
+            items.append({"index": index, "ok": True, "entry": entry})
+        return {"items": items, "created": len(items), "failed": 0}
+
+
 class PromptVaultSaveNodeTests(unittest.TestCase):
     def setUp(self):
         self.store = _FakeStore()
@@ -40,7 +97,9 @@ class PromptVaultSaveNodeTests(unittest.TestCase):
         self.assertNotIn("auto_generate_mode", optional)
 
     def test_save_node_prefers_explicit_positive_and_negative_inputs(self):
-        with patch.object(nodes, "_make_thumbnail_png", return_value=(b"png", 256, 128)):
+        with patch.object(nodes, "_image_to_array", return_value=None), patch.object(
+            nodes, "_thumbnail_png_from_array", return_value=(b"png", 256, 128)
+        ):
             with patch.object(nodes, "_extract_prompt_from_pnginfo", return_value=None):
                 with patch.object(
                     nodes,
@@ -71,7 +130,9 @@ class PromptVaultSaveNodeTests(unittest.TestCase):
         self.assertEqual(self.store.payload["raw"]["negative"], "manual negative")
 
     def test_save_node_falls_back_to_extracted_prompts_when_optional_inputs_are_empty(self):
-        with patch.object(nodes, "_make_thumbnail_png", return_value=(b"png", 256, 128)):
+        with patch.object(nodes, "_image_to_array", return_value=None), patch.object(
+            nodes, "_thumbnail_png_from_array", return_value=(b"png", 256, 128)
+        ):
             with patch.object(nodes, "_extract_prompt_from_pnginfo", return_value=None):
                 with patch.object(
                     nodes,
@@ -102,7 +163,9 @@ class PromptVaultSaveNodeTests(unittest.TestCase):
         self.assertEqual(self.store.payload["raw"]["negative"], "metadata neg")
 
     def test_save_node_uses_llm_generate_arguments(self):
-        with patch.object(nodes, "_make_thumbnail_png", return_value=(b"png", 256, 128)):
+        with patch.object(nodes, "_image_to_array", return_value=None), patch.object(
+            nodes, "_thumbnail_png_from_array", return_value=(b"png", 256, 128)
+        ):
             with patch.object(nodes, "_extract_prompt_from_pnginfo", return_value=None):
                 with patch.object(
                     nodes,
@@ -140,6 +203,231 @@ class PromptVaultSaveNodeTests(unittest.TestCase):
         self.assertTrue(args[4])
         self.assertEqual(args[5], "title_only")
 
+    def test_async_save_returns_preassigned_id_and_saves_in_background(self):
+        store = _AsyncFakeStore()
+        image = _FakeTensor(np.random.default_rng(0).random((1, 1024, 768, 3), dtype=np.float32))
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = SaveQueue(tmp, nodes._process_save_job, max_pending=4)
+            with patch.object(nodes, "get_save_queue", return_value=queue):
+                with patch.object(nodes.PromptVaultStore, "get", return_value=store):
+                    with patch.object(nodes, "_debug_dump_png_meta", return_value=None):
+                        entry_id, status = self.node.run(
+                            image=image,
+                            title="async",
+                            positive_prompt="async positive",
+                            save_mode="async",
+                        )
+                        self.assertTrue(entry_id.startswith("entry_"))
+                        self.assertIn("后台", status)
+                        self.assertTrue(queue.wait_idle(timeout=10))
+
+            self.assertEqual(queue.status(entry_id)["state"], "done")
+            self.assertEqual(os.listdir(tmp), ["failed"])
+        saved = store.entries[entry_id]
+        self.assertEqual(saved["title"], "async")
+        self.assertEqual((saved["thumbnail_width"], saved["thumbnail_height"]), (256, 341))
+        self.assertTrue(saved["thumbnail_png"].startswith(b"\x89PNG"))
+        renditions = saved["thumbnail_renditions"]
+        self.assertEqual(
+            [(r["format"], r["width"], r["height"]) for r in renditions],
+            [("webp", 96, 128), ("webp", 256, 341), ("webp", 512, 683)],
+        )
+        self.assertTrue(all(r["data"][8:12] == b"WEBP" for r in renditions))
+
+    def test_batch_modes_save_every_image_with_shared_metadata(self):
+        batch = np.stack([np.full((512, 384, 3), v, dtype=np.float32) for v in (0.0, 0.25, 0.5, 1.0)])
+        image = _FakeTensor(batch)
+        for batch_mode in ("separate", "contact_sheet"):
+            store = _AsyncFakeStore()
+            with patch.object(nodes.PromptVaultStore, "get", return_value=store):
+                with patch.object(nodes, "_debug_dump_png_meta", return_value=None):
+                    with patch.object(
+                        nodes, "_extract_generation_data", wraps=nodes._extract_generation_data
+                    ) as extract_mock:
+                        entry_ids, status = self.node.run(
+                            image=image,
+                            title="batch",
+                            positive_prompt="batch positive",
+                            batch_mode=batch_mode,
+                        )
+            self.assertEqual(extract_mock.call_count, 1)
+            self.assertEqual(len(store.batches), 1)
+            payloads = store.batches[0]
+            self.assertIn("保存成功", status)
+            self.assertEqual(entry_ids.split(","), list(store.entries))
+            if batch_mode == "separate":
+                self.assertEqual([p["title"] for p in payloads], ["batch #1", "batch #2", "batch #3", "batch #4"])
+                # 每张图各自的缩略图：纯色图的像素值按批次顺序递增
+                pixels = [Image.open(io.BytesIO(p["thumbnail_png"])).getpixel((0, 0))[0] for p in payloads]
+                self.assertEqual(pixels, [0, 64, 128, 255])
+                self.assertTrue(all(len(p["thumbnail_renditions"]) == 3 for p in payloads))
+            else:
+                self.assertEqual(len(payloads), 1)
+                self.assertEqual(payloads[0]["title"], "batch")
+                sheet = Image.open(io.BytesIO(payloads[0]["thumbnail_png"])).convert("RGB")
+                self.assertEqual(sheet.size[0], 256)
+                corners = [sheet.getpixel((x, y))[0] for x, y in ((10, 10), (200, 10), (10, 300), (200, 300))]
+                self.assertEqual(corners, [0, 64, 128, 255])
+
+        # 一次 NumPy 运算缩小整批，结果与逐张缩小一致
+        reduced = nodes._image_batch_to_array(image, max_width=96)
+        self.assertEqual(reduced.shape, (4, 128, 96, 3))
+        self.assertTrue(np.array_equal(reduced[2], nodes._image_to_array(_FakeTensor(batch[2]), max_width=96)))
+
+    def test_async_batch_save_uses_preassigned_ids(self):
+        store = _AsyncFakeStore()
+        image = _FakeTensor(np.random.default_rng(2).random((3, 256, 256, 3), dtype=np.float32))
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = SaveQueue(tmp, nodes._process_save_job, max_pending=4)
+            with patch.object(nodes, "get_save_queue", return_value=queue):
+                with patch.object(nodes.PromptVaultStore, "get", return_value=store):
+                    with patch.object(nodes, "_debug_dump_png_meta", return_value=None):
+                        entry_ids, status = self.node.run(
+                            image=image,
+                            title="async batch",
+                            positive_prompt="async positive",
+                            save_mode="async",
+                            batch_mode="separate",
+                        )
+                        self.assertTrue(queue.wait_idle(timeout=10))
+            ids = entry_ids.split(",")
+            self.assertEqual(len(ids), 3)
+            self.assertEqual(queue.status(ids[0])["entry_ids"], ids)
+        self.assertEqual(list(store.entries), ids)
+        self.assertEqual(store.entries[ids[2]]["title"], "async batch #3")
+
+    def test_every_save_path_keeps_wide_rendition_sizes(self):
+        class WideStore(_AsyncFakeStore):
+            def get_settings(self):
+                return dict(nodes.PromptVaultStore.DEFAULT_SETTINGS, thumbnail_webp_sizes=[96, 1024])
+
+        image = _FakeTensor(np.random.default_rng(3).random((2, 128, 2048, 3), dtype=np.float32))
+        for save_mode, batch_mode in itertools.product(("blocking", "async"), ("first", "separate")):
+            store = WideStore()
+            with tempfile.TemporaryDirectory() as tmp:
+                queue = SaveQueue(tmp, nodes._process_save_job, max_pending=4)
+                with patch.object(nodes, "get_save_queue", return_value=queue):
+                    with patch.object(nodes.PromptVaultStore, "get", return_value=store):
+                        with patch.object(nodes, "_debug_dump_png_meta", return_value=None):
+                            self.node.run(
+                                image=image,
+                                title="wide",
+                                positive_prompt="wide",
+                                save_mode=save_mode,
+                                batch_mode=batch_mode,
+                            )
+                            self.assertTrue(queue.wait_idle(timeout=10))
+            # 同步、后台、批量保存都按同一宽度缩小源图，不会把 1024 的副本截成 512
+            for entry in store.entries.values():
+                widths = [r["width"] for r in entry["thumbnail_renditions"]]
+                self.assertEqual(widths, [96, 1024], (save_mode, batch_mode))
+            self.assertEqual(len(store.entries), 1 if batch_mode == "first" else 2)
+
+    def test_thumbnail_fast_path_matches_full_size_reference(self):
+        rng = np.random.default_rng(1)
+        y, x = np.mgrid[0:1024, 0:768].astype(np.float32)
+        arr = np.stack([x / 767.0, y / 1023.0, (np.sin(x / 19.0) + 1.0) / 2.0], axis=-1)
+        arr += rng.normal(0.0, 0.01, arr.shape).astype(np.float32)
+        image = _FakeTensor(arr[None])
+        before = arr.copy()
+
+        png, width, height = nodes._make_thumbnail_png(image, target_width=256)
+        # 旧实现：整图截断量化后直接 LANCZOS 到 256
+        full = (np.clip(arr, 0.0, 1.0) * 255.0).round().astype(np.uint8)
+        reference = np.asarray(Image.fromarray(full).resize((256, 341), Image.Resampling.LANCZOS), dtype=np.float64)
+        fast = np.asarray(Image.open(io.BytesIO(png)).convert("RGB"), dtype=np.float64)
+
+        self.assertEqual((width, height), (256, 341))
+        self.assertEqual(fast.shape, reference.shape)
+        mse = float(np.mean((fast - reference) ** 2))
+        self.assertGreater(10.0 * np.log10(255.0 ** 2 / mse), 40.0)
+        # 输入张量不能被原地修改
+        self.assertTrue(np.array_equal(arr, before))
+
+        # 同步保存只转换一次张量，缩略图和 WebP 副本共用
+        store = _AsyncFakeStore()
+        with patch.object(nodes.PromptVaultStore, "get", return_value=store):
+            with patch.object(nodes, "_debug_dump_png_meta", return_value=None):
+                with patch.object(nodes, "_image_to_array", wraps=nodes._image_to_array) as convert_mock:
+                    _entry_id, status = self.node.run(image=image, title="sync", positive_prompt="sync positive")
+        self.assertIn("保存成功", status)
+        self.assertEqual(convert_mock.call_count, 1)
+        self.assertEqual(convert_mock.call_args.kwargs["max_width"], 512)
+        self.assertEqual(store.payload["thumbnail_width"], 256)
+        self.assertEqual(len(store.payload["thumbnail_renditions"]), 3)
+
+        gray = _FakeTensor(np.full((1, 64, 64, 1), 0.5, dtype=np.float32))
+        self.assertEqual(nodes._image_to_array(gray, max_width=16).shape, (16, 16, 3))
+        self.assertEqual(int(nodes._image_to_array(gray)[0, 0, 0]), 128)
+
+    def test_save_queue_recovers_pending_jobs_and_reports_failures(self):
+        handled = []
+
+        def handler(job_id, payload, blob):
+            if payload.get("fail"):
+                raise ValueError("boom")
+            handled.append((job_id, payload["n"], blob))
+            return {"entry_id": job_id}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # 先只落盘不处理，模拟进程在任务完成前退出
+            crashed = SaveQueue(tmp, handler, max_pending=2)
+            crashed.start = lambda: None
+            crashed.enqueue("a", {"n": 1}, b"xyz")
+            crashed.enqueue("b", {"fail": True})
+            with self.assertRaises(SaveQueueFull):
+                crashed.enqueue("c", {"n": 3})
+
+            queue = SaveQueue(tmp, handler, max_pending=2)
+            self.assertEqual(queue.status("a")["state"], "queued")
+            queue.start()
+            self.assertTrue(queue.wait_idle(timeout=10))
+            self.assertEqual(handled, [("a", 1, b"xyz")])
+            self.assertEqual(queue.status("a")["state"], "done")
+            self.assertEqual((queue.status("b")["state"], queue.status("b")["error"]), ("failed", "boom"))
+            self.assertEqual(SaveQueue(tmp, handler).status("b")["error"], "boom")
+            self.assertIsNone(queue.status("missing"))
+
+    def test_save_queue_retries_locked_database_and_survives_failed_moves(self):
+        calls = []
+
+        def handler(job_id, payload, blob):
+            calls.append(job_id)
+            if calls.count(job_id) <= payload.get("locked", 0):
+                raise sqlite3.OperationalError("database is locked")
+            if payload.get("fail"):
+                raise ValueError("boom")
+            return {"entry_id": job_id}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = SaveQueue(tmp, handler)
+            queue.RETRY_DELAY = 0
+            queue.enqueue("flaky", {"locked": queue.MAX_RETRIES})
+            queue.enqueue("locked", {"locked": queue.MAX_RETRIES + 1})
+            self.assertTrue(queue.wait_idle(timeout=10))
+            self.assertEqual(queue.status("flaky")["state"], "done")
+            self.assertEqual(calls.count("flaky"), queue.MAX_RETRIES + 1)
+            self.assertEqual(queue.status("locked")["state"], "failed")
+
+            # 移入 failed/ 出错时线程不能退出，后面的任务照常处理
+            with patch.object(queue, "_fail", side_effect=OSError("disk full")):
+                queue.enqueue("broken", {"fail": True})
+                queue.enqueue("after", {})
+                self.assertTrue(queue.wait_idle(timeout=10))
+            self.assertEqual(queue.status("broken")["state"], "failed")
+            self.assertEqual(queue.status("after")["state"], "done")
+
+    def test_async_save_falls_back_to_blocking_when_queue_is_full(self):
+        full_queue = types.SimpleNamespace(enqueue=lambda *_args: (_ for _ in ()).throw(SaveQueueFull("full")))
+        image = _FakeTensor(np.zeros((1, 64, 64, 3), dtype=np.float32))
+        with patch.object(nodes, "get_save_queue", return_value=full_queue):
+            with patch.object(nodes, "_debug_dump_png_meta", return_value=None):
+                with patch.object(nodes.PromptVaultStore, "get", return_value=self.store):
+                    entry_id, status = self.node.run(
+                        image=image, title="", positive_prompt="blocking positive", save_mode="async"
+                    )
+        self.assertEqual((entry_id, status), ("entry_test", "保存成功"))
+
 
 if __name__ == "__main__":
     unittest.main()
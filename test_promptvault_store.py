@@ -0,0 +1,884 @@
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.modules.setdefault(
+    "httpx",
+    types.SimpleNamespace(
+        AsyncHTTPTransport=object,
+        AsyncClient=object,
+        ConnectError=Exception,
+    ),
+)
+
+from PIL import Image
+
+from ComfyUI_PromptVault.promptvault.db import OptimisticLockError, PromptVaultStore
+from ComfyUI_PromptVault.promptvault.thumbnails import pack_thumbnail_bundle
+from ComfyUI_PromptVault.promptvault.utils import content_hash
+
+
+class _TracingStore(PromptVaultStore):
+    def __init__(self, *args, **kwargs):
+        self.statements = []
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+
+def _png(img, color=(200, 80, 40)):
+    """把 PIL 图像编码成 PNG 字节；img 为 (宽, 高) 时先生成该尺寸的纯色图。"""
+    if isinstance(img, tuple):
+        img = Image.new("RGB", img, color)
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+class PromptVaultStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = PromptVaultStore(db_path=os.path.join(self.tmpdir.name, "promptvault.db"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _create(self, title, tags=(), models=(), **extra):
+        payload = {
+            "title": title,
+            "tags": list(tags),
+            "model_scope": list(models),
+            "raw": {"positive": f"{title}, masterpiece", "negative": "lowres"},
+        }
+        payload.update(extra)
+        return self.store.create_entry(payload)
+
+    def test_autocomplete_ranks_prefix_matches_by_usage(self):
+        self._create("Portrait one", tags=["portrait", "photo"], models=["SDXL"])
+        second = self._create("portrait two", tags=["portrait"], models=["SDXL"])
+        pose = self._create("Pose study", tags=["pose"], models=["SD1.5"])
+
+        tags = self.store.autocomplete("tag", "po")
+        models = self.store.autocomplete("model", "sd")
+        titles = self.store.autocomplete("title", "PORT")
+
+        self.assertEqual(tags, [{"value": "portrait", "count": 2}, {"value": "pose", "count": 1}])
+        self.assertEqual(models, [{"value": "SDXL", "count": 2}, {"value": "SD1.5", "count": 1}])
+        self.assertEqual([item["value"].lower() for item in titles], ["portrait one", "portrait two"])
+        self.assertEqual(self.store.autocomplete("title", ""), [])
+
+        # 回收站里的记录不计入模型次数
+        deleted = self.store.delete_entry(second["id"])
+        self.assertEqual(
+            self.store.autocomplete("model", "sd"), [{"value": "SD1.5", "count": 1}, {"value": "SDXL", "count": 1}]
+        )
+
+        # 恢复、改模型、批量新建都按增量维护 models.ref_count，大小写不同的模型名合并计数
+        self.store.patch_entry(second["id"], {"status": "active", "version": deleted["version"]})
+        self.store.create_entries([{"title": "Batch", "model_scope": ["sdxl", "Flux"]}])
+        pose["model_scope"] = ["Flux"]
+        self.store.update_entry(pose["id"], pose)
+        expected = [{"value": "SDXL", "count": 3}]
+        self.assertEqual(self.store.autocomplete("model", "sd"), expected)
+        self.assertEqual(self.store.autocomplete("model", "")[0], {"value": "SDXL", "count": 3})
+        self.assertEqual(self.store.autocomplete("model", "fl"), [{"value": "Flux", "count": 2}])
+
+        # 缺少迁移标记的旧库在打开时按 entry_models 重建计数
+        conn = self.store._connect()
+        conn.execute("DELETE FROM models")
+        conn.execute("DELETE FROM meta WHERE key = 'model_refcount_version'")
+        conn.commit()
+        conn.close()
+        reopened = PromptVaultStore(self.store.db_path)
+        self.assertEqual(reopened.autocomplete("model", "sd"), expected)
+
+    def test_autocomplete_cache_is_invalidated_by_writes(self):
+        entry = self._create("Cat", tags=["cat"])
+        self.assertEqual(self.store.autocomplete("tag", "ca"), [{"value": "cat", "count": 1}])
+
+        self._create("Another cat", tags=["cat"])
+        self.assertEqual(self.store.autocomplete("tag", "ca"), [{"value": "cat", "count": 2}])
+
+        self.store.delete_entry(entry["id"])
+        self.assertEqual(self.store.autocomplete("title", "cat"), [])
+
+    def test_create_entries_writes_batch_and_reports_per_item_errors(self):
+        existing = self._create("Existing")
+        result = self.store.create_entries(
+            [
+                {"title": "Batch one", "tags": ["batch", "cat"], "model_scope": ["SDXL"], "raw": {"positive": "red fox"}},
+                "not an object",
+                {"id": existing["id"], "title": "Clash"},
+                {"id": "entry_dup", "title": "First"},
+                {"id": "entry_dup", "title": "Second"},
+                {"title": "Batch two", "thumbnail_png": b"\x89PNG fake", "thumbnail_width": 8, "thumbnail_height": 8},
+            ]
+        )
+
+        self.assertEqual(result["created"], 3)
+        self.assertEqual(result["failed"], 3)
+        self.assertEqual([item["ok"] for item in result["items"]], [True, False, False, True, False, True])
+        self.assertEqual([item["index"] for item in result["items"]], list(range(6)))
+
+        first = result["items"][0]["entry"]
+        self.assertEqual(self.store.get_entry(first["id"])["tags"], ["batch", "cat"])
+        self.assertEqual(self.store.list_entry_versions(first["id"])[0]["version"], 1)
+        self.assertEqual([e["id"] for e in self.store.search_entries(tags=["batch"], model="SDXL")], [first["id"]])
+        self.assertEqual([e["id"] for e in self.store.search_entries(q="red fox")], [first["id"]])
+        self.assertEqual(self.store.get_entry("entry_dup")["title"], "First")
+        self.assertEqual(self.store.get_entry(existing["id"])["title"], "Existing")
+        self.assertEqual(self.store.count_entries(has_thumbnail=True), 1)
+        self.assertIn("batch", [t["name"] for t in self.store.list_tags()])
+
+    def test_metadata_update_touches_no_secondary_index(self):
+        store = _TracingStore(db_path=os.path.join(self.tmpdir.name, "traced.db"))
+        entry = store.create_entry({"title": "Fox", "tags": ["fox", "red"], "model_scope": ["SDXL"]})
+
+        store.statements.clear()
+        entry = store.update_entry(entry["id"], {"version": entry["version"], "favorite": 1, "score": 4})
+        entry = store.update_entry(entry["id"], {"version": entry["version"], "tags": ["fox", "red"]})
+        # 触发器与 FTS5 内部语句以 "-- " 前缀出现在跟踪里。
+        statements = [sql[3:] if sql.startswith("-- ") else sql for sql in store.statements]
+        writes = [sql for sql in statements if not sql.lstrip().upper().startswith(("SELECT", "TRIGGER"))]
+        touched = [sql for sql in writes if "entry_tags" in sql or "entry_models" in sql or "entries_fts" in sql]
+        self.assertEqual(touched, [])
+
+        store.statements.clear()
+        store.update_entry(entry["id"], {"version": entry["version"], "tags": ["fox", "snowfield"]})
+        lookup_writes = [sql for sql in store.statements if sql.startswith(("DELETE FROM entry_", "INSERT OR IGNORE INTO entry_"))]
+        self.assertEqual(len(lookup_writes), 2)
+        self.assertEqual([e["id"] for e in store.search_entries(tags=["snowfield"])], [entry["id"]])
+        self.assertEqual(store.search_entries(tags=["red"]), [])
+        self.assertEqual([e["id"] for e in store.search_entries(q="snowfield")], [entry["id"]])
+
+    def test_fts_indexes_only_active_entries(self):
+        fox = self._create("Arctic fox", tags=["winter"])
+        self._create("Desert fox", tags=["summer"])
+
+        self.assertEqual(len(self.store.search_entries(q="arctic")), 1)
+        deleted = self.store.delete_entry(fox["id"])
+        self.assertEqual(self.store.search_entries(q="arctic"), [])
+        self.assertEqual([e["id"] for e in self.store.search_entries(q="arctic", status="deleted")], [fox["id"]])
+
+        self.store.update_entry(fox["id"], {"version": deleted["version"], "status": "active"})
+        self.assertEqual([e["id"] for e in self.store.search_entries(q="winter")], [fox["id"]])
+
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            conn.execute("UPDATE entries SET status = 'deleted' WHERE id = ?", (fox["id"],))
+            conn.commit()
+            indexed = conn.execute("SELECT COUNT(*) FROM entries_fts WHERE entries_fts MATCH 'fox'").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(indexed, 1)
+        self.assertEqual(self.store.rebuild_fts_index(), 1)
+
+    def test_legacy_fts_table_is_migrated(self):
+        self._create("Misty harbor", tags=["sea"])
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            conn.executescript(
+                """
+                DROP TRIGGER entries_fts_ai;
+                DROP TRIGGER entries_fts_ad;
+                DROP TRIGGER entries_fts_au;
+                DROP TABLE entries_fts;
+                DROP VIEW entries_fts_source;
+                CREATE VIRTUAL TABLE entries_fts USING fts5(entry_id UNINDEXED, title, content, tags);
+                DELETE FROM meta WHERE key = 'fts_version';
+                """
+            )
+        finally:
+            conn.close()
+
+        store = PromptVaultStore(db_path=self.store.db_path)
+
+        self.assertEqual([e["title"] for e in store.search_entries(q="harbor")], ["Misty harbor"])
+        self.assertEqual([e["title"] for e in store.search_entries(q="sea harbor")], ["Misty harbor"])
+
+    def test_patch_entry_updates_only_given_fields(self):
+        store = _TracingStore(db_path=os.path.join(self.tmpdir.name, "traced.db"))
+        entry = store.create_entry(
+            {"title": "Fox", "tags": ["fox"], "thumbnail_png": b"\x89PNG fake", "thumbnail_width": 4, "thumbnail_height": 4}
+        )
+
+        store.set_settings({"version_metadata_changes": False})
+        store.statements.clear()
+        result = store.patch_entry(entry["id"], {"version": entry["version"], "favorite": True, "score": 4})
+        self.assertEqual(result["version"], 2)
+        self.assertEqual((result["favorite"], result["score"], result["versioned"]), (1, 4.0, False))
+        entry_sql = [sql for sql in store.statements if "entries" in sql and not sql.startswith("-- ")]
+        self.assertEqual(len([sql for sql in entry_sql if "UPDATE entries" in sql]), 1)
+        self.assertFalse(any("thumbnail_png" in sql and "IS NOT NULL" not in sql for sql in entry_sql))
+        self.assertFalse(any("entry_versions" in sql for sql in store.statements))
+
+        with self.assertRaises(OptimisticLockError):
+            store.patch_entry(entry["id"], {"version": 1, "score": 1})
+
+        result = store.patch_entry(entry["id"], {"version": 2, "tags": ["fox", "night"], "status": "deleted"})
+        self.assertTrue(result["versioned"])
+        full = store.get_entry(entry["id"])
+        self.assertEqual((full["status"], full["tags"], full["favorite"]), ("deleted", ["fox", "night"], 1))
+        self.assertTrue(full["has_thumbnail"])
+        self.assertEqual(store.get_entry_thumbnail(entry["id"])["png"], b"\x89PNG fake")
+        self.assertEqual([v["version"] for v in store.list_entry_versions(entry["id"])], [3, 1])
+        self.assertEqual(store.search_entries(tags=["night"], status="deleted")[0]["id"], entry["id"])
+
+        with self.assertRaises(ValueError):
+            store.patch_entry(entry["id"], {"version": 3, "title": "nope"})
+        with self.assertRaises(KeyError):
+            store.patch_entry("missing", {"version": 1, "favorite": 1})
+
+    def _tag_counts(self):
+        return {t["name"]: t["count"] for t in self.store.list_tags()}
+
+    def test_tag_ref_counts_follow_writes(self):
+        a = self._create("A", tags=["cat", "night"])
+        b = self._create("B", tags=["cat"])
+        self.store.create_entries([{"title": "C", "tags": ["cat", "dog"]}])
+        self.assertEqual(self._tag_counts(), {"cat": 3, "night": 1, "dog": 1})
+
+        a = self.store.update_entry(a["id"], {"version": a["version"], "tags": ["cat", "day"]})
+        self.assertEqual(self._tag_counts(), {"cat": 3, "day": 1, "dog": 1})
+
+        self.store.delete_entry(b["id"])
+        deleted = self.store.delete_entry(a["id"])
+        self.assertEqual(self._tag_counts(), {"cat": 1, "dog": 1})
+
+        self.store.patch_entry(a["id"], {"version": deleted["version"], "status": "active"})
+        self.assertEqual(self._tag_counts(), {"cat": 2, "day": 1, "dog": 1})
+        self.assertEqual(self.store.tidy_tags(), {"removed": 0, "added": 0, "fixed": 0})
+
+    def test_tidy_tags_repairs_drift(self):
+        self._create("A", tags=["cat", "night"])
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            conn.execute("UPDATE tags SET ref_count = 7 WHERE name = 'cat'")
+            conn.execute("DELETE FROM tags WHERE name = 'night'")
+            conn.execute("INSERT INTO tags(name, created_at, ref_count) VALUES('stale', '2024-01-01', 2)")
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.assertEqual(self.store.tidy_tags(), {"removed": 1, "added": 1, "fixed": 1})
+        self.assertEqual(self._tag_counts(), {"cat": 1, "night": 1})
+
+    def test_bulk_update_by_ids_and_filters(self):
+        ids = [self._create(f"Fox {i}", tags=["fox"] if i < 5 else ["cat"])["id"] for i in range(8)]
+
+        dry = self.store.bulk_update("delete", filters={"tags": ["fox"]}, dry_run=True)
+        self.assertEqual((dry["matched"], sorted(dry["sample_ids"])), (5, sorted(ids[:5])))
+        self.assertEqual(self.store.count_entries(), 8)
+
+        events = []
+        result = self.store.bulk_update("delete", filters={"tags": ["fox"]}, chunk_size=2, progress=events.append)
+        self.assertEqual((result["matched"], result["changed"], result["unchanged"]), (5, 5, 0))
+        self.assertEqual([e["done"] for e in events], [2, 4, 5])
+        self.assertEqual(self.store.count_entries(), 3)
+        self.assertNotIn("fox", self._tag_counts())
+
+        result = self.store.bulk_update("restore", ids=ids[:2] + ["missing"])
+        self.assertEqual((result["changed"], result["missing"]), (2, 1))
+        self.assertEqual(self._tag_counts()["fox"], 2)
+
+        result = self.store.bulk_update("tag", filters={"q": "Fox"}, value="night,Fox")
+        self.assertEqual((result["matched"], result["changed"]), (5, 5))
+        self.assertEqual(self.store.get_entry(ids[6])["tags"], ["cat", "night", "Fox"])
+        self.assertEqual(self.store.get_entry(ids[0])["tags"], ["fox", "night"])
+
+        result = self.store.bulk_update("untag", ids=ids, value=["NIGHT"])
+        self.assertEqual((result["changed"], result["unchanged"]), (5, 3))
+        self.assertNotIn("night", self._tag_counts())
+
+        self.store.bulk_update("favorite", ids=ids[:3], value=True)
+        self.store.bulk_update("score", filters={"favorite_only": True}, value=4.5)
+        self.assertEqual(
+            sorted((e["id"], e["score"]) for e in self.store.search_entries(favorite_only=True)),
+            sorted((entry_id, 4.5) for entry_id in ids[:2]),
+        )
+
+        with self.assertRaises(ValueError):
+            self.store.bulk_update("favorite", ids=ids, filters={"q": "x"})
+        with self.assertRaises(ValueError):
+            self.store.bulk_update("tag", ids=ids, value=[])
+
+    def test_purge_deleted_entries_runs_in_chunks_and_vacuums(self):
+        self.assertEqual(self.store.vacuum_status()["auto_vacuum"], "incremental")
+        blob = os.urandom(64 * 1024)
+        ids = [self._create(f"Trash {i}", tags=["trash"], thumbnail_png=blob)["id"] for i in range(7)]
+        keep = self._create("Keep", tags=["trash"])["id"]
+        self.store.bulk_update("delete", ids=ids)
+
+        events = []
+        result = self.store.purge_deleted_entries(chunk_size=3, progress=events.append)
+        self.assertEqual((result["total"], result["deleted"], result["chunks"]), (7, 7, 3))
+        self.assertEqual([e["deleted"] for e in events if e["phase"] == "purge"], [3, 6, 7])
+        self.assertGreater(result["vacuum"]["reclaimed_pages"], 0)
+        self.assertEqual(result["vacuum"]["freelist_count"], 0)
+
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            for table in ("entries", "entry_versions", "entry_tags"):
+                remaining = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {'id' if table == 'entries' else 'entry_id'} != ?", (keep,)).fetchone()[0]
+                self.assertEqual(remaining, 0, table)
+        finally:
+            conn.close()
+        self.assertEqual(self._tag_counts()["trash"], 1)
+        self.assertEqual(self.store.purge_deleted_entries()["deleted"], 0)
+
+    def test_legacy_database_is_migrated_to_incremental_vacuum(self):
+        legacy_path = os.path.join(self.tmpdir.name, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.commit()
+        conn.close()
+        store = PromptVaultStore(db_path=legacy_path)
+        entry = store.create_entry({"title": "Snowfield", "raw": {"positive": "snowfield"}})
+        self.assertEqual(store.vacuum_status()["auto_vacuum"], "none")
+        self.assertEqual(store.incremental_vacuum()["reclaimed_pages"], 0)
+
+        result = store.enable_incremental_vacuum()
+        self.assertTrue(result["migrated"])
+        self.assertEqual(store.vacuum_status()["auto_vacuum"], "incremental")
+        self.assertFalse(store.enable_incremental_vacuum()["migrated"])
+        self.assertEqual([e["id"] for e in store.search_entries(q="snowfield")], [entry["id"]])
+
+    def test_inline_thumbnails_are_migrated_online(self):
+        pngs = [b"\x89PNG 0", b"\x89PNG 1", b"\x89PNG 2", b"\x89PNG 2"]
+        ids = [self._create(f"Thumb {i}", thumbnail_png=png, thumbnail_width=4)["id"] for i, png in enumerate(pngs)]
+        self._create("No thumb")
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            # 还原成旧版布局：缩略图内联在 entries.thumbnail_png，没有内容哈希
+            conn.execute(
+                """
+                UPDATE entries SET has_thumbnail = 0, thumbnail_hash = NULL,
+                  thumbnail_png = (SELECT data FROM thumbnail_blobs b WHERE b.blob_hash = entries.thumbnail_hash)
+                WHERE thumbnail_hash IS NOT NULL
+                """
+            )
+            conn.executescript(
+                """
+                DELETE FROM thumbnail_blobs;
+                DELETE FROM meta WHERE key = 'thumbnail_table_version';
+                """
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        store = PromptVaultStore(db_path=self.store.db_path)
+        self.assertTrue(store.thumbnail_migration_pending())
+        self.assertEqual(store.count_entries(has_thumbnail=True), 4)
+        self.assertEqual(store.get_entry_thumbnail(ids[0])["png"], b"\x89PNG 0")
+
+        # 迁移前后的写入：换缩略图写新表，不改缩略图保留旧 blob
+        first = store.get_entry(ids[0])
+        store.update_entry(ids[0], {**first, "thumbnail_png": b"\x89PNG new", "thumbnail_width": 8})
+        second = store.get_entry(ids[1])
+        store.update_entry(ids[1], {**second, "title": "Renamed"})
+
+        partial = store.migrate_thumbnails(batch_size=2, max_batches=1)
+        self.assertEqual((partial["moved"], partial["complete"]), (2, False))
+        self.assertTrue(store.thumbnail_migration_pending())
+        self.assertEqual(store.count_entries(has_thumbnail=True), 4)
+
+        result = store.migrate_thumbnails(batch_size=2, cursor=partial["cursor"])
+        self.assertEqual((result["moved"], result["deduplicated"], result["complete"]), (1, 1, True))
+        self.assertFalse(store.thumbnail_migration_pending())
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM entries WHERE thumbnail_png IS NOT NULL").fetchone()[0], 0)
+            # 重复的两张合并为一份，引用计数与引用它的记录数一致
+            self.assertEqual(
+                dict(conn.execute("SELECT blob_hash, refcount FROM thumbnail_blobs").fetchall()),
+                {content_hash(b"\x89PNG new"): 1, content_hash(b"\x89PNG 1"): 1, content_hash(b"\x89PNG 2"): 2},
+            )
+        finally:
+            conn.close()
+        self.assertEqual(store.get_entry_thumbnail(ids[0])["png"], b"\x89PNG new")
+        self.assertEqual(store.get_entry_thumbnail(ids[1])["png"], b"\x89PNG 1")
+        self.assertEqual(store.get_entry(ids[1])["thumbnail_hash"], content_hash(b"\x89PNG 1"))
+        self.assertEqual(
+            sorted(e["id"] for e in store.search_entries(has_thumbnail=True, limit=10)), sorted(ids)
+        )
+        exported = {e["id"]: e for e in store.export_bundle()["entries"]}
+        self.assertTrue(all(exported[i]["thumbnail_b64"] for i in ids))
+
+        # 导入不带缩略图时保留现有缩略图
+        store.import_bundle({"entries": [dict(exported[ids[2]], thumbnail_b64="", title="Imported")]})
+        self.assertEqual(store.get_entry_thumbnail(ids[2])["png"], b"\x89PNG 2")
+        self.assertTrue(store.get_entry(ids[2])["has_thumbnail"])
+
+    def test_thumbnail_renditions_are_selected_by_width_and_converted(self):
+        renditions = [
+            {"format": "webp", "width": w, "height": w, "data": b"RIFF%dWEBP" % w} for w in (96, 256, 512)
+        ]
+        entry = self._create(
+            "Rendered",
+            thumbnail_png=_png((256, 256)),
+            thumbnail_width=256,
+            thumbnail_height=256,
+            thumbnail_renditions=renditions,
+        )
+        pick = lambda size, webp=True: self.store.get_thumbnail_rendition(entry["id"], size, accept_webp=webp)
+        self.assertEqual([pick(size)["width"] for size in (64, 96, 200, None, 1024)], [96, 96, 256, 256, 512])
+        self.assertEqual((pick(96, webp=False)["format"], pick(96, webp=False)["width"]), ("png", 256))
+
+        # 换缩略图后旧副本失效，由转换任务按设置重新生成
+        current = self.store.get_entry(entry["id"])
+        self.store.update_entry(entry["id"], {**current, "thumbnail_png": _png((256, 128)), "thumbnail_height": 128})
+        self.assertEqual(pick(96)["format"], "png")
+        plain = self._create("Plain", thumbnail_png=_png((128, 64)), thumbnail_width=128, thumbnail_height=64)
+
+        result = self.store.convert_thumbnail_renditions(batch_size=1)
+        self.assertEqual((result["converted"], result["failed"], result["complete"]), (2, 0, True))
+        self.assertEqual(set(result["webp_bytes_by_width"]), {96, 128, 256})
+        self.assertEqual((pick(96)["format"], pick(96)["width"], pick(96)["height"]), ("webp", 96, 48))
+        self.assertEqual(self.store.get_thumbnail_rendition(plain["id"], 512)["width"], 128)
+        self.assertTrue(pick(None)["data"].startswith(b"RIFF"))
+        self.assertEqual(self.store.convert_thumbnail_renditions()["converted"], 0)
+        self.assertEqual(self.store.convert_thumbnail_renditions(force=True)["converted"], 2)
+
+    def test_thumbnail_hash_is_stored_and_matches_conditional_reads(self):
+        entry = self._create(
+            "Hashed",
+            thumbnail_png=b"\x89PNG v1",
+            thumbnail_renditions=[{"format": "webp", "width": 96, "height": 96, "data": b"RIFF96WEBP"}],
+        )
+        png_hash, webp_hash = content_hash(b"\x89PNG v1"), content_hash(b"RIFF96WEBP")
+        self.assertEqual(entry["thumbnail_hash"], png_hash)
+        self.assertEqual(self.store.search_entries(q="Hashed")[0]["thumbnail_hash"], png_hash)
+
+        thumb = self.store.get_thumbnail_rendition(entry["id"], 96)
+        self.assertEqual((thumb["hash"], thumb["thumbnail_hash"], thumb["data"]), (webp_hash, png_hash, b"RIFF96WEBP"))
+        self.assertIsNone(self.store.get_thumbnail_rendition(entry["id"], 96, known_hashes=["x", webp_hash])["data"])
+        png = self.store.get_thumbnail_rendition(entry["id"], 96, accept_webp=False, known_hashes=[webp_hash])
+        self.assertEqual((png["hash"], png["data"]), (png_hash, b"\x89PNG v1"))
+        self.assertIsNone(
+            self.store.get_thumbnail_rendition(entry["id"], accept_webp=False, known_hashes=[png_hash])["data"]
+        )
+
+        # 只改元数据不改变哈希；换缩略图后哈希随之改变
+        self.store.patch_entry(entry["id"], {"favorite": True, "version": entry["version"]})
+        self.assertEqual(self.store.get_entry(entry["id"])["thumbnail_hash"], png_hash)
+        current = self.store.get_entry(entry["id"])
+        updated = self.store.update_entry(entry["id"], {**current, "thumbnail_png": b"\x89PNG v2"})
+        self.assertEqual(updated["thumbnail_hash"], content_hash(b"\x89PNG v2"))
+        # 旧副本随缩略图一起失效，退回新的 PNG
+        refreshed = self.store.get_thumbnail_rendition(entry["id"], 96, known_hashes=[webp_hash])
+        self.assertEqual(refreshed["data"], b"\x89PNG v2")
+        plain = self._create("Plain")
+        self.assertIsNone(plain["thumbnail_hash"])
+        self.assertIsNone(self.store.get_thumbnail_rendition(plain["id"]))
+
+    def test_thumbnail_stream_reads_blob_in_chunks(self):
+        png = bytes(range(256)) * 40
+        entry = self._create("Streamed", thumbnail_png=png, thumbnail_width=4)
+        stream = self.store.open_thumbnail_stream(entry["id"], accept_webp=False, chunk_size=4096)
+        chunks = list(stream["chunks"])
+        self.assertEqual((stream["length"], stream["hash"]), (len(png), content_hash(png)))
+        self.assertEqual([len(c) for c in chunks], [4096, 4096, len(png) - 8192])
+        self.assertEqual(b"".join(chunks), png)
+        matched = self.store.open_thumbnail_stream(entry["id"], accept_webp=False, known_hashes=[content_hash(png)])
+        self.assertEqual((matched["chunks"], matched["hash"]), (None, content_hash(png)))
+        self.assertIsNone(self.store.open_thumbnail_stream(self._create("Plain")["id"]))
+        with self.assertRaises(KeyError):
+            self.store.open_thumbnail_stream("missing")
+
+        # 迁移前内联在 entries 上的缩略图同样可以流式读取
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            conn.execute(
+                "UPDATE entries SET thumbnail_png = ?, has_thumbnail = 0, thumbnail_hash = NULL WHERE id = ?",
+                (png, entry["id"]),
+            )
+            conn.execute("DELETE FROM thumbnail_blobs")
+            conn.commit()
+        finally:
+            conn.close()
+        stream = self.store.open_thumbnail_stream(entry["id"])
+        self.assertEqual(b"".join(stream["chunks"]), png)
+
+    def test_identical_thumbnails_share_one_blob(self):
+        def blob_refs(store):
+            conn = sqlite3.connect(store.db_path)
+            try:
+                return dict(conn.execute("SELECT blob_hash, refcount FROM thumbnail_blobs").fetchall())
+            finally:
+                conn.close()
+
+        shared, other = b"\x89PNG shared", b"\x89PNG other"
+        first = self._create("First", thumbnail_png=shared, thumbnail_width=4)
+        second = self._create("Second", thumbnail_png=shared, thumbnail_width=4)
+        self.assertEqual(blob_refs(self.store), {content_hash(shared): 2})
+
+        # 另一个库里已有同一张图：导入只增加引用计数，不写 blob
+        target = _TracingStore(db_path=os.path.join(self.tmpdir.name, "traced.db"))
+        target.create_entry({"title": "Local", "raw": {"positive": "local"}, "thumbnail_png": shared})
+        target.statements.clear()
+        exported = self.store.export_bundle()["entries"]
+        result = target.import_bundle({"entries": exported})
+        self.assertEqual((result["created"], result["errors"]), (2, []))
+        self.assertFalse([sql for sql in target.statements if "INSERT INTO thumbnail_blobs" in sql])
+        self.assertEqual(blob_refs(target), {content_hash(shared): 3})
+        self.assertEqual(target.get_entry_thumbnail(first["id"])["png"], shared)
+
+        # 手改了 thumbnail_b64 却留着旧 thumbnail_hash：按内容重算哈希，新图不会被丢掉
+        edited = b"\x89PNG edited"
+        tampered = dict(exported[0], id="tampered", thumbnail_b64=base64.b64encode(edited).decode("ascii"))
+        self.assertEqual(tampered["thumbnail_hash"], content_hash(shared))
+        target.import_bundle({"entries": [tampered]})
+        self.assertEqual(target.get_entry_thumbnail("tampered")["png"], edited)
+        self.assertEqual(target.get_entry("tampered")["thumbnail_hash"], content_hash(edited))
+
+        # 换缩略图扣减旧引用；清空回收站后无引用的 blob 随之删除
+        self.store.update_entry(second["id"], {**self.store.get_entry(second["id"]), "thumbnail_png": other})
+        self.assertEqual(blob_refs(self.store), {content_hash(shared): 1, content_hash(other): 1})
+        self.store.delete_entry(first["id"])
+        self.assertEqual(self.store.get_entry_thumbnail(second["id"])["png"], other)
+        self.assertEqual(self.store.purge_deleted_entries()["thumbnails"], 1)
+        self.assertEqual(blob_refs(self.store), {content_hash(other): 1})
+
+    def test_perceptual_hash_finds_similar_thumbnails(self):
+        base = Image.open(Path(__file__).resolve().parent / "demo.png").convert("RGB").resize((256, 256))
+
+        from ComfyUI_PromptVault.promptvault import thumbnails
+
+        compute = thumbnails.thumbnail_features
+        computed = []
+
+        def outside_write_lock(png_list, *args, **kwargs):
+            # 解码和占位图编码时不能占着写锁：另一个连接此刻应能立即拿到写锁
+            other = sqlite3.connect(self.store.db_path, timeout=0)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                other.rollback()
+            finally:
+                other.close()
+            computed.extend(png_list)
+            return compute(png_list, *args, **kwargs)
+
+        with mock.patch.object(thumbnails, "thumbnail_features", outside_write_lock):
+            original = self._create("Original", thumbnail_png=_png(base))
+            brighter = self._create("Brighter", thumbnail_png=_png(base.point(lambda v: min(255, v + 6))))
+            mirrored = self._create("Mirrored", thumbnail_png=_png(base.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+            broken = self._create("Broken", thumbnail_png=b"\x89PNG broken")
+            self._create("Plain")
+        self.assertEqual(len(computed), 4)
+
+        similar = self.store.find_similar_entries(original["id"])
+        self.assertEqual([(i["id"], i["distance"]) for i in similar], [(brighter["id"], 0)])
+        wide = self.store.find_similar_entries(original["id"], max_distance=self.store.PHASH_MAX_DISTANCE)
+        self.assertEqual([i["id"] for i in wide], [brighter["id"], mirrored["id"]])
+        # 多索引哈希取候选与全表比对结果一致
+        self.store.PHASH_MIH_MAX_RADIUS = -1
+        self.assertEqual(self.store.find_similar_entries(original["id"], max_distance=12), similar)
+        del self.store.PHASH_MIH_MAX_RADIUS
+        self.assertEqual(self.store.find_similar_entries(broken["id"]), [])
+        with self.assertRaises(ValueError):
+            self.store.find_similar_entries(original["id"], max_distance=65)
+
+        ranked = self.store.search_entries(sort="similar", similar_to=mirrored["id"])
+        self.assertEqual(ranked[0]["id"], mirrored["id"])
+        self.assertEqual([i["distance"] for i in ranked][-2:], [None, None])
+        fallback = self.store.search_entries(sort="similar", similar_to="missing")
+        self.assertNotIn("distance", fallback[0])
+
+        # 回填只处理还没有感知哈希的缩略图；无法解码的记为 NULL，不再重复处理
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            stored = dict(conn.execute("SELECT blob_hash, phash FROM thumbnail_phashes").fetchall())
+            conn.execute("DELETE FROM thumbnail_phashes")
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(stored[broken["thumbnail_hash"]], None)
+        self.assertTrue(self.store.thumbnail_features_pending())
+        self.assertEqual(self.store.find_similar_entries(original["id"]), [])
+        with mock.patch.object(thumbnails, "thumbnail_features", outside_write_lock):
+            result = self.store.backfill_thumbnail_features(batch_size=2)
+        self.assertEqual((result["processed"], result["failed"], result["batches"]), (3, 1, 2))
+        self.assertFalse(self.store.thumbnail_features_pending())
+        self.assertEqual(self.store.backfill_thumbnail_features()["batches"], 0)
+        self.assertEqual(self.store.find_similar_entries(original["id"]), similar)
+
+    def test_search_results_inline_placeholders_within_budget(self):
+        for i, color in enumerate([(200, 40, 40), (40, 200, 40), (40, 40, 200)]):
+            self._create(f"Colored {i}", thumbnail_png=_png((256, 192), color))
+        self._create("Broken", thumbnail_png=b"\x89PNG broken")
+        self._create("Plain")
+
+        ordered = self.store.search_entries(limit=10)
+        items = {i["title"]: i for i in ordered}
+        self.assertEqual(items["Colored 0"]["placeholder_color"], "#c82828")
+        self.assertTrue(items["Colored 0"]["placeholder"].startswith("data:image/webp;base64,"))
+        for title in ("Broken", "Plain"):
+            self.assertEqual((items[title]["placeholder"], items[title]["placeholder_color"]), ("", ""))
+
+        # 超出预算的条目只带平均色；预算为 0 时全部只有平均色
+        budget = sum(len(i["placeholder"]) for i in ordered if i["placeholder"]) - 1
+        tight = self.store.search_entries(limit=10, placeholder_budget=budget)
+        self.assertEqual(sum(1 for i in tight if i["placeholder"]), 2)
+        self.assertTrue(all(i["placeholder_color"] for i in tight if i["title"].startswith("Colored")))
+        self.assertFalse(any(i["placeholder"] for i in self.store.search_entries(limit=10, placeholder_budget=0)))
+
+    def test_export_streams_every_format_in_chunks(self):
+        empty = json.loads("".join(self.store.iter_export_text("json")))
+        self.assertEqual((empty["templates"], empty["fragments"], empty["entries"]), ([], [], []))
+
+        self.store.upsert_fragment({"title": "Light", "text": "soft light"})
+        for i in range(5):
+            self._create(f"Entry {i}", tags=["t"], thumbnail_png=b"\x89PNG %d" % i)
+        bundle = self.store.export_bundle()
+
+        chunks = list(self.store.iter_export_text("json", batch_size=2, chunk_size=64))
+        self.assertGreater(len(chunks), 5)
+        streamed = json.loads("".join(chunks))
+        self.assertEqual(dict(streamed, exported_at=None), dict(bundle, exported_at=None))
+
+        lines = [json.loads(line) for line in "".join(self.store.iter_export_text("ndjson")).splitlines()]
+        self.assertEqual([line["record_type"] for line in lines], ["meta", "fragment"] + ["entry"] * 5)
+        self.assertEqual(lines[-1]["thumbnail_b64"], bundle["entries"][-1]["thumbnail_b64"])
+
+        rows = list(csv.DictReader(io.StringIO(self.store.export_bundle_csv())))
+        self.assertEqual([row["title"] for row in rows], ["Light"] + [f"Entry {i}" for i in range(5)])
+        with self.assertRaises(ValueError):
+            next(self.store.iter_export_text("xml"))
+
+    def test_streaming_import_resumes_from_checkpoint(self):
+        self.store.upsert_fragment({"title": "Light", "text": "soft light"})
+        for i in range(12):
+            self._create(f"Entry {i}", tags=["t"], thumbnail_png=b"\x89PNG %d" % i)
+        merge_record = PromptVaultStore._import_record
+
+        for fmt, compress in (("json", False), ("ndjson", True), ("csv", False)):
+            data = "".join(self.store.iter_export_text(fmt)).encode("utf-8")
+            path = os.path.join(self.tmpdir.name, f"bundle.{fmt}" + (".gz" if compress else ""))
+            Path(path).write_bytes(gzip.compress(data) if compress else data)
+            target = PromptVaultStore(db_path=os.path.join(self.tmpdir.name, f"import-{fmt}.db"))
+            checkpoint = target.create_import(path)
+            calls = []
+
+            def interrupted(store, conn, record_type, payload, features=None):
+                calls.append(record_type)
+                if len(calls) == 8:
+                    raise KeyboardInterrupt
+                return merge_record(store, conn, record_type, payload, features)
+
+            # 第二批中途进程退出：第一批已随断点提交，第二批整体回滚
+            with mock.patch.object(PromptVaultStore, "_import_record", interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    target.run_import(checkpoint["import_id"], batch_size=5)
+            state = target.get_import(checkpoint["import_id"])
+            # ndjson 的首行 meta 也占一个位置
+            first_batch = 4 if fmt == "ndjson" else 5
+            self.assertEqual((state["state"], state["created"]), ("interrupted", first_batch))
+            self.assertEqual(target.count_entries(), first_batch - 1)
+
+            progress = []
+            result = target.run_import(checkpoint["import_id"], batch_size=5, progress=progress.append)
+            self.assertEqual((result["state"], result["format"]), ("done", fmt))
+            self.assertEqual((result["created"], result["updated"], result["error_count"]), (13, 0, 0))
+            self.assertEqual(progress[-1]["bytes_read"], os.path.getsize(path))
+            self.assertEqual(target.count_entries(), 12)
+            self.assertTrue(target.get_entry_thumbnail(target.search_entries(limit=1)[0]["id"])["png"])
+
+        with self.assertRaises(ValueError):
+            self.store.run_import(self.store.create_import(path, fmt="json")["import_id"])
+        self.assertEqual(self.store.list_imports()[0]["state"], "failed")
+
+    def test_import_rolls_back_only_the_failing_record(self):
+        write_version = PromptVaultStore._write_version
+
+        def failing(store, conn, entry, *args):
+            # 记录行已经插入之后才出错
+            if entry["id"] == "bad":
+                raise sqlite3.IntegrityError("boom")
+            return write_version(store, conn, entry, *args)
+
+        bundle = {"entries": [{"id": "ok", "title": "Fine"}, {"id": "bad", "title": "Bad"}, "junk"]}
+        with mock.patch.object(PromptVaultStore, "_write_version", failing):
+            result = self.store.import_bundle(bundle, batch_size=2)
+        self.assertEqual((result["created"], result["error_count"]), (1, 2))
+        self.assertEqual([e["id"] for e in result["errors"]], ["bad", ""])
+        self.assertEqual([e["id"] for e in self.store.search_entries(limit=10)], ["ok"])
+
+    def test_import_detects_encoding_past_the_sniffed_head(self):
+        from ComfyUI_PromptVault.promptvault.import_reader import SNIFF_BYTES
+
+        # GBK 字符只出现在开头 SNIFF_BYTES 之后：编码要在提交任何记录之前就选对
+        self.store.upsert_fragment({"title": "Padding", "text": "x" * (SNIFF_BYTES + 4096)})
+        fragment = self.store.upsert_fragment({"title": "柔光", "text": "柔和的侧光"})
+        path = os.path.join(self.tmpdir.name, "bundle.csv")
+        Path(path).write_bytes(self.store.export_bundle_csv().encode("gbk"))
+        self.assertNotIn(b"\xc8", Path(path).read_bytes()[:SNIFF_BYTES])
+
+        target = PromptVaultStore(db_path=os.path.join(self.tmpdir.name, "import-gbk.db"))
+        result = target.import_file(path, batch_size=1)
+        self.assertEqual((result["state"], result["created"], result["error_count"]), ("done", 2, 0))
+        self.assertEqual(target.get_fragment(fragment["id"])["text"], "柔和的侧光")
+
+    def test_thumbnails_are_fetched_in_one_batch(self):
+        webp = self._create(
+            "Batch webp",
+            thumbnail_png=b"\x89PNG a",
+            thumbnail_renditions=[
+                {"format": "webp", "width": 96, "height": 96, "data": b"RIFF96"},
+                {"format": "webp", "width": 256, "height": 256, "data": b"RIFF256"},
+            ],
+        )
+        png = self._create("Batch png", thumbnail_png=b"\x89PNG b")
+        plain = self._create("Batch plain")
+
+        ids = [png["id"], "missing", webp["id"], plain["id"], png["id"]]
+        items, missing = self.store.get_thumbnails(ids, width=96)
+        self.assertEqual([(i["id"], i["format"], i["data"]) for i in items], [
+            (png["id"], "png", b"\x89PNG b"),
+            (webp["id"], "webp", b"RIFF96"),
+        ])
+        self.assertEqual(items[1]["hash"], content_hash(b"RIFF96"))
+        self.assertEqual(missing, ["missing", plain["id"]])
+        # 与单条读取的选取规则一致
+        for width in (64, 200, 400):
+            batch = self.store.get_thumbnails([webp["id"]], width=width)[0][0]
+            single = self.store.get_thumbnail_rendition(webp["id"], width)
+            self.assertEqual((batch["width"], batch["data"]), (single["width"], single["data"]))
+        no_webp, _ = self.store.get_thumbnails([webp["id"]], width=96, accept_webp=False)
+        self.assertEqual(no_webp[0]["data"], b"\x89PNG a")
+
+        bundle = pack_thumbnail_bundle(items, missing)
+        header_len = struct.unpack(">I", bundle[4:8])[0]
+        manifest = json.loads(bundle[8 : 8 + header_len])
+        body = bundle[8 + header_len :]
+        self.assertEqual(bundle[:4], b"PVT1")
+        self.assertEqual(manifest["missing"], missing)
+        self.assertEqual(
+            [body[m["offset"] : m["offset"] + m["length"]] for m in manifest["items"]],
+            [b"\x89PNG b", b"RIFF96"],
+        )
+
+        self.assertEqual(self.store.get_thumbnails([]), ([], []))
+        with self.assertRaises(ValueError):
+            self.store.get_thumbnails(["x"] * (self.store.THUMBNAIL_BATCH_LIMIT + 1))
+        with self.assertRaises(ValueError):
+            self.store.get_thumbnails("abc")
+
+    def _version_rows(self, entry_id):
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            return conn.execute(
+                "SELECT version, keyframe, snapshot_json FROM entry_versions WHERE entry_id = ? ORDER BY version",
+                (entry_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def test_versions_are_stored_as_keyframes_and_deltas(self):
+        self.store.VERSION_KEYFRAME_INTERVAL = 3
+        entry = self._create("Lake", tags=["lake"])
+        expected = {1: entry}
+        for i in range(6):
+            if i % 2:
+                self.store.patch_entry(entry["id"], {"favorite": i % 4 == 1, "version": entry["version"]})
+                entry = self.store.get_entry(entry["id"])
+            else:
+                raw = dict(entry["raw"], positive=f"lake, step {i}")
+                entry = self.store.update_entry(entry["id"], {**entry, "raw": raw, "tags": ["lake", f"s{i}"]})
+            expected[entry["version"]] = entry
+
+        rows = self._version_rows(entry["id"])
+        self.assertEqual([(version, keyframe) for version, keyframe, _json in rows], [(v, int(v % 3 == 1)) for v in range(1, 8)])
+        self.assertTrue(all(snapshot_json == "" for _v, _k, snapshot_json in rows))
+        for version, stored in expected.items():
+            snapshot = self.store.get_entry_version(entry["id"], version)["snapshot"]
+            for key in ("title", "tags", "raw", "version", "status", "updated_at"):
+                self.assertEqual(snapshot[key], stored[key], (version, key))
+            self.assertEqual(int(snapshot.get("favorite", 0)), int(stored.get("favorite", 0)), version)
+        with self.assertRaises(KeyError):
+            self.store.get_entry_version(entry["id"], 99)
+
+    def test_legacy_full_snapshots_are_compressed(self):
+        entry = self._create("Legacy")
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            conn.execute("DELETE FROM entry_versions")
+            for version in range(1, 5):
+                snapshot = dict(entry, version=version, title=f"Legacy {version}", thumbnail_b64="QUFB" * 500)
+                conn.execute(
+                    "INSERT INTO entry_versions(entry_id,version,snapshot_json,created_at) VALUES(?,?,?,?)",
+                    (entry["id"], version, json.dumps(snapshot), entry["created_at"]),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(self.store.get_entry_version(entry["id"], 3)["snapshot"]["title"], "Legacy 3")
+
+        result = self.store.compress_entry_versions(batch_size=1)
+        self.assertEqual((result["entries"], result["rows"]), (1, 4))
+        self.assertLess(result["bytes_after"] * 10, result["bytes_before"])
+        self.assertEqual([keyframe for _v, keyframe, _json in self._version_rows(entry["id"])], [1, 0, 0, 0])
+        snapshot = self.store.get_entry_version(entry["id"], 3)["snapshot"]
+        self.assertEqual((snapshot["title"], "thumbnail_b64" in snapshot), ("Legacy 3", False))
+        self.assertEqual(self.store.compress_entry_versions()["rows"], 0)
+
+    def test_compact_entry_versions_applies_retention_policy(self):
+        self.store.VERSION_KEYFRAME_INTERVAL = 4
+        entry = self._create("River")
+        for i in range(11):
+            self.store.patch_entry(entry["id"], {"score": i, "version": i + 1})
+        other = self._create("Short history")
+        # 版本 1-8 分布在很久以前的 4 天里（每天两个），9-12 在保留窗口内
+        conn = sqlite3.connect(self.store.db_path)
+        try:
+            for version in range(1, 9):
+                created_at = f"2020-01-0{(version + 1) // 2}T0{version % 2}:00:00+00:00"
+                conn.execute(
+                    "UPDATE entry_versions SET created_at = ? WHERE entry_id = ? AND version = ?",
+                    (created_at, entry["id"], version),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        self.store.set_settings({"version_keep_last": 2, "version_keep_days": 30, "version_thin_daily": True})
+
+        events = []
+        result = self.store.compact_entry_versions(batch_size=1, progress=events.append)
+        self.assertEqual((result["entries_checked"], result["entries_compacted"], result["deleted"]), (1, 1, 4))
+        self.assertTrue(result["complete"])
+        self.assertGreater(result["bytes_reclaimed"], 0)
+        self.assertEqual(len(events), 1)
+        rows = self._version_rows(entry["id"])
+        self.assertEqual([(version, keyframe) for version, keyframe, _json in rows], [(2, 1), (4, 0), (6, 0), (8, 0), (9, 1), (10, 0), (11, 0), (12, 0)])
+        for version in (2, 8, 12):
+            self.assertEqual(self.store.get_entry_version(entry["id"], version)["snapshot"]["score"], version - 2)
+        self.assertEqual(len(self._version_rows(other["id"])), 1)
+
+        self.store.set_settings({"version_thin_daily": False})
+        self.assertEqual(self.store.compact_entry_versions()["deleted"], 4)
+        self.assertEqual([row[0] for row in self._version_rows(entry["id"])], [9, 10, 11, 12])
+        self.assertEqual(self.store.compact_entry_versions()["deleted"], 0)
+        with self.assertRaises(ValueError):
+            self.store.set_settings({"version_keep_last": -1})
+
+    def test_autocomplete_rejects_unknown_field(self):
+        with self.assertRaises(ValueError):
+            self.store.autocomplete("positive", "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
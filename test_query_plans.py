@@ -0,0 +1,110 @@
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import types
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.modules.setdefault(
+    "httpx",
+    types.SimpleNamespace(
+        AsyncHTTPTransport=object,
+        AsyncClient=object,
+        ConnectError=Exception,
+    ),
+)
+
+from ComfyUI_PromptVault.promptvault import query_plan
+from ComfyUI_PromptVault.promptvault.db import PromptVaultStore
+
+
+class _CorrelatedExistsStore(PromptVaultStore):
+    @staticmethod
+    def _entry_filters(status="active", tags=None, model="", favorite_only=False, has_thumbnail=False):
+        where = ["e.status = ?"]
+        params = [status]
+        for tag in tags or []:
+            where.append("EXISTS (SELECT 1 FROM entry_tags et WHERE et.entry_id = e.id AND et.tag = ?)")
+            params.append(tag)
+        return where, params
+
+
+class QueryPlanTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.store = PromptVaultStore(db_path=os.path.join(cls.tmpdir.name, "promptvault.db"))
+        for i in range(60):
+            cls.store.create_entry(
+                {
+                    "title": f"cinematic lighting {i}",
+                    "tags": ["portrait", "photo"] if i % 3 == 0 else ["风景"],
+                    "model_scope": ["SDXL" if i % 2 else "FLUX"],
+                    "raw": {"positive": f"少女, cinematic lighting, seed {i}", "negative": "lowres"},
+                    "thumbnail_png": b"\x89PNG fake" if i % 4 == 0 else None,
+                }
+            )
+        cls.conn = sqlite3.connect(cls.store.db_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls.tmpdir.cleanup()
+
+    def test_every_search_shape_uses_indexes(self):
+        report = query_plan.check_query_plans(self.conn)
+
+        self.assertGreater(len(report), 100)
+        self.assertIn("search:similar[status=active]", {item["name"] for item in report})
+        bad = {item["name"]: item["problems"] for item in report if item["problems"]}
+        self.assertEqual(bad, {})
+
+    def test_checker_flags_correlated_tag_lookup(self):
+        report = query_plan.check_query_plans(self.conn, store_cls=_CorrelatedExistsStore)
+
+        problems = [p for item in report for p in item["problems"]]
+        self.assertIn("index not used: idx_entry_tags_tag_entry", problems)
+
+    def test_find_plan_problems_reports_scans_and_temp_btrees(self):
+        details = ["SCAN e", "USE TEMP B-TREE FOR ORDER BY", "SCAN f VIRTUAL TABLE INDEX 0:M4"]
+
+        problems = query_plan.find_plan_problems(details)
+
+        self.assertEqual(problems, ["full scan: SCAN e", "temp b-tree: USE TEMP B-TREE FOR ORDER BY"])
+        self.assertEqual(query_plan.find_plan_problems(details[1:], allow_temp_btree=True), [])
+        # sort="similar" 只放行按距离排序的那一次临时 B 树
+        allowed = query_plan.SIMILAR_TEMP_BTREES
+        self.assertEqual(query_plan.find_plan_problems(details[1:], allowed_temp_btrees=allowed), [])
+        self.assertEqual(
+            query_plan.find_plan_problems(["USE TEMP B-TREE FOR GROUP BY"], allowed_temp_btrees=allowed),
+            ["temp b-tree: USE TEMP B-TREE FOR GROUP BY"],
+        )
+
+    def test_tag_and_model_filters_match_search_results(self):
+        items = self.store.search_entries(tags=["portrait"], model="SDXL", limit=100)
+        total = self.store.count_entries(tags=["portrait"], model="SDXL")
+
+        self.assertEqual(len(items), total)
+        self.assertEqual(total, 10)
+        for item in items:
+            self.assertIn("portrait", item["tags"])
+            self.assertIn("SDXL", item["model_scope"])
+
+    def test_main_reports_unmigrated_database(self):
+        path = os.path.join(self.tmpdir.name, "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE entries(id TEXT PRIMARY KEY, title TEXT, status TEXT, updated_at TEXT)")
+        conn.close()
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(query_plan.main(["--db", path]), 2)
+        self.assertIn("迁移", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -120,6 +120,88 @@ async function request(path, options = {}) {
   return await response.json();
 }
 
+// 调用带 stream=1 的长任务接口：逐行读取 NDJSON 事件，progress 事件交给 onProgress，
+// 返回 done 事件；error 事件抛出异常（附带最后一次进度，便于续传）。
+async function requestStream(path, options = {}, onProgress = null) {
+  const response = await fetch(`/promptvault${path}`, options);
+  if (!response.ok) {
+    const text = await response.text();
+    let message = text;
+    try {
+      message = JSON.parse(text).error || text;
+    } catch (_error) {
+      message = text;
+    }
+    throw new Error(`${response.status}: ${message}`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+  let last = null;
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffered.split("\n");
+    buffered = lines.pop();
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const event = JSON.parse(line);
+      if (event.event === "progress") {
+        last = event;
+        onProgress?.(event);
+      } else if (event.event === "done") {
+        return event;
+      } else if (event.event === "error") {
+        const error = new Error(event.error);
+        error.progress = last;
+        throw error;
+      }
+    }
+    if (done) {
+      const error = new Error("连接中断");
+      error.progress = last;
+      throw error;
+    }
+  }
+}
+
+let _datalistSeq = 0;
+// 给输入框挂上服务端前缀补全：防抖后请求 /autocomplete，结果写入 <datalist>。
+// multi=true 时按逗号列表处理，只补全最后一项并保留前面已输入的值。
+function attachAutocomplete(input, field, { multi = false, limit = 10, delay = 150 } = {}) {
+  const listId = `pv-ac-${field}-${++_datalistSeq}`;
+  const datalist = create("datalist", { id: listId });
+  input.setAttribute("list", listId);
+  input.setAttribute("autocomplete", "off");
+  let timer = null;
+  let seq = 0;
+  input.addEventListener("input", () => {
+    if (!datalist.isConnected) input.after(datalist);
+    clearTimeout(timer);
+    timer = setTimeout(async () => {
+      const raw = input.value || "";
+      const parts = multi ? raw.replace(/[，、]/g, ",").split(",") : [raw];
+      const prefix = parts[parts.length - 1].trim();
+      const head = multi ? parts.slice(0, -1).map((x) => x.trim()).filter(Boolean) : [];
+      const current = ++seq;
+      try {
+        const params = new URLSearchParams({ field, q: prefix, limit: String(limit) });
+        const res = await request(`/autocomplete?${params.toString()}`);
+        if (current !== seq) return;
+        datalist.textContent = "";
+        (res.items || []).forEach((item) => {
+          if (head.includes(item.value)) return;
+          const value = multi ? [...head, item.value].join(",") : item.value;
+          datalist.appendChild(create("option", { value, label: `${item.value} (${item.count})` }));
+        });
+      } catch (_error) {
+        datalist.textContent = "";
+      }
+    }, delay);
+  });
+  return datalist;
+}
+
 function getNodeWidget(node, name) {
   return node?.widgets?.find((widget) => widget.name === name) || null;
 }
@@ -201,13 +283,18 @@ function buildPreviewSummary(entry, assembled, extra = {}) {
     updated_at: entry?.updated_at || "",
     positive: assembled?.positive || entry?.raw?.positive || "",
     negative: assembled?.negative || entry?.raw?.negative || "",
-    thumbnail_url: entry?.id ? thumbUrl(entry.id, entry?.updated_at || "") : "",
+    thumbnail_url: entry?.id ? thumbUrl(entry.id, entry?.thumbnail_hash || "", THUMB_SIZE_DETAIL) : "",
     match_source: extra.match_source || "matched",
   };
 }
 
+// 详情 / 编辑只取元数据，缩略图走带哈希、可长期缓存的 /thumbnail URL，不内联 base64
+function fetchEntry(entryId) {
+  return request(`/entries/${encodeURIComponent(entryId)}?inline_thumbnail=0`);
+}
+
 async function fetchPreviewEntryById(entryId, extra = {}) {
-  const full = await request(`/entries/${encodeURIComponent(entryId)}`);
+  const full = await fetchEntry(entryId);
   const assembled = await request("/assemble", {
     method: "POST",
     body: JSON.stringify({ entry_id: entryId, variables_override: {} }),
@@ -488,9 +575,122 @@ function injectLegacyMenuButton(openFn) {
   return true;
 }
 
-function thumbUrl(itemId, updatedAt) {
-  const v = updatedAt ? encodeURIComponent(updatedAt) : "0";
-  return `/promptvault/entries/${encodeURIComponent(itemId)}/thumbnail?v=${v}`;
+// 缩略图按显示宽度取副本：列表 96，卡片 256，详情 / 预览 512（服务端按 Accept 返回 WebP 或 PNG）
+const THUMB_SIZE_LIST = 96;
+const THUMB_SIZE_CARD = 256;
+const THUMB_SIZE_DETAIL = 512;
+
+// 以缩略图内容哈希寻址：哈希不变 URL 就不变，浏览器按 immutable 缓存；编辑其它字段不会让缓存失效。
+// 尚未回填哈希的旧记录不带 h，由 ETag 重新验证。
+function thumbUrl(itemId, thumbHash, size = THUMB_SIZE_CARD) {
+  const h = thumbHash ? `&h=${encodeURIComponent(thumbHash)}` : "";
+  return `/promptvault/entries/${encodeURIComponent(itemId)}/thumbnail?size=${size}${h}`;
+}
+
+// 一页结果的缩略图通过 /thumbnails/batch 一次取回（长度前缀二进制包），解出的图片以
+// object URL 缓存在内存里，键为 id + 内容哈希 + 尺寸；超出上限时淘汰最早的并释放 URL。
+const THUMB_BATCH_LIMIT = 200;
+const THUMB_OBJECT_URL_LIMIT = 800;
+const thumbObjectUrls = new Map();
+
+function thumbCacheKey(item, size) {
+  return item?.thumbnail_hash ? `${item.id}:${item.thumbnail_hash}:${size}` : "";
+}
+
+function rememberThumbObjectUrl(key, url) {
+  thumbObjectUrls.set(key, url);
+  while (thumbObjectUrls.size > THUMB_OBJECT_URL_LIMIT) {
+    const [oldKey, oldUrl] = thumbObjectUrls.entries().next().value;
+    thumbObjectUrls.delete(oldKey);
+    URL.revokeObjectURL(oldUrl);
+  }
+}
+
+function parseThumbBundle(buffer) {
+  const view = new DataView(buffer);
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+  if (magic !== "PVT1") throw new Error("invalid thumbnail bundle");
+  const headerLength = view.getUint32(4);
+  const manifest = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  const dataStart = 8 + headerLength;
+  const images = new Map();
+  for (const entry of manifest.items || []) {
+    const start = dataStart + entry.offset;
+    images.set(entry.id, new Blob([buffer.slice(start, start + entry.length)], { type: entry.type }));
+  }
+  return images;
+}
+
+// 列表接口内联的占位图（十几像素宽的 WebP + 平均色）先模糊显示，真正的缩略图到达后替换
+function showThumbPlaceholder(img, item) {
+  if (item.placeholder_color) img.style.backgroundColor = item.placeholder_color;
+  if (item.placeholder) {
+    img.src = item.placeholder;
+    img.classList.add("pv-thumb-placeholder");
+  }
+}
+
+function setThumbSrc(img, url) {
+  if (img.classList.contains("pv-thumb-placeholder")) {
+    img.onload = () => {
+      img.classList.remove("pv-thumb-placeholder");
+      img.style.backgroundColor = "";
+      img.onload = null;
+    };
+  }
+  img.src = url;
+}
+
+// pending: [{ img, item, size }]；没有缩略图的条目直接触发 img.onerror。有缓存的直接复用，没有内容哈希的逐张走
+// thumbUrl，其余按尺寸分组批量获取；批量请求失败时退回逐张的 thumbUrl。
+async function hydrateThumbnails(pending) {
+  const groups = new Map();
+  for (const task of pending) {
+    if (!task.item?.has_thumbnail) {
+      task.img.onerror?.();
+      continue;
+    }
+    const key = thumbCacheKey(task.item, task.size);
+    const cached = key && thumbObjectUrls.get(key);
+    if (cached) {
+      task.img.src = cached;
+      continue;
+    }
+    showThumbPlaceholder(task.img, task.item);
+    if (!key) {
+      // 没有内容哈希就没有缓存键，批量取回的 object URL 无处登记、永远不会被回收，改走逐张的 thumbUrl
+      setThumbSrc(task.img, thumbUrl(task.item.id, task.item.thumbnail_hash, task.size));
+      continue;
+    }
+    if (!groups.has(task.size)) groups.set(task.size, []);
+    groups.get(task.size).push(task);
+  }
+  for (const [size, tasks] of groups) {
+    for (let start = 0; start < tasks.length; start += THUMB_BATCH_LIMIT) {
+      const chunk = tasks.slice(start, start + THUMB_BATCH_LIMIT);
+      try {
+        const response = await fetch("/promptvault/thumbnails/batch", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ ids: chunk.map((task) => task.item.id), size, formats: ["webp", "png"] }),
+        });
+        if (!response.ok) throw new Error(`${response.status}`);
+        const images = parseThumbBundle(await response.arrayBuffer());
+        for (const task of chunk) {
+          const blob = images.get(task.item.id);
+          if (!blob) {
+            task.img.onerror?.();
+            continue;
+          }
+          const url = URL.createObjectURL(blob);
+          rememberThumbObjectUrl(thumbCacheKey(task.item, size), url);
+          setThumbSrc(task.img, url);
+        }
+      } catch (_error) {
+        for (const task of chunk) setThumbSrc(task.img, thumbUrl(task.item.id, task.item.thumbnail_hash, size));
+      }
+    }
+  }
 }
 
 function openManager() {
@@ -507,6 +707,8 @@ function openManager() {
   const inputQuery = create("input", { class: "pv-input", placeholder: "\u5173\u952e\u8bcd\uff08\u6807\u9898/\u5185\u5bb9/\u6807\u7b7e\uff09" });
   const inputTags = create("input", { class: "pv-input", placeholder: "\u6807\u7b7e\uff08\u9017\u53f7\u5206\u9694\uff0c\u53ef\u9009\uff09" });
   const inputModel = create("input", { class: "pv-input", placeholder: "\u6a21\u578b\uff08\u5982 SDXL / Flux\uff0c\u53ef\u9009\uff09" });
+  attachAutocomplete(inputTags, "tag", { multi: true });
+  attachAutocomplete(inputModel, "model");
   const selectStatus = create(
     "select",
     { class: "pv-input pv-select-status", title: "\u72b6\u6001" },
@@ -520,7 +722,7 @@ function openManager() {
   const buttonNew = create("button", { class: "pv-btn", text: "\u65b0\u5efa" });
   const buttonExportCsv = create("button", { class: "pv-btn", text: "\u5bfc\u51fa CSV" });
   const buttonImport = create("button", { class: "pv-btn", text: "\u5bfc\u5165" });
-  const importInput = create("input", { type: "file", accept: ".json,.csv,application/json,text/csv" });
+  const importInput = create("input", { type: "file", accept: ".json,.ndjson,.jsonl,.csv,.gz,application/json,text/csv" });
   importInput.style.display = "none";
   const buttonLLMSettings = create("button", { class: "pv-btn", text: "LLM \u8bbe\u7f6e" });
   const buttonToggleSidebar = create("button", { class: "pv-btn", text: "\u6807\u7b7e\u680f" });
@@ -609,6 +811,8 @@ function openManager() {
     has_thumbnail: false,
   };
   let currentSort = "updated_desc";
+  // sort=similar 的参考记录，由详情里的“找相似”设置
+  let similarTo = "";
   let currentViewMode = "card_compact";
   let minimizedDock = null;
 
@@ -657,58 +861,64 @@ function openManager() {
 
   async function downloadExport(format) {
     const upper = format.toUpperCase();
-    setStatus(`正在导出 ${upper}...`);
-    try {
-      const response = await fetch(`/promptvault/export?format=${encodeURIComponent(format)}`);
-      if (!response.ok) {
-        throw new Error(await response.text());
-      }
-      const blob = await response.blob();
-      const url = URL.createObjectURL(blob);
-      const anchor = document.createElement("a");
-      const dispo = response.headers.get("Content-Disposition") || "";
-      const match = dispo.match(/filename="?([^"]+)"?/i);
-      anchor.href = url;
-      anchor.download = match?.[1] || `promptvault-export.${format}`;
-      document.body.appendChild(anchor);
-      anchor.click();
-      anchor.remove();
-      URL.revokeObjectURL(url);
-      toast(`${upper} 导出完成`, "success");
-      setStatus(`${upper} 导出完成`);
-    } catch (error) {
-      toast(`导出失败: ${error}`, "error");
-      setStatus(`导出失败: ${error}`);
+    // 直接交给浏览器下载：服务端按块流式输出，浏览器边收边写盘，不在页面里攒成一个 Blob
+    const anchor = document.createElement("a");
+    anchor.href = `/promptvault/export?format=${encodeURIComponent(format)}`;
+    anchor.download = "";
+    document.body.appendChild(anchor);
+    anchor.click();
+    anchor.remove();
+    // 页面拿不到下载结果（服务端出错时浏览器只会在下载列表里显示失败），这里只提示已发起请求
+    const message = `已请求 ${upper} 导出，请在浏览器下载列表中查看进度`;
+    toast(message, "info");
+    setStatus(message);
+  }
+
+  function importProgressText(info) {
+    const percent = info.total_bytes ? ` ${Math.min(100, Math.round((info.bytes_read / info.total_bytes) * 100))}%` : "";
+    return `已处理 ${info.records || 0} 条${percent}，创建 ${info.created || 0}，更新 ${info.updated || 0}，错误 ${info.error_count || 0}`;
+  }
+
+  async function runImport(path, options, label) {
+    const result = await requestStream(path, options, (info) => setStatus(`正在导入 ${label}：${importProgressText(info)}`, "merge"));
+    const summary = `创建 ${result.created || 0}，更新 ${result.updated || 0}，跳过 ${result.skipped || 0}，错误 ${result.error_count || 0}`;
+    toast(`导入完成: ${summary}`, result.error_count ? "info" : "success", 5000);
+    setStatus(`导入完成: ${summary}`);
+    if ((result.errors || []).length) {
+      const brief = result.errors.slice(0, 5).map((item) => `${item.record_type}/${item.id}: ${item.error}`).join("\n");
+      alert(`导入结果\n\n${summary}\n\n错误明细:\n${brief}`);
+    } else {
+      alert(`导入结果\n\n${summary}`);
     }
   }
 
   async function uploadImport(file) {
     const name = file?.name || "";
     if (!file) return;
-    const format = name.toLowerCase().endsWith(".csv") ? "csv" : "json";
+    // 格式由服务端按文件名和内容判断（json / ndjson / csv，可为 .gz）
     const formData = new FormData();
-    formData.append("file", file);
-    formData.append("format", format);
     formData.append("conflict_strategy", "merge");
-    setStatus(`正在导入 ${name}...`, "merge");
+    formData.append("file", file);
+    setStatus(`正在上传 ${name}...`, "merge");
     try {
-      const result = await request("/import", { method: "POST", body: formData });
-      const summary = `创建 ${result.created || 0}，更新 ${result.updated || 0}，跳过 ${result.skipped || 0}，错误 ${(result.errors || []).length}`;
-      toast(`导入完成: ${summary}`, (result.errors || []).length ? "info" : "success", 5000);
-      setStatus(`导入完成: ${summary}`);
-      if ((result.errors || []).length) {
-        const brief = result.errors.slice(0, 5).map((item) => `${item.record_type}/${item.id}: ${item.error}`).join("\n");
-        alert(`导入结果\n\n${summary}\n\n错误明细:\n${brief}`);
-      } else {
-        alert(`导入结果\n\n${summary}`);
-      }
-      await loadTags();
-      await reloadList();
+      await runImport("/import?stream=1", { method: "POST", body: formData }, name);
     } catch (error) {
+      // 已提交的批次不会回滚；导入任务留有断点时可以从断点继续
+      const importId = error.progress?.import_id;
       toast(`导入失败: ${error}`, "error", 5000);
       setStatus(`导入失败: ${error}`);
+      if (importId && confirm(`导入在第 ${error.progress.records || 0} 条后中断：${error.message}\n\n是否从断点继续导入？`)) {
+        try {
+          await runImport(`/imports/${encodeURIComponent(importId)}/resume?stream=1`, { method: "POST" }, name);
+        } catch (retryError) {
+          toast(`导入失败: ${retryError}`, "error", 5000);
+          setStatus(`导入失败: ${retryError}`);
+        }
+      }
     } finally {
       importInput.value = "";
+      await loadTags();
+      await reloadList();
     }
   }
 
@@ -737,6 +947,7 @@ function openManager() {
       create("option", { value: "updated_desc", text: "最近更新" }),
       create("option", { value: "score_desc", text: "评分优先" }),
       create("option", { value: "favorite_desc", text: "收藏优先" }),
+      create("option", { value: "similar", text: "外观相似", hidden: true }),
     ],
   );
   resultControls.appendChild(create("div", { class: "pv-filter-chip-row" }, [
@@ -766,6 +977,7 @@ function openManager() {
     viewList.classList.toggle("pv-filter-chip-active", currentViewMode === "list");
     viewCardCompact.classList.toggle("pv-filter-chip-active", currentViewMode === "card_compact");
     viewThumbnailCard.classList.toggle("pv-filter-chip-active", currentViewMode === "card_thumbnail");
+    sortSelect.options[3].hidden = !similarTo;
     sortSelect.value = currentSort;
   }
 
@@ -789,6 +1001,7 @@ function openManager() {
     const sortLabel =
       currentSort === "score_desc" ? "评分优先" :
       currentSort === "favorite_desc" ? "收藏优先" :
+      currentSort === "similar" ? "外观相似" :
       "最近更新";
     statusBarLeft.textContent = `共 ${total} 条记录`
       + (total ? ` · 显示 ${start}-${end}` : "")
@@ -856,8 +1069,10 @@ function openManager() {
     }
     if (!confirm("\u786e\u5b9a\u6e05\u7a7a\u56de\u6536\u7ad9\uff1f\u6b64\u64cd\u4f5c\u4e0d\u53ef\u64a4\u56de\u3002")) return;
     try {
-      await request("/entries/purge_deleted", { method: "POST", body: JSON.stringify({}) });
-      toast("\u56de\u6536\u7ad9\u5df2\u6e05\u7a7a", "success");
+      const result = await request("/entries/purge_deleted", { method: "POST", body: JSON.stringify({}) });
+      const reclaimed = result?.vacuum?.reclaimed_bytes || 0;
+      const freed = reclaimed ? `\uff0c\u91ca\u653e ${(reclaimed / 1048576).toFixed(1)} MB` : "";
+      toast(`\u56de\u6536\u7ad9\u5df2\u6e05\u7a7a\uff08${result?.deleted ?? 0} \u6761${freed}\uff09`, "success");
       await reloadList();
     } catch (error) {
       toast(`\u6e05\u7a7a\u56de\u6536\u7ad9\u5931\u8d25: ${error}`, "error");
@@ -928,7 +1143,7 @@ function openManager() {
         try {
           if (!confirm("\u5c06\u5220\u9664\u6ca1\u6709\u4efb\u4f55\u8bb0\u5f55\u5f15\u7528\u7684\u6807\u7b7e\uff0c\u5e76\u8865\u5145\u7f3a\u5931\u7684\u6807\u7b7e\u8bb0\u5f55\u3002\u786e\u5b9a\u7ee7\u7eed\uff1f")) return;
           const result = await request("/tags/tidy", { method: "POST", body: JSON.stringify({}) });
-          toast(`\u6574\u7406\u5b8c\u6210\uff1a\u5220\u9664 ${result.removed || 0} \u4e2a\u65e0\u7528\u6807\u7b7e\uff0c\u65b0\u589e ${result.added || 0} \u4e2a\u6807\u7b7e\u3002`, "success");
+          toast(`\u6574\u7406\u5b8c\u6210\uff1a\u5220\u9664 ${result.removed || 0} \u4e2a\u65e0\u7528\u6807\u7b7e\uff0c\u65b0\u589e ${result.added || 0} \u4e2a\u6807\u7b7e\uff0c\u4fee\u6b63 ${result.fixed || 0} \u4e2a\u5f15\u7528\u8ba1\u6570\u3002`, "success");
           await loadTags();
         } catch (e) {
           toast(`\u6574\u7406\u6807\u7b7e\u5931\u8d25: ${e}`, "error");
@@ -953,15 +1168,13 @@ function openManager() {
 
       const tagListContainer = create("div", { class: "pv-sidebar-list" });
 
-      function renderTagItems(filter) {
+      function renderTagItems(tagItems, kw) {
         tagListContainer.textContent = "";
         tagListContainer.appendChild(allRow);
-        const kw = (filter || "").trim().toLowerCase();
         let count = 0;
-        items.forEach((t) => {
+        tagItems.forEach((t) => {
           const name = t.name || "";
           if (!name) return;
-          if (kw && !name.toLowerCase().includes(kw)) return;
           count++;
           const row = create("div", { class: "pv-sidebar-item", text: name });
           if (name === selectedTag) row.classList.add("pv-sidebar-item-active");
@@ -979,12 +1192,33 @@ function openManager() {
         }
       }
 
-      tagSearchInput.addEventListener("input", () => renderTagItems(tagSearchInput.value));
+      // 关键词交给服务端按前缀匹配，不再在预加载的前 200 个标签里做客户端过滤。
+      let tagSearchTimer = null;
+      let tagSearchSeq = 0;
+      tagSearchInput.addEventListener("input", () => {
+        clearTimeout(tagSearchTimer);
+        tagSearchTimer = setTimeout(async () => {
+          const kw = tagSearchInput.value.trim();
+          const current = ++tagSearchSeq;
+          if (!kw) {
+            renderTagItems(items, "");
+            return;
+          }
+          try {
+            const params = new URLSearchParams({ field: "tag", q: kw, limit: "50" });
+            const res = await request(`/autocomplete?${params.toString()}`);
+            if (current !== tagSearchSeq) return;
+            renderTagItems((res.items || []).map((t) => ({ name: t.value, count: t.count })), kw);
+          } catch (e) {
+            if (current === tagSearchSeq) toast(`\u6807\u7b7e\u641c\u7d22\u5931\u8d25: ${e}`, "error");
+          }
+        }, 150);
+      });
 
       sidebar.appendChild(headerRow);
       sidebar.appendChild(tagSearchInput);
       sidebar.appendChild(tagListContainer);
-      renderTagItems("");
+      renderTagItems(items, "");
     } catch (e) {
       sidebar.textContent = "";
       sidebar.appendChild(create("div", { class: "pv-empty", text: `\u6807\u7b7e\u52a0\u8f7d\u5931\u8d25: ${e}` }));
@@ -1060,7 +1294,7 @@ function openManager() {
     const thumb = create("img", {
       class: "pv-thumb",
       alt: "thumbnail",
-      src: entry.thumbnail_data_url || thumbUrl(entry.id, entry.updated_at),
+      src: entry.thumbnail_data_url || thumbUrl(entry.id, entry.thumbnail_hash, THUMB_SIZE_DETAIL),
     });
     const thumbFallback = create("div", { class: "pv-empty pv-thumb-empty", text: "\u6682\u65e0\u7f29\u7565\u56fe" });
     thumb.onerror = () => {
@@ -1090,10 +1324,24 @@ function openManager() {
     scoreSelect.value = String(currentScore);
     scoreSelect.style.display = "none";
     const scoreStars = create("div", { class: "pv-detail-stars", title: "评分" });
+    const similarButton = create("button", {
+      class: "pv-btn pv-small",
+      text: "找相似",
+      title: "按缩略图外观排序结果列表",
+    });
+    similarButton.style.display = entry.has_thumbnail ? "" : "none";
+    similarButton.addEventListener("click", () => {
+      similarTo = entry.id;
+      currentSort = "similar";
+      refreshQuickFilterUI();
+      resetPagination();
+      reloadList().catch((e) => toast(String(e), "error"));
+    });
     const detailActions = create("div", { class: "pv-detail-actions" }, [
       favoriteButton,
       scoreStars,
       scoreSelect,
+      similarButton,
     ]);
     const topRight = create("div", { class: "pv-detail-top-right" }, [
       headerRow,
@@ -1105,14 +1353,13 @@ function openManager() {
     const refreshDetailMeta = async (patch) => {
       try {
         await request(`/entries/${encodeURIComponent(entry.id)}`, {
-          method: "PUT",
+          method: "PATCH",
           body: JSON.stringify({
             ...patch,
             version: entry.version,
-            updated_at: entry.updated_at,
           }),
         });
-        const full = await request(`/entries/${encodeURIComponent(entry.id)}`);
+        const full = await fetchEntry(entry.id);
         full.match_reasons = entry.match_reasons || [];
         const freshAssembled = await request("/assemble", {
           method: "POST",
@@ -1237,6 +1484,8 @@ function openManager() {
     const btnAiTitleTags = create("button", { class: "pv-btn pv-ai-tag-btn", text: "AI \u6807\u9898+\u6807\u7b7e" });
     const titleRow = create("div", { class: "pv-tags-row" }, [fieldTitle, btnAiTitle, btnAiTitleTags]);
     const tagsRow = create("div", { class: "pv-tags-row" }, [fieldTags, btnAiTag]);
+    attachAutocomplete(fieldTitle, "title");
+    attachAutocomplete(fieldTags, "tag", { multi: true });
     const aiButtons = [btnAiTitle, btnAiTag, btnAiTitleTags];
     let aiButtonsAvailable = false;
 
@@ -1397,6 +1646,7 @@ function openManager() {
       placeholder: "\u6a21\u578b\u8303\u56f4\uff08\u9017\u53f7\u5206\u9694\uff09",
       value: (entry?.model_scope || []).join(","),
     });
+    attachAutocomplete(fieldModel, "model", { multi: true });
     const fieldPos = create("textarea", { class: "pv-textarea", placeholder: "\u6b63\u5411\u63d0\u793a\u8bcd\uff08raw\uff0c\u652f\u6301 {name}\uff09" });
     const fieldNeg = create("textarea", { class: "pv-textarea", placeholder: "\u8d1f\u5411\u63d0\u793a\u8bcd\uff08raw\uff0c\u652f\u6301 {name}\uff09" });
     const fieldVars = create("textarea", {
@@ -1444,8 +1694,8 @@ function openManager() {
       thumbDropZone, btnClearThumb,
     ]);
 
-    if (entry?.thumbnail_data_url) {
-      thumbPreview.src = entry.thumbnail_data_url;
+    if (entry?.thumbnail_data_url || entry?.has_thumbnail) {
+      thumbPreview.src = entry.thumbnail_data_url || thumbUrl(entry.id, entry.thumbnail_hash, THUMB_SIZE_DETAIL);
       thumbPreview.style.display = "block";
       thumbPlaceholder.style.display = "none";
       btnClearThumb.style.display = "";
@@ -1659,6 +1909,7 @@ function openManager() {
     params.set("limit", String(pageLimit));
     params.set("offset", String(currentOffset));
     params.set("sort", currentSort);
+    if (currentSort === "similar" && similarTo) params.set("similar_to", similarTo);
     if (quickFilters.favorite_only) params.set("favorite_only", "true");
     if (quickFilters.has_thumbnail) params.set("has_thumbnail", "true");
 
@@ -1724,7 +1975,7 @@ function openManager() {
 
     const openEditorForItem = async (item) => {
       try {
-        const full = await request(`/entries/${encodeURIComponent(item.id)}`);
+        const full = await fetchEntry(item.id);
         openEditor(full);
       } catch (error) {
         toast(`加载编辑数据失败: ${error}`, "error");
@@ -1736,7 +1987,7 @@ function openManager() {
         if (currentStatus === "deleted") {
           if (!confirm("确定还原记录？")) return;
           await request(`/entries/${encodeURIComponent(item.id)}`, {
-            method: "PUT",
+            method: "PATCH",
             body: JSON.stringify({ status: "active", updated_at: item.updated_at }),
           });
           toast("记录已还原", "success");
@@ -1753,7 +2004,7 @@ function openManager() {
 
     const selectSummaryItem = async (item, element, activeClass) => {
       try {
-        const full = await request(`/entries/${encodeURIComponent(item.id)}`);
+        const full = await fetchEntry(item.id);
         full.match_reasons = item.match_reasons || [];
         const assembled = await request("/assemble", {
           method: "POST",
@@ -1773,6 +2024,7 @@ function openManager() {
       }
     };
 
+    const pendingThumbs = [];
     for (const item of result.items) {
       const rowIndex = currentOffset + list.childElementCount + 1;
       const buttonCopy = create("button", { class: "pv-btn pv-small pv-icon-btn", text: "⧉", title: "复制正向提示词" });
@@ -1784,7 +2036,7 @@ function openManager() {
       });
       buttonCopy.addEventListener("click", async () => {
         try {
-          const full = await request(`/entries/${encodeURIComponent(item.id)}`);
+          const full = await fetchEntry(item.id);
           await copyTextToClipboard(full?.raw?.positive || "");
           toast("已复制正向提示词", "success", 1500);
         } catch (error) {
@@ -1801,9 +2053,9 @@ function openManager() {
         const thumb = create("img", {
           class: "pv-row-thumb",
           alt: "thumbnail",
-          src: thumbUrl(item.id, item.updated_at),
         });
         thumb.onerror = () => { thumb.style.display = "none"; };
+        pendingThumbs.push({ img: thumb, item, size: THUMB_SIZE_LIST });
         const subText = [
           (item.tags || []).join(", "),
           formatTimestamp(item.updated_at),
@@ -1832,11 +2084,11 @@ function openManager() {
         const thumb = create("img", {
           class: "pv-card-thumb pv-thumb-card-thumb",
           alt: "thumbnail",
-          src: thumbUrl(item.id, item.updated_at),
         });
         thumb.onerror = () => {
           thumb.replaceWith(create("div", { class: "pv-card-thumb pv-card-thumb-empty pv-thumb-card-thumb", text: "暂无缩略图" }));
         };
+        pendingThumbs.push({ img: thumb, item, size: THUMB_SIZE_CARD });
         const copyIcon = create("button", {
           class: "pv-btn pv-small pv-icon-btn pv-thumb-card-copy",
           text: "⧉",
@@ -1845,7 +2097,7 @@ function openManager() {
         copyIcon.addEventListener("click", async (event) => {
           event.stopPropagation();
           try {
-            const full = await request(`/entries/${encodeURIComponent(item.id)}`);
+            const full = await fetchEntry(item.id);
             await copyTextToClipboard(full?.raw?.positive || "");
             toast("已复制正向提示词", "success", 1500);
           } catch (error) {
@@ -1869,11 +2121,11 @@ function openManager() {
       const thumb = create("img", {
         class: "pv-card-thumb",
         alt: "thumbnail",
-        src: thumbUrl(item.id, item.updated_at),
       });
       thumb.onerror = () => {
         thumb.replaceWith(create("div", { class: "pv-card-thumb pv-card-thumb-empty", text: "暂无缩略图" }));
       };
+      pendingThumbs.push({ img: thumb, item, size: THUMB_SIZE_CARD });
       const tags = item.tags || [];
       const tagWrap = create("div", { class: "pv-card-tags" }, tags.map((tag) => create("span", { class: "pv-card-tag", text: tag })));
       const modelText = (item.model_scope || []).join(" / ") || "不限模型";
@@ -1915,6 +2167,7 @@ function openManager() {
       });
       list.appendChild(card);
     }
+    hydrateThumbnails(pendingThumbs);
 
     const preferredItem = currentViewMode === "list"
       ? (result.items.find((item) => item.id === selectedCardId) || result.items[0])
@@ -1922,7 +2175,7 @@ function openManager() {
     if (preferredItem?.id) {
       try {
         selectedCardId = preferredItem.id;
-        const full = await request(`/entries/${encodeURIComponent(preferredItem.id)}`);
+        const full = await fetchEntry(preferredItem.id);
         full.match_reasons = preferredItem.match_reasons || [];
         const assembled = await request("/assemble", {
           method: "POST",